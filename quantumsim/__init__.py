@@ -3,8 +3,6 @@ from ._version import __version__
 from . import pauli_vectors, bases
 from .operations.operation import Operation
 
-PauliVector = pauli_vectors.Default
-
 __all__ = [
     'bases',
     'pauli_vectors',
@@ -13,6 +11,15 @@ __all__ = [
 ]
 
 
+def __getattr__(name):
+    # Default backend is selected on first use, see
+    # `quantumsim.pauli_vectors.registry`
+    if name == 'PauliVector':
+        return pauli_vectors.get_backend()
+    raise AttributeError('module {!r} has no attribute {!r}'
+                         .format(__name__, name))
+
+
 def test(verbose=True):
     from pytest import main
     from os.path import dirname, abspath, join
@@ -1,4 +1,5 @@
-from .algebra import kraus_to_ptm, ptm_convert_basis, dm_to_pv, pv_to_dm
+from .algebra import kraus_to_ptm, ptm_convert_basis, dm_to_pv, pv_to_dm, \
+    ptm_structure, PTMStructure
 from . import tools
 
 __all__ = [
@@ -6,5 +7,7 @@ __all__ = [
     'ptm_convert_basis',
     'dm_to_pv',
     'pv_to_dm',
+    'ptm_structure',
+    'PTMStructure',
     'tools',
 ]
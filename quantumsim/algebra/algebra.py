@@ -1,4 +1,5 @@
 import numpy as np
+from collections import namedtuple
 from functools import reduce, lru_cache
 from itertools import chain
 
@@ -9,24 +10,43 @@ def bases_kron(bases):
 
 
 def kraus_to_ptm(kraus, bases_in, bases_out):
+    """Convert a set of Kraus operators to a Pauli transfer matrix.
+
+    Parameters
+    ----------
+    kraus : array
+        Kraus operators of shape `(num_kraus, dim, dim)`. Extra leading axes
+        are treated as batch (parameter) axes and are kept in the result.
+    bases_in : tuple of quantumsim.bases.PauliBasis
+        Input bases of the PTM.
+    bases_out : tuple of quantumsim.bases.PauliBasis
+        Output bases of the PTM.
+
+    Returns
+    -------
+    array
+    """
     dim = bases_in[0].dim_hilbert
     nq = len(bases_in)
     if nq != len(bases_out):
         raise ValueError("Input and output bases must contain the same number"
                          " of elements")
-    kraus = kraus.reshape([kraus.shape[0]] + [dim] * (2 * nq))
+    batch_shape = kraus.shape[:-3]
+    kraus = kraus.reshape(batch_shape + (kraus.shape[-3],) +
+                          (dim,) * (2 * nq))
     einsum_args = []
     for i, b in enumerate(bases_out):
         einsum_args.append(b.vectors)
         einsum_args.append([4 * nq + i, 2 * i, 2 * i + 1])
     einsum_args.append(kraus)
-    einsum_args.append([6 * nq] + [2 * i + 1 for i in range(2 * nq)])
+    einsum_args.append([Ellipsis, 6 * nq] +
+                       [2 * i + 1 for i in range(2 * nq)])
     for i, b in enumerate(bases_in):
         einsum_args.append(b.vectors)
         einsum_args.append([5 * nq + i, 2 * (i + nq) + 1, 2 * (i + nq)])
     einsum_args.append(kraus.conj())
-    einsum_args.append([6 * nq] + [2 * i for i in range(2 * nq)])
-    einsum_args.append([4 * nq + i for i in range(2 * nq)])
+    einsum_args.append([Ellipsis, 6 * nq] + [2 * i for i in range(2 * nq)])
+    einsum_args.append([Ellipsis] + [4 * nq + i for i in range(2 * nq)])
     return np.einsum(*einsum_args, optimize=True).real
 
 
@@ -34,32 +54,200 @@ def ptm_convert_basis(ptm, bi_old, bo_old, bi_new, bo_new):
     shape = tuple(b.dim_pauli for b in chain(bo_new, bi_new))
     d_in = np.prod([b.dim_pauli for b in bi_old])
     d_out = np.prod([b.dim_pauli for b in bo_old])
-    return np.einsum("xij, yji, yz, zkl, wlk -> xw",
+    batch_shape = ptm.shape[:len(ptm.shape) - len(shape)]
+    return np.einsum("xij, yji, ...yz, zkl, wlk -> ...xw",
                      bases_kron(bo_new), bases_kron(bo_old),
-                     ptm.reshape((d_out, d_in)),
+                     ptm.reshape(batch_shape + (d_out, d_in)),
                      bases_kron(bi_old), bases_kron(bi_new),
-                     optimize=True).real.reshape(shape)
+                     optimize=True).real.reshape(batch_shape + shape)
+
 
+def dm_to_pv(dm, bases, *, out=None):
+    """Convert density matrices to Pauli vectors.
+
+    The conversion is done as a sequence of contractions over one qubit at a
+    time, so that no intermediate array is much larger than the input. Large
+    density matrices (for example, memory-mapped ones, that do not fit into
+    RAM) are read in blocks, that span all values of the trailing qubits.
+
+    Parameters
+    ----------
+    dm : array
+        Density matrix of shape `(D, D)` or `(d_0, ..., d_N, d_0, ..., d_N)`,
+        where `d_i` is Hilbert dimensionality of the qubit `i` and `D` is
+        their product. Extra leading axes are treated as batch axes and are
+        kept in the result.
+    bases : list of quantumsim.bases.PauliBasis
+        Bases of the qubits.
+    out : array or None
+        Real array of shape `batch_shape + (dim_pauli_0, ..., dim_pauli_N)`
+        to write the result to (may be a memory-mapped array).
 
-def dm_to_pv(dm, bases):
+    Returns
+    -------
+    array
+    """
+    dims = [b.dim_hilbert for b in bases]
     n_qubits = len(bases)
-    d = bases[0].dim_hilbert
-    einsum_args = [dm.reshape((d,) * (2 * n_qubits)),
-                   list(range(2 * n_qubits))]
-    for i, b in enumerate(bases):
-        einsum_args.append(b.vectors),
-        einsum_args.append([2 * n_qubits + i, i + n_qubits, i])
-    return np.einsum(*einsum_args, optimize=True).real
+    dim = int(np.prod(dims))
+    if dm.ndim >= 2 * n_qubits and dm.shape[dm.ndim - 2 * n_qubits:] == \
+            tuple(dims) * 2:
+        batch_shape = dm.shape[:dm.ndim - 2 * n_qubits]
+    elif dm.ndim >= 2 and dm.shape[-2:] == (dim, dim):
+        batch_shape = dm.shape[:-2]
+    else:
+        raise ValueError(
+            'Shape of the density matrix {} does not match the bases with '
+            'Hilbert dimensions {}'.format(dm.shape, tuple(dims)))
+    batch_size = int(np.prod(batch_shape))
+    dm = dm.reshape((batch_size,) + tuple(dims) * 2)
+    shape_out = batch_shape + tuple(b.dim_pauli for b in bases)
+    if out is None:
+        out = np.empty(shape_out, dtype=np.float64)
+    elif out.shape != shape_out:
+        raise ValueError('`out` must have shape {}, got {}'
+                         .format(shape_out, out.shape))
+    result = out.reshape((batch_size,) + shape_out[len(batch_shape):])
+    vectors = [b.vectors for b in bases]
+
+    n_lead = _streamed_qubits(dims)
+    if n_lead == 0:
+        result[...] = _dm_to_pv_qubitwise(np.asarray(dm), vectors, 1).real
+        return out
+    lead, rest = dims[:n_lead], dims[n_lead:]
+    for b in range(batch_size):
+        converted = np.empty(tuple(lead) * 2 + tuple(
+            v.shape[0] for v in vectors[n_lead:]), dtype=complex)
+        for index in np.ndindex(*(lead * 2)):
+            block = dm[(b,) + index[:n_lead] + (slice(None),) * len(rest) +
+                       index[n_lead:]]
+            converted[index] = _dm_to_pv_qubitwise(
+                np.asarray(block), vectors[n_lead:], 0)
+        result[b] = _dm_to_pv_qubitwise(converted, vectors[:n_lead], 0).real
+    return out
 
 
-def pv_to_dm(pv, bases):
-    nq = len(bases)
-    dim = bases[0].dim_hilbert
-    einsum_args = [pv, list(range(2 * nq, 3 * nq))]
-    for i, b in enumerate(bases):
-        einsum_args.append(b.vectors)
-        einsum_args.append([2 * nq + i, i, nq + i])
-    return np.einsum(*einsum_args, optimize=True).reshape((dim ** nq,) * 2)
+def pv_to_dm(pv, bases, *, out=None):
+    """Convert Pauli vectors to density matrices.
+
+    The conversion is done as a sequence of contractions over one qubit at a
+    time, so that no intermediate array is much larger than the output.
+    Large density matrices are written in blocks, that span all values of
+    the trailing qubits, so that `out` may be a memory-mapped array, that
+    does not fit into RAM.
+
+    Parameters
+    ----------
+    pv : array
+        Pauli vector of shape `(dim_pauli_0, ..., dim_pauli_N)`. Extra
+        leading axes are treated as batch axes and are kept in the result.
+    bases : list of quantumsim.bases.PauliBasis
+        Bases of the qubits.
+    out : array or None
+        Complex array of shape `batch_shape + (D, D)`, where `D` is a product
+        of Hilbert dimensionalities of the qubits, to write the result to.
+
+    Returns
+    -------
+    array
+    """
+    dims = [b.dim_hilbert for b in bases]
+    n_qubits = len(bases)
+    dim = int(np.prod(dims))
+    dims_pauli = tuple(b.dim_pauli for b in bases)
+    if pv.ndim < n_qubits or pv.shape[pv.ndim - n_qubits:] != dims_pauli:
+        raise ValueError(
+            'Shape of the Pauli vector {} does not match the bases with '
+            'Pauli dimensions {}'.format(pv.shape, dims_pauli))
+    batch_shape = pv.shape[:pv.ndim - n_qubits]
+    batch_size = int(np.prod(batch_shape))
+    pv = pv.reshape((batch_size,) + dims_pauli)
+    shape_out = batch_shape + (dim, dim)
+    if out is None:
+        out = np.empty(shape_out, dtype=complex)
+    elif out.shape != shape_out:
+        raise ValueError('`out` must have shape {}, got {}'
+                         .format(shape_out, out.shape))
+    result = out.reshape((batch_size,) + tuple(dims) * 2)
+    vectors = [b.vectors for b in bases]
+
+    n_lead = _streamed_qubits(dims)
+    if n_lead == 0:
+        result[...] = _pv_to_dm_qubitwise(np.asarray(pv), vectors, 1)
+        return out
+    lead, rest = dims[:n_lead], dims[n_lead:]
+    for b in range(batch_size):
+        expanded = _pv_to_dm_qubitwise(np.asarray(pv[b]), vectors[:n_lead], 0)
+        for index in np.ndindex(*(lead * 2)):
+            result[(b,) + index[:n_lead] + (slice(None),) * len(rest) +
+                   index[n_lead:]] = _pv_to_dm_qubitwise(
+                expanded[index], vectors[n_lead:], 0)
+    return out
+
+
+# Density matrices with more elements than that are converted in blocks
+_BLOCK_SIZE = 2**22
+
+
+def _streamed_qubits(dims):
+    """Number of leading qubits, that the conversion iterates over, so that
+    a block, spanning all values of the other qubits, fits `_BLOCK_SIZE`."""
+    for n_lead in range(len(dims)):
+        if np.prod(dims[n_lead:], dtype=float) ** 2 <= _BLOCK_SIZE:
+            return n_lead
+    return len(dims)
+
+
+def _dm_to_pv_qubitwise(dm, vectors, n_batch):
+    """Contract an array of shape `(batch..., rows..., columns...,
+    trailing...)` with the basis vectors qubit by qubit, getting an array of
+    shape `(batch..., pauli..., trailing...)`.
+
+    Every step accumulates slices of the data, weighted with nonzero
+    elements of the basis vectors, so that no memory is allocated apart
+    from the result and a scratch slice.
+    """
+    n = len(vectors)
+    for i, v in enumerate(vectors):
+        shape = dm.shape
+        # Rows of the qubits, that are not converted yet, precede columns
+        row, col = n_batch + i, n_batch + n
+        data = dm.reshape(int(np.prod(shape[:row])), shape[row],
+                          int(np.prod(shape[row + 1:col])), shape[col],
+                          int(np.prod(shape[col + 1:])))
+        out = np.zeros((data.shape[0], v.shape[0], data.shape[2],
+                        data.shape[4]), dtype=np.result_type(dm, v))
+        scratch = np.empty(out.shape[:1] + out.shape[2:], dtype=out.dtype)
+        for p, c, r in zip(*np.nonzero(v)):
+            np.multiply(data[:, r, :, c, :], v[p, c, r], out=scratch)
+            out[:, p] += scratch
+        dm = out.reshape(shape[:row] + (v.shape[0],) + shape[row + 1:col] +
+                         shape[col + 1:])
+    return dm
+
+
+def _pv_to_dm_qubitwise(pv, vectors, n_batch):
+    """Contract an array of shape `(batch..., pauli..., trailing...)` with
+    the basis vectors qubit by qubit, getting an array of shape
+    `(batch..., rows..., columns..., trailing...)`."""
+    n = len(vectors)
+    for i, v in enumerate(vectors):
+        shape = pv.shape
+        # Columns of the converted qubits follow the Pauli axes
+        axis, col = n_batch + i, n_batch + n + i
+        d = v.shape[1]
+        data = pv.reshape(int(np.prod(shape[:axis])), shape[axis],
+                          int(np.prod(shape[axis + 1:col])),
+                          int(np.prod(shape[col:])))
+        out = np.zeros((data.shape[0], d, data.shape[2], d, data.shape[3]),
+                       dtype=np.result_type(pv, v))
+        scratch = np.empty(data.shape[:1] + data.shape[2:], dtype=out.dtype)
+        for p, r, c in zip(*np.nonzero(v)):
+            np.multiply(data[:, p], v[p, r, c], out=scratch)
+            out[:, r, :, c, :] += scratch
+        pv = out.reshape(shape[:axis] + (d,) + shape[axis + 1:col] + (d,) +
+                         shape[col:])
+    return pv
 
 
 def plm_lindbladian_part(lindblad_op, bases):
@@ -81,7 +269,8 @@ def plm_lindbladian_part(lindblad_op, bases):
     Parameters
     ----------
     lindblad_op : array
-        Lindblad jump operator, in units :math:`\\hbar = 1`.
+        Lindblad jump operators, in units :math:`\\hbar = 1`. Extra leading
+        axes are treated as batch axes and are kept in the result.
     bases : tuple of quantumsim.bases.PauliBasis
         Input and output basis for the resulting PLM.
 
@@ -95,36 +284,38 @@ def plm_lindbladian_part(lindblad_op, bases):
     """
     n = len(bases)
     einsum_args = [
-        lindblad_op, [6*n] + list(range(2*n)),
-        lindblad_op.conj(), [6*n] + list(range(2*n, 4*n)),
+        lindblad_op, [Ellipsis, 6*n] + list(range(2*n)),
+        lindblad_op.conj(), [Ellipsis, 6*n] + list(range(2*n, 4*n)),
     ]
     for i, basis in enumerate(bases):
         einsum_args += [basis.vectors, [4*n+i, 2*n+i, i]]
     for i, basis in enumerate(bases):
         einsum_args += [basis.vectors, [5*n+i, n+i, 3*n+i]]
-    einsum_args.append(list(range(4*n, 6*n)))
+    einsum_args.append([Ellipsis] + list(range(4*n, 6*n)))
     out = np.einsum(*einsum_args, optimize=True)
 
     einsum_args = [
-        lindblad_op, [6*n] + list(range(2*n)),
-        lindblad_op.conj(), [6*n] + list(range(n)) + list(range(2*n, 3*n)),
+        lindblad_op, [Ellipsis, 6*n] + list(range(2*n)),
+        lindblad_op.conj(),
+        [Ellipsis, 6*n] + list(range(n)) + list(range(2*n, 3*n)),
     ]
     for i, basis in enumerate(bases):
         einsum_args += [basis.vectors, [4*n+i, 3*n+i, 2*n+i]]
     for i, basis in enumerate(bases):
         einsum_args += [basis.vectors, [5*n+i, n+i, 3*n+i]]
-    einsum_args.append(list(range(4*n, 6*n)))
+    einsum_args.append([Ellipsis] + list(range(4*n, 6*n)))
     out -= 0.5 * np.einsum(*einsum_args, optimize=True)
 
     einsum_args = [
-        lindblad_op, [6*n] + list(range(2*n)),
-        lindblad_op.conj(), [6*n] + list(range(n)) + list(range(2*n, 3*n)),
+        lindblad_op, [Ellipsis, 6*n] + list(range(2*n)),
+        lindblad_op.conj(),
+        [Ellipsis, 6*n] + list(range(n)) + list(range(2*n, 3*n)),
     ]
     for i, basis in enumerate(bases):
         einsum_args += [basis.vectors, [4*n+i, n+i, 3*n+i]]
     for i, basis in enumerate(bases):
         einsum_args += [basis.vectors, [5*n+i, 3*n+i, 2*n+i]]
-    einsum_args.append(list(range(4*n, 6*n)))
+    einsum_args.append([Ellipsis] + list(range(4*n, 6*n)))
     out -= 0.5 * np.einsum(*einsum_args, optimize=True)
 
     return out
@@ -147,6 +338,8 @@ def plm_hamiltonian_part(hamiltonian, bases):
     ----------
     hamiltonian : array
         Hamiltonian in Lindblad equation, in units :math:`\\hbar = 1`.
+        Extra leading axes are treated as batch axes and are kept in the
+        result.
     bases : tuple of quantumsim.bases.PauliBasis
         Input and output bases for the resulting PLM.
 
@@ -160,20 +353,91 @@ def plm_hamiltonian_part(hamiltonian, bases):
     """
     n = len(bases)
 
-    einsum_args = [hamiltonian, list(range(2*n))]
+    einsum_args = [hamiltonian, [Ellipsis] + list(range(2*n))]
     for i, basis in enumerate(bases):
         einsum_args += [basis.vectors, [3*n+i, 2*n+i, i]]
     for i, basis in enumerate(bases):
         einsum_args += [basis.vectors, [4*n+i, n+i, 2*n+i]]
-    einsum_args.append(list(range(3*n, 5*n)))
+    einsum_args.append([Ellipsis] + list(range(3*n, 5*n)))
     out = np.einsum(*einsum_args, optimize=True)
 
-    einsum_args = [hamiltonian, list(range(2*n))]
+    einsum_args = [hamiltonian, [Ellipsis] + list(range(2*n))]
     for i, basis in enumerate(bases):
         einsum_args += [basis.vectors, [3*n+i, n+i, 2*n+i]]
     for i, basis in enumerate(bases):
         einsum_args += [basis.vectors, [4*n+i, 2*n+i, i]]
-    einsum_args.append(list(range(3*n, 5*n)))
+    einsum_args.append([Ellipsis] + list(range(3*n, 5*n)))
     out -= np.einsum(*einsum_args, optimize=True)
 
     return -1j * out
+
+
+DENSE = 'dense'
+DIAGONAL = 'diagonal'
+PERMUTATION = 'permutation'
+
+PTMStructure = namedtuple('PTMStructure', ['kind', 'diagonal', 'permutation'])
+PTMStructure.__new__.__defaults__ = (None,) * 2
+PTMStructure.__doc__ = """Sparsity structure of a Pauli transfer matrix,
+that allows to apply it faster, than with a dense contraction.
+
+Attributes
+----------
+kind : str
+    `'diagonal'`, `'permutation'` or `'dense'`.
+diagonal : array or None
+    For diagonal PTMs, diagonal elements as a tensor of shape
+    `(dim_pauli_0, ..., dim_pauli_N)`.
+permutation : tuple or None
+    For signed permutation PTMs, a tuple `(sources, signs)` of tensors of
+    shape `(dim_pauli_out_0, ..., dim_pauli_out_N)`: element with a given
+    output index equals the input element number `sources` (a flat index
+    over the input dimensions), multiplied by `signs`.
+"""
+
+# Elements not greater than that relative to the largest one are zeros
+_STRUCTURE_RTOL = 1e-14
+# Nonzero elements of signed permutations may differ from 1 or -1 by that
+# much due to rounding errors of a basis conversion
+_PERMUTATION_ATOL = 1e-10
+
+
+def ptm_structure(ptm):
+    """Detect the sparsity structure of a Pauli transfer matrix.
+
+    PTMs of many channels are diagonal (for example, dephasing and
+    depolarization in the `twolevel_ixyz` basis), and PTMs of Clifford
+    gates in the `twolevel_ixyz` basis are signed permutations. Other
+    PTMs are reported as dense: a contraction with a small matrix is
+    memory-bound anyway, so other sparsity patterns would not make it
+    faster.
+
+    Parameters
+    ----------
+    ptm : array
+        Pauli transfer matrix of shape `(d_out_0, ..., d_out_N, d_in_0,
+        ..., d_in_N)`.
+
+    Returns
+    -------
+    PTMStructure
+    """
+    k = ptm.ndim // 2
+    dims_out, dims_in = ptm.shape[:k], ptm.shape[k:]
+    d_out, d_in = int(np.prod(dims_out)), int(np.prod(dims_in))
+    matrix = ptm.reshape(d_out, d_in)
+    scale = np.max(np.abs(matrix)) if matrix.size > 0 else 0.
+    nonzero = np.abs(matrix) > _STRUCTURE_RTOL * scale
+    if dims_out == dims_in and \
+            not np.any(nonzero & ~np.eye(d_out, dtype=bool)):
+        return PTMStructure(DIAGONAL,
+                            diagonal=np.diagonal(matrix).reshape(dims_in))
+    if d_out == d_in and np.all(np.sum(nonzero, axis=0) == 1) and \
+            np.all(np.sum(nonzero, axis=1) == 1):
+        sources = np.argmax(nonzero, axis=1)
+        values = matrix[np.arange(d_out), sources]
+        if np.allclose(np.abs(values), 1, rtol=0, atol=_PERMUTATION_ATOL):
+            return PTMStructure(PERMUTATION, permutation=(
+                sources.reshape(dims_out),
+                np.sign(values).reshape(dims_out)))
+    return PTMStructure(DENSE)
@@ -1,5 +1,4 @@
 import numpy as np
-from scipy.stats import unitary_group
 
 
 def random_hermitian_matrix(dim: int, seed: int):
@@ -13,6 +12,7 @@ def random_hermitian_matrix(dim: int, seed: int):
 
 
 def random_unitary_matrix(dim: int, seed: int):
+    from scipy.stats import unitary_group
     rng = np.random.RandomState(seed)
     return unitary_group.rvs(dim, random_state=rng)
 
@@ -0,0 +1,79 @@
+"""Helpers for model constructors, that accept both scalar parameters and
+1D arrays of parameters.
+
+If any of the parameters is a Numpy array, the constructor builds a batch
+of operations (see :class:`quantumsim.operations.operation.
+_BatchedPTMOperation`) with a leading parameter axis in one vectorized
+computation, instead of one operation per parameter value.
+"""
+from functools import lru_cache, wraps
+from itertools import chain
+
+import numpy as np
+
+
+def is_batch(*params):
+    """Whether any of the parameters is a Numpy array."""
+    return any(isinstance(p, np.ndarray) for p in params)
+
+
+def cache_scalars(maxsize):
+    """Same as :func:`functools.lru_cache`, but the cache is bypassed if any
+    of the arguments is a Numpy array (which is not hashable)."""
+    def decorator(func):
+        cached = lru_cache(maxsize=maxsize)(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if is_batch(*chain(args, kwargs.values())):
+                return func(*args, **kwargs)
+            return cached(*args, **kwargs)
+
+        wrapper.cache_info = cached.cache_info
+        wrapper.cache_clear = cached.cache_clear
+        return wrapper
+    return decorator
+
+
+def batch_matrix(rows):
+    """Build a matrix from a nested list of its elements.
+
+    Elements may be scalars or 1D arrays of the same size. In the latter
+    case a stack of matrices with a leading parameter axis is returned.
+
+    Parameters
+    ----------
+    rows : list of lists
+        Matrix elements.
+
+    Returns
+    -------
+    array
+    """
+    elements = [[np.asarray(x) for x in row] for row in rows]
+    flat = list(chain(*elements))
+    batch_shape = np.broadcast_shapes(*(x.shape for x in flat))
+    if len(batch_shape) > 1:
+        raise ValueError('Parameters must be scalars or 1D arrays, got '
+                         'arrays of shape {}'.format(batch_shape))
+    out = np.empty(batch_shape + (len(elements), len(elements[0])),
+                   dtype=np.result_type(*flat))
+    for i, row in enumerate(elements):
+        for j, x in enumerate(row):
+            out[..., i, j] = x
+    return out
+
+
+def batch_diag(elements):
+    """Build a diagonal matrix (or a stack of them, see
+    :func:`batch_matrix`)."""
+    n = len(elements)
+    return batch_matrix([[elements[i] if i == j else 0 for j in range(n)]
+                         for i in range(n)])
+
+
+def kraus_set(*ops):
+    """Stack Kraus operators (or stacks of them with a leading parameter
+    axis) into a Kraus operator set (batch of them)."""
+    ops = np.broadcast_arrays(*ops)
+    return np.stack(ops, axis=-3)
@@ -1,6 +1,7 @@
 import numpy as np
 from functools import lru_cache
 from quantumsim import bases, Operation
+from ._vectorize import cache_scalars, batch_matrix, batch_diag, kraus_set
 
 _PAULI = dict(zip(['I', 'X', 'Y', 'Z'], bases.gell_mann(2).vectors))
 
@@ -8,7 +9,22 @@ bases1_default = (bases.general(2),)
 bases2_default = bases1_default * 2
 
 
-@lru_cache(maxsize=64)
+def _from_kraus(kraus, bases):
+    # Kraus operators with a leading parameter axis produce a batch
+    return Operation.from_kraus(kraus, bases, batched=len(kraus.shape) == 4)
+
+
+def _from_unitary(unitary, bases):
+    return _from_kraus(kraus_set(unitary), bases)
+
+
+def _scaled(factor, op):
+    # Multiplies an operator by a scalar or by each element of 1D array
+    factor = np.asarray(factor)
+    return factor.reshape(factor.shape + (1, 1)) * op
+
+
+@cache_scalars(maxsize=64)
 def rotate_euler(phi, theta, lamda):
     """A perfect single qubit rotation described by three Euler angles.
 
@@ -20,8 +36,9 @@ def rotate_euler(phi, theta, lamda):
 
     Parameters
     ----------
-    phi, theta, lamda: float
-        Euler rotation angles in radians.
+    phi, theta, lamda: float or array
+        Euler rotation angles in radians. If arrays are provided, a batch
+        of operations is returned.
 
     Returns
     -------
@@ -30,20 +47,21 @@ def rotate_euler(phi, theta, lamda):
     """
     exp_phi, exp_lambda = np.exp(1j * phi), np.exp(1j * lamda)
     sin_theta, cos_theta = np.sin(theta / 2), np.cos(theta / 2)
-    matrix = np.array([
+    unitary = batch_matrix([
         [cos_theta, -1j * exp_lambda * sin_theta],
         [-1j * exp_phi * sin_theta, exp_phi * exp_lambda * cos_theta]])
-    return Operation.from_kraus(matrix, bases1_default)
+    return _from_unitary(unitary, bases1_default)
 
 
-@lru_cache(maxsize=32)
+@cache_scalars(maxsize=32)
 def rotate_x(angle=np.pi):
     """A perfect single qubit rotation around :math:`Ox` axis.
 
     Parameters
     ----------
-    angle: float, optional
-        Rotation angle in radians. Default is :math:`\\pi`.
+    angle: float or array, optional
+        Rotation angle in radians. Default is :math:`\\pi`. If an array
+        is provided, a batch of operations is returned.
 
     Returns
     -------
@@ -51,18 +69,19 @@ def rotate_x(angle=np.pi):
         An operation, that corresponds to the rotation.
     """
     sin, cos = np.sin(angle / 2), np.cos(angle / 2)
-    matrix = np.array([[cos, -1j*sin], [-1j*sin, cos]])
-    return Operation.from_kraus(matrix, bases1_default)
+    unitary = batch_matrix([[cos, -1j*sin], [-1j*sin, cos]])
+    return _from_unitary(unitary, bases1_default)
 
 
-@lru_cache(maxsize=32)
+@cache_scalars(maxsize=32)
 def rotate_y(angle=np.pi):
     """A perfect single qubit rotation around :math:`Oy` axis.
 
     Parameters
     ----------
-    angle: float, optional
-        Rotation angle in radians. Default is :math:`\\pi`.
+    angle: float or array, optional
+        Rotation angle in radians. Default is :math:`\\pi`. If an array
+        is provided, a batch of operations is returned.
 
     Returns
     -------
@@ -70,18 +89,19 @@ def rotate_y(angle=np.pi):
         An operation, that corresponds to the rotation.
     """
     sin, cos = np.sin(angle / 2), np.cos(angle / 2)
-    matrix = np.array([[cos, -sin], [sin, cos]])
-    return Operation.from_kraus(matrix, bases1_default)
+    unitary = batch_matrix([[cos, -sin], [sin, cos]])
+    return _from_unitary(unitary, bases1_default)
 
 
-@lru_cache(maxsize=32)
+@cache_scalars(maxsize=32)
 def rotate_z(angle=np.pi):
     """A perfect single qubit rotation around :math:`Oz` axis.
 
     Parameters
     ----------
-    angle: float, optional
-        Rotation angle in radians. Default is :math:`\\pi`.
+    angle: float or array, optional
+        Rotation angle in radians. Default is :math:`\\pi`. If an array
+        is provided, a batch of operations is returned.
 
     Returns
     -------
@@ -89,13 +109,13 @@ def rotate_z(angle=np.pi):
         An operation, that corresponds to the rotation.
     """
     exp = np.exp(-1j * angle / 2)
-    matrix = np.diag([exp, exp.conj()])
-    return Operation.from_kraus(matrix, bases1_default)
+    unitary = batch_diag([exp, exp.conj()])
+    return _from_unitary(unitary, bases1_default)
 
 
 def phase_shift(angle=np.pi):
-    matrix = np.diag([1, np.exp(1j * angle)])
-    return Operation.from_kraus(matrix, bases1_default)
+    unitary = batch_diag([1, np.exp(1j * angle)])
+    return _from_unitary(unitary, bases1_default)
 
 
 def hadamard():
@@ -110,32 +130,34 @@ def hadamard():
     return Operation.from_kraus(matrix, bases1_default)
 
 
-@lru_cache(maxsize=32)
+@cache_scalars(maxsize=32)
 def cphase(angle=np.pi):
     """A perfect controlled phase rotation.
 
     Parameters
     ----------
-    angle: float, optional
-        Rotation angle in radians. Default is :math:`\\pi`.
+    angle: float or array, optional
+        Rotation angle in radians. Default is :math:`\\pi`. If an array
+        is provided, a batch of operations is returned.
 
     Returns
     -------
     Operation.from_kraus
         An operation, that corresponds to the rotation.
     """
-    matrix = np.diag([1, 1, 1, np.exp(1j * angle)])
-    return Operation.from_kraus(matrix, bases2_default)
+    unitary = batch_diag([1, 1, 1, np.exp(1j * angle)])
+    return _from_unitary(unitary, bases2_default)
 
 
-@lru_cache(maxsize=32)
+@cache_scalars(maxsize=32)
 def iswap(angle=np.pi/2):
     """A perfect controlled phase rotation.
 
     Parameters
     ----------
-    angle: float, optional
-        Rotation angle in radians. Default is :math:`\\pi`.
+    angle: float or array, optional
+        Rotation angle in radians. Default is :math:`\\pi`. If an array
+        is provided, a batch of operations is returned.
 
     Returns
     -------
@@ -143,11 +165,11 @@ def iswap(angle=np.pi/2):
         An operation, that corresponds to the rotation.
     """
     sin, cos = np.sin(angle), np.cos(angle)
-    matrix = np.array([[1, 0, 0, 0],
-                       [0, cos, 1j*sin, 0],
-                       [0, 1j*sin, cos, 0],
-                       [0, 0, 0, 1]])
-    return Operation.from_kraus(matrix, bases2_default)
+    unitary = batch_matrix([[1, 0, 0, 0],
+                            [0, cos, 1j*sin, 0],
+                            [0, 1j*sin, cos, 0],
+                            [0, 0, 0, 1]])
+    return _from_unitary(unitary, bases2_default)
 
 
 @lru_cache(maxsize=32)
@@ -187,19 +209,20 @@ def controlled_rotation(angle=np.pi, axis='z'):
     return controlled_unitary(matrix)
 
 
-@lru_cache(maxsize=32)
+@cache_scalars(maxsize=32)
 def amp_damping(total_rate=None, *, exc_rate=None, damp_rate=None):
     if total_rate is not None:
-        kraus = np.array([[[1, 0], [0, np.sqrt(1 - total_rate)]],
-                          [[0, np.sqrt(total_rate)], [0, 0]]])
-        return Operation.from_kraus(kraus, bases1_default)
+        kraus = kraus_set(
+            batch_matrix([[1, 0], [0, np.sqrt(1 - total_rate)]]),
+            batch_matrix([[0, np.sqrt(total_rate)], [0, 0]]))
+        return _from_kraus(kraus, bases1_default)
     else:
-        if None in (exc_rate, damp_rate):
+        if exc_rate is None or damp_rate is None:
             raise ValueError(
                 "Either the total_rate or both the exc_rate and damp_rate "
                 "must be provided")
         comb_rate = exc_rate + damp_rate
-        ptm = np.array([
+        ptm = batch_matrix([
             [1, 0, 0, 0],
             [0, np.sqrt((1 - comb_rate)), 0, 0],
             [0, 0, np.sqrt((1 - comb_rate)), 0],
@@ -207,58 +230,59 @@ def amp_damping(total_rate=None, *, exc_rate=None, damp_rate=None):
         return Operation.from_ptm(ptm, (bases.gell_mann(2),))
 
 
-@lru_cache(maxsize=32)
+@cache_scalars(maxsize=32)
 def phase_damping(total_rate=None, *, x_deph_rate=None,
                   y_deph_rate=None, z_deph_rate=None):
     if total_rate is not None:
-        kraus = np.array([[[1, 0], [0, np.sqrt(1 - total_rate)]],
-                          [[0, 0], [0, np.sqrt(total_rate)]]])
-        return Operation.from_kraus(kraus, bases1_default)
+        kraus = kraus_set(batch_diag([1, np.sqrt(1 - total_rate)]),
+                          batch_diag([0, np.sqrt(total_rate)]))
+        return _from_kraus(kraus, bases1_default)
     else:
-        if None in (x_deph_rate, y_deph_rate, z_deph_rate):
+        if (x_deph_rate is None or y_deph_rate is None or
+                z_deph_rate is None):
             raise ValueError(
                 "Either the total_rate or the dephasing rates along each of "
                 "the three axis must be provided")
-        ptm = np.diag(
+        ptm = batch_diag(
             [1, 1 - x_deph_rate, 1 - y_deph_rate, 1 - z_deph_rate])
         return Operation.from_ptm(ptm, (bases.gell_mann(2),))
 
 
-@lru_cache(maxsize=64)
+@cache_scalars(maxsize=64)
 def amp_phase_damping(damp_rate, deph_rate):
     amp_damp = amp_damping(damp_rate)
     phase_damp = phase_damping(deph_rate)
     return Operation.from_sequence(amp_damp.at(0), phase_damp.at(0))
 
 
-@lru_cache(maxsize=16)
+@cache_scalars(maxsize=16)
 def bit_flipping(flip_rate):
-    matrix = np.array([np.sqrt(flip_rate) * _PAULI["I"],
-                       np.sqrt(1 - flip_rate) * _PAULI["X"]])
-    return Operation.from_kraus(matrix, bases1_default)
+    kraus = kraus_set(_scaled(np.sqrt(flip_rate), _PAULI["I"]),
+                      _scaled(np.sqrt(1 - flip_rate), _PAULI["X"]))
+    return _from_kraus(kraus, bases1_default)
 
 
-@lru_cache(maxsize=16)
+@cache_scalars(maxsize=16)
 def phase_flipping(flip_rate):
     # This is actually equivalent to the phase damping
-    matrix = np.array([np.sqrt(flip_rate) * _PAULI["I"],
-                       np.sqrt(1 - flip_rate) * _PAULI["Z"]])
-    return Operation.from_kraus(matrix, bases1_default)
+    kraus = kraus_set(_scaled(np.sqrt(flip_rate), _PAULI["I"]),
+                      _scaled(np.sqrt(1 - flip_rate), _PAULI["Z"]))
+    return _from_kraus(kraus, bases1_default)
 
 
-@lru_cache(maxsize=16)
+@cache_scalars(maxsize=16)
 def bit_phase_flipping(flip_rate):
-    matrix = np.array([np.sqrt(flip_rate) * _PAULI["I"],
-                       np.sqrt(1 - flip_rate) * _PAULI["Y"]])
-    return Operation.from_kraus(matrix, bases1_default)
+    kraus = kraus_set(_scaled(np.sqrt(flip_rate), _PAULI["I"]),
+                      _scaled(np.sqrt(1 - flip_rate), _PAULI["Y"]))
+    return _from_kraus(kraus, bases1_default)
 
 
-@lru_cache(maxsize=16)
+@cache_scalars(maxsize=16)
 def depolarization(rate):
     rate = rate / 2
     sqrt = np.sqrt(rate)
-    matrix = np.array([np.sqrt(2 - (3 * rate)) * _PAULI["I"],
-                       sqrt * _PAULI["X"],
-                       sqrt * _PAULI["Y"],
-                       sqrt * _PAULI["Z"]])
-    return Operation.from_kraus(matrix, bases1_default)
+    kraus = kraus_set(_scaled(np.sqrt(2 - (3 * rate)), _PAULI["I"]),
+                      _scaled(sqrt, _PAULI["X"]),
+                      _scaled(sqrt, _PAULI["Y"]),
+                      _scaled(sqrt, _PAULI["Z"]))
+    return _from_kraus(kraus, bases1_default)
@@ -3,6 +3,7 @@ from functools import lru_cache
 from scipy.linalg import expm
 from quantumsim import bases, Operation
 from quantumsim.algebra.tools import verify_kraus_unitarity
+from ._vectorize import cache_scalars, batch_matrix, batch_diag, kraus_set
 
 _PAULI = dict(zip(['I', 'X', 'Y', 'Z'], bases.gell_mann(2).vectors))
 
@@ -10,7 +11,13 @@ bases1_default = (bases.general(3),)
 bases2_default = bases1_default * 2
 
 
-@lru_cache(maxsize=64)
+def _from_unitary(unitary, bases):
+    # Unitaries with a leading parameter axis produce a batch
+    return Operation.from_kraus(kraus_set(unitary), bases,
+                                batched=len(unitary.shape) == 3)
+
+
+@cache_scalars(maxsize=64)
 def rotate_euler(phi, theta, lamda):
     """A perfect single qubit rotation described by three Euler angles.
 
@@ -22,8 +29,9 @@ def rotate_euler(phi, theta, lamda):
 
     Parameters
     ----------
-    phi, theta, lamda: float
-        Euler rotation angles in radians.
+    phi, theta, lamda: float or array
+        Euler rotation angles in radians. If arrays are provided, a batch
+        of operations is returned.
 
     Returns
     -------
@@ -32,21 +40,22 @@ def rotate_euler(phi, theta, lamda):
     """
     exp_phi, exp_lambda = np.exp(1j * phi), np.exp(1j * lamda)
     sin_theta, cos_theta = np.sin(theta / 2), np.cos(theta / 2)
-    matrix = np.array([
+    unitary = batch_matrix([
         [cos_theta, -1j * exp_lambda * sin_theta, 0],
         [-1j * exp_phi * sin_theta, exp_phi * exp_lambda * cos_theta, 0],
         [0, 0, 1]])
-    return Operation.from_kraus(matrix, bases1_default)
+    return _from_unitary(unitary, bases1_default)
 
 
-@lru_cache(maxsize=32)
+@cache_scalars(maxsize=32)
 def rotate_x(angle=np.pi):
     """A perfect single qubit rotation around :math:`Ox` axis.
 
     Parameters
     ----------
-    angle: float, optional
-        Rotation angle in radians. Default is :math:`\\pi`.
+    angle: float or array, optional
+        Rotation angle in radians. Default is :math:`\\pi`. If an array
+        is provided, a batch of operations is returned.
 
     Returns
     -------
@@ -54,18 +63,21 @@ def rotate_x(angle=np.pi):
         An operation, that corresponds to the rotation.
     """
     sin, cos = np.sin(angle / 2), np.cos(angle / 2)
-    matrix = np.array([[cos, -1j * sin, 0], [-1j * sin, cos, 0], [0, 0, 1]])
-    return Operation.from_kraus(matrix, bases1_default)
+    unitary = batch_matrix([[cos, -1j * sin, 0],
+                            [-1j * sin, cos, 0],
+                            [0, 0, 1]])
+    return _from_unitary(unitary, bases1_default)
 
 
-@lru_cache(maxsize=32)
+@cache_scalars(maxsize=32)
 def rotate_y(angle=np.pi):
     """A perfect single qubit rotation around :math:`Oy` axis.
 
     Parameters
     ----------
-    angle: float, optional
-        Rotation angle in radians. Default is :math:`\\pi`.
+    angle: float or array, optional
+        Rotation angle in radians. Default is :math:`\\pi`. If an array
+        is provided, a batch of operations is returned.
 
     Returns
     -------
@@ -73,18 +85,19 @@ def rotate_y(angle=np.pi):
         An operation, that corresponds to the rotation.
     """
     sin, cos = np.sin(angle / 2), np.cos(angle / 2)
-    matrix = np.array([[cos, -sin, 0], [sin, cos, 0], [0, 0, 1]])
-    return Operation.from_kraus(matrix, bases1_default)
+    unitary = batch_matrix([[cos, -sin, 0], [sin, cos, 0], [0, 0, 1]])
+    return _from_unitary(unitary, bases1_default)
 
 
-@lru_cache(maxsize=32)
+@cache_scalars(maxsize=32)
 def rotate_z(angle=np.pi):
     """A perfect single qubit rotation around :math:`Oz` axis.
 
     Parameters
     ----------
-    angle: float, optional
-        Rotation angle in radians. Default is :math:`\\pi`.
+    angle: float or array, optional
+        Rotation angle in radians. Default is :math:`\\pi`. If an array
+        is provided, a batch of operations is returned.
 
     Returns
     -------
@@ -92,13 +105,13 @@ def rotate_z(angle=np.pi):
         An operation, that corresponds to the rotation.
     """
     exp = np.exp(-1j * angle / 2)
-    matrix = np.diag([exp, exp.conj(), 1])
-    return Operation.from_kraus(matrix, bases1_default)
+    unitary = batch_diag([exp, exp.conj(), 1])
+    return _from_unitary(unitary, bases1_default)
 
 
 def phase_shift(angle=np.pi):
-    matrix = np.diag([1, np.exp(1j * angle), 1])
-    return Operation.from_kraus(matrix, bases1_default)
+    unitary = batch_diag([1, np.exp(1j * angle), 1])
+    return _from_unitary(unitary, bases1_default)
 
 
 def hadamard():
@@ -286,8 +299,9 @@ def _exchange_generator(leakage, leakage_phase,
     generator[4][2] = -1j * \
         np.arcsin(np.sqrt(leakage)) * np.exp(-1j * leakage_phase)
 
-    generator[5][7] = 1j * np.arcsin(np.sqrt(leakage_mobility_rate)) * \
-                      np.exp(1j * leakage_mobility_phase)
+    generator[5][7] = 1j * \
+        np.arcsin(np.sqrt(leakage_mobility_rate)) * \
+        np.exp(1j * leakage_mobility_phase)
     generator[7][5] = -1j * \
         np.arcsin(np.sqrt(leakage_mobility_rate)) * \
         np.exp(-1j * leakage_mobility_phase)
@@ -306,78 +320,88 @@ def cnot():
     return Operation.from_kraus(unitary, bases2_default)
 
 
-@lru_cache(maxsize=64)
+@cache_scalars(maxsize=64)
 def idle(duration, t1, t2, anharmonicity=0.):
-    if np.isfinite(t1) and np.isfinite(t2):
-        t_phi = 1. / (1. / t2 - 0.5 / t1)
-        if t_phi < 0:
-            raise ValueError('t2 must be less than 2*t1')
-        elif np.allclose(t_phi, 0):
-            ops_t2 = []
-        else:
-            ops_t2 = [
-                (8. / (9 * t_phi)) ** 0.5 * np.array([
-                    [1, 0, 0],
-                    [0, 0, 0],
-                    [0, 0, -1]
-                ]),
-                (2. / (9 * t_phi)) ** 0.5 * np.array([
-                    [1, 0, 0],
-                    [0, -1, 0],
-                    [0, 0, 0]
-                ]),
-                (2. / (9 * t_phi)) ** 0.5 * np.array([
-                    [0, 0, 0],
-                    [0, 1, 0],
-                    [0, 0, -1]
-                ])
-            ]
-    else:
-        ops_t2 = []
+    """Idling of a transmon with amplitude damping and dephasing.
 
-    op_t1 = t1 ** -0.5 * np.array([
-        [0, 1, 0],
-        [0, 0, np.sqrt(2)],
-        [0, 0, 0]
-    ])
+    Parameters
+    ----------
+    duration : float or array
+        Duration of idling.
+    t1, t2 : float or array
+        Energy relaxation and dephasing times of a transmon.
+    anharmonicity : float or array
+        Anharmonicity of a transmon.
+
+    If any of the parameters is an array, a batch of operations is
+    returned, built in one vectorized computation.
+
+    Returns
+    -------
+    Operation
+    """
+    duration, t1, t2, anharmonicity = np.broadcast_arrays(
+        *(np.asarray(p, dtype=float)
+          for p in (duration, t1, t2, anharmonicity)))
+    with np.errstate(divide='ignore'):
+        # Pure dephasing rate 1/t_phi; it is zero if t1 or t2 is infinite
+        rate_phi = np.where(np.isfinite(t1) & np.isfinite(t2),
+                            1. / t2 - 0.5 / t1, 0.)
+        if np.any(rate_phi < 0):
+            raise ValueError('t2 must be less than 2*t1')
+        # Dephasing is not taken into account for t_phi close to zero
+        rate_phi = np.where(np.isclose(1. / rate_phi, 0), 0., rate_phi)
+        rate_t1 = t1 ** -1
+
+    def scaled(rate, op):
+        return rate[..., None, None] ** 0.5 * op
+
+    lindblad_ops = kraus_set(
+        scaled(rate_t1, np.array([[0, 1, 0],
+                                  [0, 0, np.sqrt(2)],
+                                  [0, 0, 0]])),
+        scaled(8. / 9 * rate_phi, np.diag([1, 0, -1])),
+        scaled(2. / 9 * rate_phi, np.diag([1, -1, 0])),
+        scaled(2. / 9 * rate_phi, np.diag([0, 1, -1])),
+    )
     if not np.allclose(anharmonicity, 0.):
-        ham = np.array([
-            [0., 0., 0.],
-            [0., 0., 0.],
-            [0., 0., anharmonicity],
-        ])
+        ham = anharmonicity[..., None, None] * np.diag([0., 0., 1.])
     else:
         ham = None
     return Operation.from_lindblad_form(
         duration, (bases.general(3),),
         hamiltonian=ham,
-        lindblad_ops=[op_t1, *ops_t2])
+        lindblad_ops=lindblad_ops)
 
 
-@lru_cache(maxsize=32)
+@cache_scalars(maxsize=32)
 def amp_damping(p0_up, p1_up, p1_down, p2_down):
     """
     A gate, that excites or relaxes a qubit with a certain probability.
 
     Parameters
     ----------
-    p0_up : float
+    p0_up : float or array
         Probability to excite to state 1, being in the state 0
-    p1_up : float
+    p1_up : float or array
         Probability to excite to state 2, being in the state 1
-    p1_down : float
+    p1_down : float or array
         Probability to relax to state 0, being in the state 1
-    p2_down : float
+    p2_down : float or array
         Probability to relax to state 1, being in the state 2
 
+    If arrays are provided, a batch of operations is returned.
+
     Returns
     -------
         quantumsim.operation._PTMOperation
     """
-    ptm = np.identity(9, dtype=float)
-    ptm[:3, :3] = [[1. - p0_up, p1_down, 0.],
-                   [p0_up, 1. - p1_down - p1_up, p2_down],
-                   [0., p1_up, 1 - p2_down]]
+    block = batch_matrix([[1. - p0_up, p1_down, 0.],
+                          [p0_up, 1. - p1_down - p1_up, p2_down],
+                          [0., p1_up, 1 - p2_down]])
+    ptm = np.broadcast_to(np.identity(9, dtype=float),
+                          block.shape[:-2] + (9, 9)).copy()
+    ptm[..., :3, :3] = block
     basis = (bases.general(3),)
     return Operation.from_ptm(ptm, basis, basis)
 
@@ -1,11 +1,11 @@
 import abc
 import numpy as np
-import scipy.linalg.matfuncs
-from collections import namedtuple
+from collections import namedtuple, OrderedDict
 from itertools import chain
 
 from ..algebra.algebra import (kraus_to_ptm, ptm_convert_basis,
-                               plm_lindbladian_part, plm_hamiltonian_part)
+                               plm_lindbladian_part, plm_hamiltonian_part,
+                               ptm_structure)
 from ..bases import PauliBasis
 
 
@@ -105,7 +105,9 @@ class Operation(metaclass=abc.ABCMeta):
         Parameters
         ----------
         ptm: ndarray
-            Pauli transfer matrix in a form of Numpy array
+            Pauli transfer matrix in a form of Numpy array. If it has an
+            extra leading axis, it is treated as a parameter axis and a
+            batch of operations is returned.
         bases_in: tuple of quantumsim.bases.PauliBasis
             Input bases of qubits.
         bases_out: tuple of quantumsim.bases.PauliBasis
@@ -119,10 +121,13 @@ class Operation(metaclass=abc.ABCMeta):
         """
         if bases_out is None:
             bases_out = bases_in
+        if len(ptm.shape) == 2 * len(bases_in) + 1:
+            return _BatchedPTMOperation(ptm, bases_in=bases_in,
+                                        bases_out=bases_out)
         return _PTMOperation(ptm, bases_in=bases_in, bases_out=bases_out)
 
     @staticmethod
-    def from_kraus(kraus, bases_in, bases_out=None):
+    def from_kraus(kraus, bases_in, bases_out=None, *, batched=False):
         """Construct an operation from a set of Kraus matrices.
 
         Either bases, or `dim_hilbert` must be specified.
@@ -137,6 +142,10 @@ class Operation(metaclass=abc.ABCMeta):
             Input bases for generated PTMs. If None, default is picked.
         bases_out : tuple of PauliBasis or None
             Output bases for generated PTMs. If None, defaults to `bases_in`.
+        batched : bool
+            If True, first axis of `kraus` is treated as a parameter axis
+            and a batch of operations is returned (see
+            :class:`_BatchedPTMOperation`).
 
         Returns
         -------
@@ -146,23 +155,25 @@ class Operation(metaclass=abc.ABCMeta):
         bases_out = bases_out or bases_in
         if not isinstance(kraus, np.ndarray):
             kraus = np.array(kraus)
-        if len(kraus.shape) == 2:
-            kraus = kraus.reshape((1, *kraus.shape))
-        elif len(kraus.shape) != 3:
+        n_batch = 1 if batched else 0
+        if len(kraus.shape) == 2 + n_batch:
+            kraus = kraus.reshape((*kraus.shape[:n_batch], 1,
+                                   *kraus.shape[n_batch:]))
+        elif len(kraus.shape) != 3 + n_batch:
             raise ValueError(
-                '`kraus` should be a 2D or 3D array, got shape {}'
-                .format(kraus.shape))
+                '`kraus` should be a {}D or {}D array, got shape {}'
+                .format(2 + n_batch, 3 + n_batch, kraus.shape))
 
         dim_hilbert = bases_in[0].dim_hilbert
         num_qubits = len(bases_in)
-        kraus_size = kraus.shape[1]
+        kraus_size = kraus.shape[-2]
         if (kraus_size != dim_hilbert ** num_qubits or
-                kraus_size != kraus.shape[2]):
+                kraus_size != kraus.shape[-1]):
             raise ValueError(
                 'Shape of the Kraus operator for bases provided must be '
                 '{0}x{0}, got {1}x{2} instead'
                 .format(dim_hilbert ** num_qubits,
-                        kraus.shape[1], kraus.shape[2]))
+                        kraus.shape[-2], kraus.shape[-1]))
 
         return Operation.from_ptm(kraus_to_ptm(kraus, bases_in, bases_out),
                                   bases_in, bases_out)
@@ -174,9 +185,12 @@ class Operation(metaclass=abc.ABCMeta):
 
         TODO: elaborate on Lindblad operators format
 
+        If `time` is a 1D array, or `hamiltonian` and `lindblad_ops` have
+        an extra leading parameter axis, a batch of operations is returned.
+
         Parameters
         ----------
-        time : float
+        time : float or array
             Duration of an evolution, driven by Lindblad equation,
             in arbitrary units.
         bases_in : tuple of PauliBasis
@@ -207,14 +221,20 @@ class Operation(metaclass=abc.ABCMeta):
         if len(summands) == 0:
             raise ValueError("Either `hamiltonian` or `lindblad_ops` must be "
                              "provided.")
-        plm = np.sum(summands, axis=0) * time
-        dim = np.prod(plm.shape[:len(plm.shape) // 2])
-        ptm = scipy.linalg.matfuncs.expm(plm.reshape((dim, dim)))\
-            .reshape(plm.shape)
+        n = 2 * len(bases_in)
+        time = np.asarray(time)
+        plm = sum(summands) * time.reshape(time.shape + (1,) * n)
+        batch_shape = plm.shape[:len(plm.shape) - n]
+        dim = np.prod(plm.shape[-n:-n // 2])
+        # SciPy is imported here, so that `import quantumsim` does not pay
+        # for it
+        import scipy.linalg
+        ptm = scipy.linalg.expm(
+            plm.reshape(batch_shape + (dim, dim))).reshape(plm.shape)
         if not np.allclose(ptm.imag, 0):
             raise ValueError('Resulting PTM is not real-valued, check the '
                              'sanity of `hamiltonian` and `lindblad_ops`.')
-        out = _PTMOperation(ptm.real, bases_in, bases_in)
+        out = Operation.from_ptm(ptm.real, bases_in, bases_in)
         if bases_out is not None:
             return out.set_bases(bases_out=bases_out)
         else:
@@ -296,7 +316,8 @@ class Operation(metaclass=abc.ABCMeta):
 
         return _Chain(operations)
 
-    def compile(self, bases_in=None, bases_out=None, *, compiler_cls=None):
+    def compile(self, bases_in=None, bases_out=None, *, compiler_cls=None,
+                dtype=None):
         """Returns equivalent circuit, optimized for given input and/or
         output bases.
 
@@ -316,6 +337,11 @@ class Operation(metaclass=abc.ABCMeta):
             Output bases.
         compiler_cls: none or class
             Class of a compiler. If None, Quantumsim decides.
+        dtype: None, numpy.float32 or numpy.float64
+            Precision of PTMs of the compiled operation. Should match the
+            working precision of Pauli vectors it is applied to, otherwise
+            PTMs are cast on every application. If None, precision is not
+            changed.
 
         Returns
         -------
@@ -326,9 +352,26 @@ class Operation(metaclass=abc.ABCMeta):
             op = self
         else:
             op = Operation.from_sequence(self)
+        op._validate_not_batched()
         compiler_cls = compiler_cls or self._default_compiler_cls
         compiler = compiler_cls(op, optimize=True)
-        return compiler.compile(bases_in, bases_out)
+        out = compiler.compile(bases_in, bases_out)
+        return out if dtype is None else out.astype(dtype)
+
+    def astype(self, dtype):
+        """Return the same operation with the PTM in a given precision.
+
+        Operations, that do not store a PTM, are returned as is.
+
+        Parameters
+        ----------
+        dtype: numpy.float32 or numpy.float64
+
+        Returns
+        -------
+        Operation
+        """
+        return self
 
     def at(self, *indices):
         """Returns a container with the operation, that provides also dumb
@@ -372,6 +415,10 @@ class Operation(metaclass=abc.ABCMeta):
 _IndexedOperation = namedtuple('_IndexedOperation', ['operation', 'indices'])
 
 
+def _is_full(basis):
+    return basis.dim_pauli == basis.dim_hilbert ** 2
+
+
 class _PTMOperation(Operation):
     """Generic transformation of a state.
 
@@ -398,6 +445,8 @@ class _PTMOperation(Operation):
     .. [2] D. Greenbaum, "Introduction to Quantum Gate Set Tomography",
        arXiv:1509.02921 (2000).
     """
+    # Number of versions of the operation in other bases to keep
+    _converted_max = 16
 
     def __init__(self, ptm, bases_in, bases_out):
         self._ptm = ptm
@@ -408,12 +457,32 @@ class _PTMOperation(Operation):
         self._validate_bases(bases_out=self.bases_out)
         shape = tuple(b.dim_pauli for b in
                       chain(self.bases_out, self.bases_in))
-        if not ptm.shape == shape:
+        if not self.shape == shape:
             raise ValueError(
                 'Shape of `ptm` is not compatible with the `bases` '
                 'dimensionality: \n'
                 '- expected shape from provided `bases`: {}\n'
                 '- `ptm` shape: {}'.format(shape, ptm.shape))
+        # Structure of the PTM, that backends may use to apply it faster.
+        # It is detected, when the operation is applied for the first time,
+        # so that operations, that are only compiled or converted, do not
+        # pay for it.
+        self._structure_detected = False
+        # Versions of the operation in other bases, so that the basis
+        # conversion and structure detection are not repeated, when the
+        # operation is applied to states in these bases. Least recently
+        # used ones go first.
+        self._converted = OrderedDict()
+
+    @property
+    def _structure(self):
+        if not self._structure_detected:
+            self._structure_value = self._detect_structure()
+            self._structure_detected = True
+        return self._structure_value
+
+    def _detect_structure(self):
+        return ptm_structure(self._ptm)
 
     @property
     def dim_hilbert(self):
@@ -444,14 +513,41 @@ class _PTMOperation(Operation):
         b_in = bases_in or self.bases_in
         b_out = bases_out or self.bases_out
         if b_in == self.bases_in and b_out == self.bases_out:
-            new_op = self
-        else:
-            new_ptm = ptm_convert_basis(self._ptm,
-                                        self.bases_in, self.bases_out,
-                                        b_in, b_out)
-            new_op = _PTMOperation(new_ptm, b_in, b_out)
+            return self
+        key = (tuple(b_in), tuple(b_out))
+        try:
+            self._converted.move_to_end(key)
+            return self._converted[key]
+        except KeyError:
+            pass
+        new_ptm = ptm_convert_basis(self._ptm,
+                                    self.bases_in, self.bases_out,
+                                    b_in, b_out)
+        if self._ptm.dtype == np.float32:
+            # Basis conversion is done in double precision
+            new_ptm = new_ptm.astype(np.float32)
+        new_op = self.__class__(new_ptm, b_in, b_out)
+        if len(self._converted) >= self._converted_max:
+            self._converted.popitem(last=False)
+        self._converted[key] = new_op
         return new_op
 
+    def astype(self, dtype):
+        """Return the same operation with the PTM in a given precision.
+
+        Parameters
+        ----------
+        dtype: numpy.float32 or numpy.float64
+
+        Returns
+        -------
+        _PTMOperation
+        """
+        if self._ptm.dtype == dtype:
+            return self
+        return self.__class__(self._ptm.astype(dtype), self.bases_in,
+                              self.bases_out)
+
     def ptm(self, bases_in, bases_out=None):
         bases_out = bases_out or bases_in
         if bases_in == self.bases_in and bases_out == self.bases_out:
@@ -471,18 +567,88 @@ class _PTMOperation(Operation):
             raise ValueError('This is a {}-qubit operation, but number of '
                              'qubits provided is {}'
                              .format(self.num_qubits, len(qubit_indices)))
-        op = self
-        for q, b in zip(qubit_indices, self.bases_in):
-            if pauli_vector.bases[q] != b:
-                op = self.set_bases(
-                    bases_in=tuple([pauli_vector.bases[q] for q in qubit_indices]))
-                break
-
-        pauli_vector.apply_ptm(op._ptm, *qubit_indices)
+        # The operation is converted to the bases of the state. Where both
+        # the output basis of the operation and the basis of the state are
+        # full, the latter is used as the output basis too, so that the
+        # bases of the state do not change and the structure of the PTM in
+        # them (for example, a signed permutation for Clifford gates in the
+        # `twolevel_ixyz` basis) may be used. Reduced output bases are kept.
+        bases_in = tuple(pauli_vector.bases[q] for q in qubit_indices)
+        bases_out = tuple(
+            b if _is_full(b) and _is_full(b_out) else b_out
+            for b, b_out in zip(bases_in, self.bases_out))
+        op = self.set_bases(bases_in=bases_in, bases_out=bases_out)
+
+        pauli_vector.apply_structured_ptm(op._ptm, op._structure,
+                                          *qubit_indices)
         for q, b in zip(qubit_indices, op.bases_out):
             pauli_vector.bases[q] = b
 
 
+class _BatchedPTMOperation(_PTMOperation):
+    """A batch of operations, that differ only by the values of their
+    parameters.
+
+    The PTM of the batch has an extra leading parameter axis. Applied to a
+    :class:`quantumsim.pauli_vectors.PauliVectorBatch` of the same size,
+    operation number `i` acts on the batch member number `i`, all in a
+    single contraction. Constructor of this class is not supposed to be
+    called in user code, see :func:`Operation.from_ptm` and
+    :func:`Operation.from_kraus`.
+
+    Parameters
+    ----------
+    ptm : ndarray
+        Pauli transfer matrices of operations, stacked along the first axis.
+    bases_in : tuple of PauliBasis
+        Input bases of the PTM
+    bases_out : tuple of PauliBasis
+        Output bases of the PTM
+    """
+
+    def _detect_structure(self):
+        # Batches of PTMs are always applied with a dense contraction
+        return None
+
+    @property
+    def shape(self):
+        """Shape of a PTM of a single operation in the batch, qubit-wise
+        (see :attr:`_PTMOperation.shape`)."""
+        return self._ptm.shape[1:]
+
+    @property
+    def batch_size(self):
+        """Number of operations in the batch."""
+        return self._ptm.shape[0]
+
+    def __len__(self):
+        return self.batch_size
+
+    def __getitem__(self, index):
+        """Return operation number `index` of the batch."""
+        return _PTMOperation(self._ptm[index], self.bases_in, self.bases_out)
+
+    def __call__(self, pauli_vector, *qubit_indices):
+        """
+
+        Parameters
+        ----------
+        pauli_vector : quantumsim.pauli_vectors.PauliVectorBatch
+            A batch of Pauli vectors of the same size, as the batch of
+            operations.
+        q0, ..., qN : indices of qubits to act on
+        """
+        batch_size = getattr(pauli_vector, 'batch_size', None)
+        if batch_size != self.batch_size:
+            raise ValueError(
+                'A batch of {} operations can be applied only to a batch of '
+                'Pauli vectors of the same size, got {}'
+                .format(self.batch_size,
+                        'a single Pauli vector' if batch_size is None else
+                        'a batch of size {}'.format(batch_size)))
+        super().__call__(pauli_vector, *qubit_indices)
+
+
 class _Chain(Operation):
     """
     A chain of operations, that are applied sequentially.
@@ -534,13 +700,21 @@ class _Chain(Operation):
                 results.append(result)
         return results if len(results) > 0 else None
 
+    def astype(self, dtype):
+        """Return the same chain with PTMs of all operations in a given
+        precision (see :func:`_PTMOperation.astype`)."""
+        return _Chain([_IndexedOperation(op.astype(dtype), indices)
+                       for op, indices in self.operations])
+
     def set_bases(self, bases_in=None, bases_out=None):
         super().set_bases(bases_in, bases_out)
+        self._validate_not_batched()
         compiler = self._default_compiler_cls(self, optimize=False)
         return compiler.compile(bases_in, bases_out)
 
     def ptm(self, bases_in, bases_out=None):
         super().ptm(bases_in, bases_out)
+        self._validate_not_batched()
         bases_out = bases_out or bases_in
         ptm_in_shape = tuple(b.dim_pauli for b in bases_in)
         start_ptm = Operation.from_ptm(
@@ -551,3 +725,13 @@ class _Chain(Operation):
             optimize=False) \
             .compile(bases_in, bases_out) \
             .ptm(bases_in, bases_out)
+
+    def _validate_not_batched(self):
+        """Compiler merges PTMs of operations, so it does not support
+        batched ones."""
+        for op, _ in self.operations:
+            if isinstance(op, _BatchedPTMOperation):
+                raise ValueError(
+                    'Chains with batched operations can not be compiled or '
+                    'converted to other bases, apply them to a batch of '
+                    'Pauli vectors directly')
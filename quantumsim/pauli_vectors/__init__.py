@@ -1,14 +1,38 @@
+import importlib
+
 from .numpy import PauliVectorNumpy
+from .registry import register, get as get_backend
+
+__all__ = ['Default', 'PauliVectorNumpy', 'PauliVectorBatch',
+           'PauliVectorMemmap', 'PauliVectorSparse', 'PauliVectorMPS',
+           'PauliVectorShared', 'SharedHandle', 'Sampler', 'sample_sequential',
+           'load', 'register', 'get_backend']
+
+# Backends other than Numpy are imported only when requested, see `registry`
+_backends = {
+    'PauliVectorCuda': 'cuda',
+    'PauliVectorBatch': 'batch',
+    'PauliVectorMemmap': 'memmap',
+    'PauliVectorSparse': 'sparse',
+    'PauliVectorMPS': 'mps',
+    'PauliVectorShared': 'shared',
+}
+# Other names are imported from their modules, when requested
+_modules = {
+    'SharedHandle': 'shared',
+    'Sampler': 'sampling',
+    'sample_sequential': 'sampling',
+    'load': 'checkpoint',
+}
+
 
-__all__ = ['Default', 'PauliVectorNumpy']
-
-try:
-    from .cuda import PauliVectorCuda
-    __all__.append('PauliVectorCuda')
-    Default = PauliVectorCuda
-except ImportError:
-    import warnings
-    warnings.warn('Could not import CUDA backend. Either PyCUDA is not '
-                  'installed, or your PC has no NVidia GPU at all. Be wise '
-                  'with a difficulty of the problem you state to Quantumsim.')
-    Default = PauliVectorNumpy
+def __getattr__(name):
+    if name == 'Default':
+        return get_backend()
+    if name in _backends:
+        return get_backend(_backends[name])
+    if name in _modules:
+        module = importlib.import_module('.' + _modules[name], __name__)
+        return getattr(module, name)
+    raise AttributeError('module {!r} has no attribute {!r}'
+                         .format(__name__, name))
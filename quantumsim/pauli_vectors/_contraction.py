@@ -0,0 +1,338 @@
+"""Contraction plans for applying Pauli transfer matrices to Pauli vectors.
+
+Applying a PTM to a subset of qubits is a tensor contraction, that has the
+same structure every time the same gate hits the same qubits of a state of
+the same shape. Here we work out this structure once and express the
+contraction as a (batched) matrix product, that goes to BLAS, instead of
+searching for an optimal ``einsum`` path on every call.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import product
+
+import numpy as np
+import pytools
+
+
+class ContractionPlan:
+    """A precomputed recipe for applying a PTM to a Pauli vector tensor.
+
+    If the target qubits occupy adjacent axes of the state, the state is
+    viewed as a stack of matrices of shape ``(d_in, trail)`` and multiplied
+    by the PTM without any data movement. Otherwise target axes are first
+    moved next to each other, contracted with a single ``matmul`` and moved
+    back.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Shape of the Pauli vector tensor.
+    qubits : tuple of int
+        Axes of the tensor the PTM acts on, in the order of PTM indices.
+    ptm_shape : tuple of int
+        Shape of the PTM: output dimensions of each qubit, followed by the
+        input dimensions. If it has an extra leading dimension, PTM is a
+        batch of PTMs, number `i` of which is applied to the slice number
+        `i` of the first axis of the state.
+    """
+
+    def __init__(self, shape, qubits, ptm_shape):
+        n_qubits = len(shape)
+        k = len(qubits)
+        self.batched = len(ptm_shape) == 2 * k + 1
+        if self.batched:
+            if 0 in qubits or shape[0] != ptm_shape[0]:
+                raise ValueError(
+                    'Batch of {} PTMs can not be applied to the axes {} of '
+                    'a tensor of shape {}'.format(ptm_shape[0], qubits,
+                                                  shape))
+            ptm_shape = ptm_shape[1:]
+        if len(ptm_shape) != 2 * k:
+            raise ValueError(
+                '{}-qubit PTM must have {} dimensions, got {}'
+                .format(k, 2 * k, len(ptm_shape)))
+        if len(set(qubits)) != k:
+            raise ValueError('Qubit indices must be unique, got {}'
+                             .format(qubits))
+        for q in qubits:
+            if q < 0 or q >= n_qubits:
+                raise ValueError(
+                    'Qubit number {} does not exist in the system, it '
+                    'contains {} qubits in total.'.format(q, n_qubits))
+        dims_out, dims_in = ptm_shape[:k], ptm_shape[k:]
+        if tuple(shape[q] for q in qubits) != tuple(dims_in):
+            raise ValueError(
+                'PTM input dimensions {} do not match the dimensions of '
+                'qubits {}: {}'.format(tuple(dims_in), tuple(qubits),
+                                       tuple(shape[q] for q in qubits)))
+
+        self.shape_in = tuple(shape)
+        shape_out = list(shape)
+        for q, d in zip(qubits, dims_out):
+            shape_out[q] = d
+        self.shape_out = tuple(shape_out)
+        self.size_in = pytools.product(self.shape_in)
+        self.size_out = pytools.product(self.shape_out)
+        self.d_in = pytools.product(dims_in)
+        self.d_out = pytools.product(dims_out)
+
+        # Sort PTM indices in the order of state axes
+        order = sorted(range(k), key=lambda i: qubits[i])
+        self.qubits = tuple(qubits[i] for i in order)
+        ptm_axes = tuple(order) + tuple(k + i for i in order)
+        self._ptm_axes = (None if ptm_axes == tuple(range(2 * k))
+                          else ptm_axes)
+
+        # Target axes are gathered next to the last of them (the rest of
+        # the axes keeps its order), so that the state can be viewed as a
+        # stack of `(d_in, trail)` matrices. If targets are adjacent
+        # already, no data movement is needed at all.
+        q_last = self.qubits[-1]
+        lead_axes = tuple(i for i in range(q_last) if i not in self.qubits)
+        trail_axes = tuple(range(q_last + 1, n_qubits))
+        perm = lead_axes + self.qubits + trail_axes
+        lead = pytools.product(shape[i] for i in lead_axes)
+        trail = pytools.product(shape[i] for i in trail_axes)
+        if self.batched:
+            self._stack_in = (shape[0], lead // shape[0], self.d_in, trail)
+            self._stack_out = (shape[0], lead // shape[0], self.d_out, trail)
+        else:
+            self._stack_in = (lead, self.d_in, trail)
+            self._stack_out = (lead, self.d_out, trail)
+        self.direct = perm == tuple(range(n_qubits))
+        if self.direct:
+            self._perm_in = self._perm_out = None
+            self._shape_permuted_out = None
+        else:
+            self._perm_in = perm
+            self._perm_out = tuple(int(i) for i in np.argsort(perm))
+            self._shape_permuted_out = tuple(self.shape_out[i] for i in perm)
+
+    def ptm_matrix(self, ptm):
+        """Reshape PTM into a ``(d_out, d_in)`` matrix (or a stack of them),
+        that matches the order of state axes."""
+        if self.batched:
+            if self._ptm_axes is not None:
+                ptm = np.transpose(
+                    ptm, (0,) + tuple(i + 1 for i in self._ptm_axes))
+            return np.ascontiguousarray(ptm).reshape(
+                ptm.shape[0], 1, self.d_out, self.d_in)
+        if self._ptm_axes is not None:
+            ptm = np.transpose(ptm, self._ptm_axes)
+        return np.ascontiguousarray(ptm).reshape(self.d_out, self.d_in)
+
+    def __call__(self, data, ptm, out=None, scratch=None, pool=None):
+        """Apply a PTM to the Pauli vector tensor `data`.
+
+        If `out` is provided, no memory is allocated for the result.
+        If the target axes of the state are not adjacent, `scratch` must be
+        provided too; it is allowed to share memory with `data`, that is
+        overwritten in this case.
+
+        Parameters
+        ----------
+        data : ndarray
+            Pauli vector tensor of shape `shape_in`.
+        ptm : ndarray
+            Pauli transfer matrix.
+        out : ndarray or None
+            Flat array with at least `max(size_in, size_out)` elements,
+            that must not share memory with `data`.
+        scratch : ndarray or None
+            Flat array with at least `size_out` elements, that must not
+            share memory with `out`.
+        pool : ThreadPool or None
+            If provided (together with `out`), the state is split into
+            slabs along the axes, that PTM does not touch, which are
+            processed in parallel.
+
+        Returns
+        -------
+        ndarray
+            C-contiguous tensor of shape `shape_out`, a view of `out` if it
+            was provided.
+        """
+        matrix = self.ptm_matrix(ptm)
+        if out is None:
+            if self.direct:
+                return np.matmul(matrix, data.reshape(self._stack_in)) \
+                    .reshape(self.shape_out)
+            permuted = np.ascontiguousarray(
+                np.transpose(data, self._perm_in))
+            result = np.matmul(matrix, permuted.reshape(self._stack_in)) \
+                .reshape(self._shape_permuted_out)
+            return np.ascontiguousarray(np.transpose(result, self._perm_out))
+
+        if pool is not None and not self.batched:
+            return self._call_parallel(matrix, data, out, scratch, pool)
+        if self.direct:
+            result = out[:self.size_out].reshape(self._stack_out)
+            np.matmul(matrix, data.reshape(self._stack_in), out=result)
+            return result.reshape(self.shape_out)
+        # data -> out (permuted) -> scratch (contracted) -> out (restored)
+        permuted = out[:self.size_in].reshape(
+            tuple(self.shape_in[i] for i in self._perm_in))
+        np.copyto(permuted, np.transpose(data, self._perm_in))
+        result = scratch[:self.size_out].reshape(self._stack_out)
+        np.matmul(matrix, permuted.reshape(self._stack_in), out=result)
+        restored = out[:self.size_out].reshape(self.shape_out)
+        np.copyto(restored, np.transpose(
+            result.reshape(self._shape_permuted_out), self._perm_out))
+        return restored
+
+    def _call_parallel(self, matrix, data, out, scratch, pool):
+        if self.direct:
+            data_stack = data.reshape(self._stack_in)
+            result = out[:self.size_out].reshape(self._stack_out)
+            lead, _, trail = self._stack_in
+            # Slabs are taken along the leading axes, if there are enough
+            # of them, otherwise along the trailing ones.
+            if lead >= pool.n_threads or lead >= trail:
+                pool.map(lambda s: np.matmul(matrix, data_stack[s],
+                                             out=result[s]),
+                         pool.slabs(lead))
+            else:
+                pool.map(lambda s: np.matmul(matrix, data_stack[:, :, s],
+                                             out=result[:, :, s]),
+                         pool.slabs(trail))
+            return result.reshape(self.shape_out)
+
+        # The same three steps, as in the serial case, each one split along
+        # the first of the leading axes, that are not touched by PTM (it is
+        # the first axis of the permuted tensor). Steps are separated, since
+        # `permuted` and `restored` (and possibly `data` and `scratch`)
+        # share memory.
+        axis = self._perm_in[0]
+        n = self.shape_in[axis]
+        rows = self._stack_in[0] // n
+        shape_permuted_in = tuple(self.shape_in[i] for i in self._perm_in)
+        permuted = out[:self.size_in].reshape(shape_permuted_in)
+        data_permuted = np.transpose(data, self._perm_in)
+        pool.map(lambda s: np.copyto(permuted[s], data_permuted[s]),
+                 pool.slabs(n))
+
+        permuted_stack = permuted.reshape(self._stack_in)
+        result = scratch[:self.size_out].reshape(self._stack_out)
+        pool.map(lambda s: np.matmul(
+            matrix, permuted_stack[s.start * rows:s.stop * rows],
+            out=result[s.start * rows:s.stop * rows]), pool.slabs(n))
+
+        restored = out[:self.size_out].reshape(self.shape_out)
+        result_restored = np.transpose(
+            result.reshape(self._shape_permuted_out), self._perm_out)
+        index = [slice(None)] * len(self.shape_out)
+
+        def restore(s):
+            index_slab = tuple(index[:axis] + [s] + index[axis + 1:])
+            np.copyto(restored[index_slab], result_restored[index_slab])
+
+        pool.map(restore, pool.slabs(n))
+        return restored
+
+
+class ThreadPool:
+    """A pool of threads for applying PTMs to independent slabs of a
+    state. Numpy releases the GIL in copies and matrix products, so the
+    slabs are processed in parallel.
+
+    Parameters
+    ----------
+    n_threads : int
+        Number of threads.
+    """
+
+    def __init__(self, n_threads):
+        if n_threads < 1:
+            raise ValueError('Number of threads must be positive, got {}'
+                             .format(n_threads))
+        self.n_threads = n_threads
+        self._executor = ThreadPoolExecutor(
+            max_workers=n_threads, thread_name_prefix='quantumsim')
+
+    def slabs(self, n):
+        """Split `range(n)` into at most `n_threads` slices of nearly
+        equal size."""
+        bounds = np.linspace(0, n, min(n, self.n_threads) + 1).astype(int)
+        return [slice(int(start), int(stop))
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def map(self, func, slabs):
+        """Call `func` for each of `slabs` in parallel and wait for all of
+        them to finish."""
+        if len(slabs) == 1:
+            func(slabs[0])
+            return
+        for future in [self._executor.submit(func, s) for s in slabs]:
+            future.result()
+
+
+@lru_cache(maxsize=None)
+def thread_pool(n_threads):
+    """Return a :class:`ThreadPool` with a given number of threads, that is
+    shared by all Pauli vectors."""
+    return ThreadPool(n_threads)
+
+
+@lru_cache(maxsize=1024)
+def contraction_plan(shape, qubits, ptm_shape):
+    """Return a (cached) :class:`ContractionPlan` for the arguments.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Shape of the Pauli vector tensor.
+    qubits : tuple of int
+        Axes of the tensor the PTM acts on.
+    ptm_shape : tuple of int
+        Shape of the PTM.
+
+    Returns
+    -------
+    ContractionPlan
+    """
+    return ContractionPlan(shape, qubits, ptm_shape)
+
+
+def blocks(shape, axes, max_size):
+    """Split a tensor into blocks of at most `max_size` elements by slicing
+    it along some of `axes`.
+
+    Axes are split in the order they are listed in `axes`, each of them
+    only if the blocks are still too large. If the leading axes of a
+    C-ordered tensor go first, every block is a few contiguous pieces of
+    memory (a single one, if all axes split precede the others).
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Shape of the tensor.
+    axes : tuple of int
+        Axes, that may be split.
+    max_size : int
+        Maximal number of elements in a block. It may be exceeded only if
+        all `axes` are split to single elements already.
+
+    Yields
+    ------
+    tuple of slice
+        Index of a block, that preserves the number of tensor dimensions.
+    """
+    size = pytools.product(shape)
+    split = []
+    for axis in axes:
+        if size <= max_size:
+            break
+        split.append(axis)
+        size //= shape[axis]
+    if len(split) == 0:
+        yield (slice(None),) * len(shape)
+        return
+    *fixed, last = split
+    width = max(1, min(shape[last], max_size // size))
+    for indices in product(*(range(shape[axis]) for axis in fixed)):
+        index = [slice(None)] * len(shape)
+        for axis, i in zip(fixed, indices):
+            index[axis] = slice(i, i + 1)
+        for start in range(0, shape[last], width):
+            index[last] = slice(start, min(start + width, shape[last]))
+            yield tuple(index)
@@ -0,0 +1,74 @@
+"""Metrics of states, computed on Pauli vectors.
+
+Pauli bases are orthonormal with respect to the Hilbert-Schmidt inner
+product, so the overlap :math:`\\mathrm{Tr} \\rho \\sigma` of two states
+in the same bases is a dot product of their Pauli vectors. If bases of a
+qubit differ, one of the vectors is converted with a matrix of overlaps of
+the basis elements :math:`\\mathrm{Tr}(B_x C_y)`, that is exact even for
+subbases, since the other vector lies in the span of its basis anyway.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+
+def hs_overlap(data, bases, other_data, other_bases, batch_axes=0,
+               other_batch_axes=0):
+    """Hilbert-Schmidt overlap :math:`\\mathrm{Tr} \\rho \\sigma` of two
+    Pauli vectors.
+
+    Parameters
+    ----------
+    data, other_data : ndarray
+        Pauli vector tensors, optionally with leading batch axes, that are
+        broadcast against each other.
+    bases, other_bases : list of quantumsim.bases.PauliBasis
+        Bases of the qubit axes. Hilbert dimensions must match.
+    batch_axes, other_batch_axes : int
+        Number of leading batch axes of `data` and `other_data`.
+
+    Returns
+    -------
+    ndarray
+        Overlaps in double precision.
+    """
+    if len(bases) != len(other_bases) or \
+            any(a.dim_hilbert != b.dim_hilbert
+                for a, b in zip(bases, other_bases)):
+        raise ValueError(
+            'States must have the same Hilbert dimensions of qubits, got {} '
+            'and {}'.format(tuple(b.dim_hilbert for b in bases),
+                            tuple(b.dim_hilbert for b in other_bases)))
+    other = np.asarray(other_data)
+    for q, (basis, other_basis) in enumerate(zip(bases, other_bases)):
+        transform = _basis_transform(basis, other_basis)
+        if transform is None:
+            continue
+        axis = q + other_batch_axes
+        other = np.moveaxis(np.tensordot(transform, other,
+                                         axes=([1], [axis])), 0, axis)
+    data = data.reshape(data.shape[:batch_axes] + (-1,))
+    other = other.reshape(other.shape[:other_batch_axes] + (-1,))
+    return np.einsum('...i,...i->...', data, other, dtype=np.float64)
+
+
+def dm_fidelity(dm, other_dm):
+    """Fidelity :math:`\\left(\\mathrm{Tr} \\sqrt{\\sqrt{\\rho} \\sigma
+    \\sqrt{\\rho}}\\right)^2` of (stacks of) density matrices."""
+    values, vectors = np.linalg.eigh(dm)
+    sqrt = (vectors * np.sqrt(np.clip(values, 0, None))[..., None, :]) @ \
+        np.swapaxes(vectors.conj(), -1, -2)
+    values = np.linalg.eigvalsh(sqrt @ other_dm @ sqrt)
+    return np.sum(np.sqrt(np.clip(values, 0, None)), axis=-1) ** 2
+
+
+@lru_cache(maxsize=64)
+def _basis_transform(basis, other_basis):
+    """Matrix, that converts a Pauli vector axis from `other_basis` to
+    `basis`, or `None`, if the bases are the same."""
+    if basis is other_basis or basis == other_basis:
+        return None
+    transform = np.einsum('xab,yba->xy', basis.vectors,
+                          other_basis.vectors).real
+    transform.flags.writeable = False
+    return transform
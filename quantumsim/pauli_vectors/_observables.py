@@ -0,0 +1,237 @@
+"""Expectation values of factorized observables in Pauli space.
+
+An observable :math:`O = O_0 \\otimes \\cdots \\otimes O_N` has an
+expectation value :math:`\\mathrm{Tr} \\rho O = \\sum_x p_x \\prod_q
+\\mathrm{Tr}(B^{(q)}_{x_q} O_q)`, where :math:`p` is the Pauli vector and
+:math:`B^{(q)}` are basis elements of the qubit :math:`q`. Therefore every
+factor is reduced to a real overlap vector against the basis of its qubit,
+and the Pauli vector is contracted with these vectors qubit by qubit,
+without building a density matrix.
+
+Observables, that share the factors on the leading qubits, share the
+contractions too: they are processed as a prefix tree, so that every
+distinct prefix is contracted once.
+
+If all observables are Pauli strings and there are many of them, a table of
+expectation values of all Pauli strings is computed instead with a
+Walsh-Hadamard-style transform, that converts every qubit axis to the
+:math:`I, X, Y, Z` basis by a small :math:`4 \\times d` matrix. For the
+`twolevel_ixyz` basis this transform is a scaling only, so the table is the
+Pauli vector itself.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+PAULI_LABELS = 'IXYZ'
+
+_paulis = np.array([[[1, 0], [0, 1]],
+                    [[0, 1], [1, 0]],
+                    [[0, -1j], [1j, 0]],
+                    [[1, 0], [0, -1]]])
+
+# If there are at least that many Pauli strings per element of the table
+# of all of them, the table is computed
+_table_min_fraction = 1 / 16
+
+
+def parse_observables(observables, bases):
+    """Convert observables to per-qubit factors.
+
+    Parameters
+    ----------
+    observables : list
+        Every observable is either a Pauli string, like `'XIZ'`, a list of
+        per-qubit factors, or a dict, that maps qubit indices to factors
+        (missing qubits have identity factors). A factor is either one of
+        `'I'`, `'X'`, `'Y'`, `'Z'`, `None` (identity) or a Hermitian matrix.
+    bases : list of quantumsim.bases.PauliBasis
+        Bases of the qubits.
+
+    Returns
+    -------
+    factors : list of list
+        Distinct factors of every qubit: Pauli labels or matrices.
+    ids : ndarray
+        Integer array of shape `(n_observables, n_qubits)` with indices of
+        factors of every observable in `factors`.
+    """
+    n = len(bases)
+    factors = [[] for _ in range(n)]
+    keys = [{} for _ in range(n)]
+    ids = np.zeros((len(observables), n), dtype=int)
+    for i, observable in enumerate(observables):
+        if isinstance(observable, dict):
+            for q in observable:
+                if not 0 <= q < n:
+                    raise ValueError(
+                        'Qubit {} does not exist in the system, it contains '
+                        '{} qubits in total.'.format(q, n))
+            observable = [observable.get(q) for q in range(n)]
+        if len(observable) != n:
+            raise ValueError('Observable must have {} factors, got {}'
+                             .format(n, len(observable)))
+        for q, (factor, basis) in enumerate(zip(observable, bases)):
+            factor, key = _factor_key(factor, basis.dim_hilbert)
+            if key not in keys[q]:
+                keys[q][key] = len(factors[q])
+                factors[q].append(factor)
+            ids[i, q] = keys[q][key]
+    return factors, ids
+
+
+def expectation_values(data, bases, observables, batch_axes=0):
+    """Expectation values :math:`\\mathrm{Tr} \\rho O` of factorized
+    observables.
+
+    Parameters
+    ----------
+    data : ndarray
+        Pauli vector tensor, optionally with leading batch axes.
+    bases : list of quantumsim.bases.PauliBasis
+        Bases of the qubit axes.
+    observables : list
+        Observables, see :func:`parse_observables`.
+    batch_axes : int
+        Number of leading batch axes of `data`, that are kept as is.
+
+    Returns
+    -------
+    ndarray
+        Array of shape `batch_shape + (n_observables,)` in double precision.
+    """
+    factors, ids = parse_observables(observables, bases)
+    n = len(bases)
+    batch_shape = data.shape[:batch_axes]
+    if len(observables) == 0:
+        return np.zeros(batch_shape + (0,))
+    if n == 0:
+        return np.repeat(np.asarray(data, dtype=np.float64)[..., None],
+                         len(observables), axis=-1)
+    if _use_table(factors, bases, len(observables)):
+        # Qubits may have different numbers of distinct factors
+        labels = [np.array([PAULI_LABELS.index(f) for f in fs])
+                  for fs in factors]
+        index = tuple(labels[q][ids[:, q]] for q in range(n))
+        table = pauli_table(data, bases, batch_axes)
+        return table[(slice(None),) * batch_axes + index]
+
+    # Batch axes go last, so that every prefix is a contiguous block
+    data = np.moveaxis(data, tuple(range(batch_axes)),
+                       tuple(range(n, n + batch_axes)))
+    tensor = data.reshape(1, -1)
+    parents = np.zeros(len(observables), dtype=int)
+    for q, (basis, fs) in enumerate(zip(bases, factors)):
+        overlaps = np.array([_overlaps(f, basis) for f in fs])
+        prefixes, parents = np.unique(parents * len(fs) + ids[:, q],
+                                      return_inverse=True)
+        rest = tensor.shape[1] // basis.dim_pauli
+        out = np.empty((len(prefixes), rest))
+        # Prefixes are sorted, so the children of every parent are adjacent
+        groups = np.flatnonzero(np.diff(prefixes // len(fs))) + 1
+        for rows in np.split(np.arange(len(prefixes)), groups):
+            parent = tensor[prefixes[rows[0]] // len(fs)]
+            out[rows] = np.dot(
+                overlaps[prefixes[rows] % len(fs)],
+                np.asarray(parent, dtype=np.float64).reshape(
+                    basis.dim_pauli, rest))
+        tensor = out
+    return tensor[parents].T.reshape(batch_shape + (len(observables),))
+
+
+def pauli_table(data, bases, batch_axes=0):
+    """Expectation values of all Pauli strings of two-level qubits.
+
+    Parameters
+    ----------
+    data : ndarray
+        Pauli vector tensor, optionally with leading batch axes.
+    bases : list of quantumsim.bases.PauliBasis
+        Two-level bases of the qubit axes.
+    batch_axes : int
+        Number of leading batch axes of `data`, that are kept as is.
+
+    Returns
+    -------
+    ndarray
+        Array of shape `batch_shape + (4,) * n_qubits`, indexed by labels
+        of Pauli strings in order `'IXYZ'`.
+    """
+    table = np.asarray(data, dtype=np.float64)
+    scale = 1.
+    for q, basis in enumerate(bases):
+        transform = _pauli_transform(basis)
+        if transform is None:
+            # The basis is twolevel_ixyz up to a normalization
+            scale *= np.sqrt(2)
+            continue
+        axis = q + batch_axes
+        table = np.moveaxis(np.tensordot(transform, table,
+                                         axes=([1], [axis])), 0, axis)
+    return table * scale if scale != 1. else table
+
+
+def _factor_key(factor, dim_hilbert):
+    """Validate a factor and return it together with a hashable key."""
+    if factor is None:
+        factor = 'I'
+    if isinstance(factor, str):
+        if len(factor) != 1 or factor not in PAULI_LABELS:
+            raise ValueError('Unknown Pauli label: {}'.format(factor))
+        if factor != 'I' and dim_hilbert != 2:
+            raise ValueError(
+                'Pauli label {} is defined for two-level qubits only, use a '
+                'matrix instead'.format(factor))
+        return factor, factor
+    factor = np.asarray(factor)
+    if factor.shape != (dim_hilbert, dim_hilbert):
+        raise ValueError('Factor must have shape {}, got {}'
+                         .format((dim_hilbert, dim_hilbert), factor.shape))
+    if not np.allclose(factor, factor.conj().T):
+        raise ValueError('Factors of observables must be Hermitian')
+    factor = factor.astype(complex)
+    return factor, factor.tobytes()
+
+
+def _overlaps(factor, basis):
+    """Overlaps :math:`\\mathrm{Tr}(B_x O)` of a factor with the basis
+    elements."""
+    if isinstance(factor, str):
+        return _pauli_overlaps(basis)[PAULI_LABELS.index(factor)] \
+            if basis.dim_hilbert == 2 else _identity_overlaps(basis)
+    return basis.hilbert_to_pauli_vector(factor).real
+
+
+@lru_cache(maxsize=64)
+def _identity_overlaps(basis):
+    overlaps = np.einsum('xii->x', basis.vectors).real
+    overlaps.flags.writeable = False
+    return overlaps
+
+
+@lru_cache(maxsize=64)
+def _pauli_overlaps(basis):
+    """Array of shape `(4, dim_pauli)` with overlaps of Pauli matrices with
+    the elements of a two-level basis."""
+    overlaps = np.einsum('xab,pba->px', basis.vectors, _paulis).real
+    overlaps.flags.writeable = False
+    return overlaps
+
+
+@lru_cache(maxsize=64)
+def _pauli_transform(basis):
+    """Matrix, that converts an axis of a Pauli vector to a table of Pauli
+    expectation values, or `None`, if it is a multiple of identity."""
+    overlaps = _pauli_overlaps(basis)
+    if overlaps.shape == (4, 4) and \
+            np.allclose(overlaps, np.sqrt(2) * np.identity(4)):
+        return None
+    return overlaps
+
+
+def _use_table(factors, bases, n_observables):
+    if not all(b.dim_hilbert == 2 for b in bases):
+        return False
+    if not all(isinstance(f, str) for fs in factors for f in fs):
+        return False
+    return n_observables >= _table_min_fraction * 4 ** len(bases)
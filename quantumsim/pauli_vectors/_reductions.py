@@ -0,0 +1,144 @@
+"""Reductions of Pauli vectors (diagonal, trace, partial trace, marginals).
+
+Every reduction contracts each qubit axis of a Pauli vector with a small
+functional: it either keeps the axis, extracts the diagonal of the
+single-qubit density matrix, or traces it out. Usually bases carry hints
+(:attr:`PauliBasis.computational_basis_indices` and
+:attr:`PauliBasis.trace_index`), that reduce these functionals to selecting
+some of the basis elements. In this case the reduction is done by gathering
+only the elements needed and summing them, without any complex arithmetic
+and :math:`d \\times d` basis matrices. Axes with bases, that lack hints, are
+contracted with the corresponding real-valued rows of basis matrices.
+"""
+import numpy as np
+
+KEEP = 'keep'
+DIAGONAL = 'diagonal'
+TRACE = 'trace'
+
+
+def reduce_axes(data, bases, kinds, batch_axes=0):
+    """Reduce every qubit axis of a Pauli vector tensor.
+
+    Parameters
+    ----------
+    data : ndarray
+        Pauli vector tensor, optionally with leading batch axes.
+    bases : list of quantumsim.bases.PauliBasis
+        Bases of the qubit axes.
+    kinds : list of str
+        What to do with every qubit axis: `'keep'` it as it is, take the
+        `'diagonal'` of the single-qubit density matrix (axis size becomes
+        `dim_hilbert`) or `'trace'` it out (axis is removed).
+    batch_axes : int
+        Number of leading batch axes of `data`, that are kept as is.
+
+    Returns
+    -------
+    ndarray
+        Result of the reduction, accumulated in double precision.
+    """
+    n = len(bases)
+    if data.ndim != n + batch_axes or len(kinds) != n:
+        raise ValueError('Number of axes of `data` ({}) does not match the '
+                         'number of bases ({}) and kinds ({})'
+                         .format(data.ndim, n, len(kinds)))
+    gather = [np.arange(d) for d in data.shape[:batch_axes]]
+    scale = 1.
+    einsum_args = []
+    out_indices = list(range(batch_axes))
+    for axis, (basis, kind) in enumerate(zip(bases, kinds)):
+        index = axis + batch_axes
+        if kind == KEEP:
+            gather.append(np.arange(basis.dim_pauli))
+            out_indices.append(index)
+        elif kind == DIAGONAL:
+            diagonal_indices = _diagonal_indices(basis)
+            if diagonal_indices is not None:
+                gather.append(diagonal_indices)
+                out_indices.append(index)
+            else:
+                gather.append(np.arange(basis.dim_pauli))
+                einsum_args.append(basis.computational_basis_vectors.real)
+                einsum_args.append([index + n + batch_axes, index])
+                out_indices.append(index + n + batch_axes)
+        elif kind == TRACE:
+            if basis.trace_index is not None:
+                # Hint is normalized: Tr(v) = sqrt(d) for this element only
+                gather.append(np.array([basis.trace_index]))
+                scale *= np.trace(basis.vectors[basis.trace_index]).real
+            else:
+                diagonal_indices = _diagonal_indices(basis)
+                if diagonal_indices is not None:
+                    gather.append(diagonal_indices)
+                else:
+                    gather.append(np.arange(basis.dim_pauli))
+                    einsum_args.append(
+                        np.einsum('xii->x', basis.vectors).real)
+                    einsum_args.append([index])
+        else:
+            raise ValueError('Unknown reduction kind: {}'.format(kind))
+
+    if all(np.array_equal(g, np.arange(d))
+           for g, d in zip(gather, data.shape)):
+        # Nothing to select
+        gathered = data
+    else:
+        gathered = data[np.ix_(*gather)]
+    result = np.einsum(np.asarray(gathered, dtype=np.float64),
+                       list(range(n + batch_axes)),
+                       *einsum_args, out_indices, optimize=True)
+    return result * scale if scale != 1. else result
+
+
+def select_outcomes(data, bases, outcomes, batch_axes=0):
+    """Diagonal elements of a density matrix, that correspond to given
+    computational basis states.
+
+    For bases with hints this is a direct lookup of a single element of
+    the Pauli vector per state. Axes with bases, that lack hints, are
+    reduced to diagonals first.
+
+    Parameters
+    ----------
+    data : ndarray
+        Pauli vector tensor, optionally with leading batch axes.
+    bases : list of quantumsim.bases.PauliBasis
+        Bases of the qubit axes.
+    outcomes : ndarray
+        Integer array of shape `(n_states, n_qubits)`.
+    batch_axes : int
+        Number of leading batch axes of `data`, that are kept as is.
+
+    Returns
+    -------
+    ndarray
+        Array of shape `batch_shape + (n_states,)` in double precision.
+    """
+    indices = [_diagonal_indices(b) for b in bases]
+    if any(i is None for i in indices):
+        data = reduce_axes(data, bases,
+                           [KEEP if i is not None else DIAGONAL
+                            for i in indices], batch_axes)
+        indices = [i if i is not None else np.arange(b.dim_hilbert)
+                   for i, b in zip(indices, bases)]
+    index = tuple(i[outcomes[:, axis]] for axis, i in enumerate(indices))
+    return np.asarray(data[(slice(None),) * batch_axes + index],
+                      dtype=np.float64)
+
+
+def _diagonal_indices(basis):
+    """Indices of basis elements, that form the diagonal of a single-qubit
+    density matrix, or `None`, if the diagonal is not a selection of
+    elements."""
+    indices = [basis.computational_basis_indices[i]
+               for i in range(basis.dim_hilbert)]
+    if any(i is None for i in indices):
+        return None
+    return np.array(indices)
+
+
+def trace_row(basis):
+    """Real-valued row of shape `(1, dim_pauli)`, that traces out a qubit
+    axis in `basis`."""
+    return np.einsum('xii->x', basis.vectors).real.reshape(1, -1)
@@ -0,0 +1,264 @@
+import warnings
+
+import numpy as np
+import pytools
+
+from quantumsim.algebra.algebra import dm_to_pv, pv_to_dm
+from .numpy import PauliVectorNumpy, _working_dtype
+from .pauli_vector import PauliVectorBase, memoized, _single_qubit_pv
+from ._contraction import contraction_plan
+from ._reductions import reduce_axes, KEEP, DIAGONAL, TRACE
+
+
+class PauliVectorBatch(PauliVectorNumpy):
+    """A batch of Pauli vectors, that share the same bases.
+
+    The data is stored as a single Numpy array with an extra leading batch
+    axis, so that every PTM is applied to all members of the batch in one
+    contraction. This is useful, when the same circuit is run on many
+    initial states (for example, during process tomography). Results of
+    reductions (`trace`, `diagonal`, `meas_prob`, `marginals`, etc.) have
+    an extra leading batch axis.
+
+    Parameters
+    ----------
+    bases : list of quantumsim.bases.PauliBasis
+        A descrption of the basis for the subsystems.
+    pv : array or None
+        Pauli vectors of the batch members, stacked along the first axis.
+        If `None`, all `batch_size` members are initialized in
+        :math:`\\left| 0 \\cdots 0 \\right\\rangle` state.
+    batch_size : int or None
+        Number of Pauli vectors in a batch. Must be provided, if `pv` is
+        `None`.
+    force : bool
+        By default creation of too large batch (more than :math:`2^22`
+        elements in total in double precision) is not allowed. Set this to
+        `True` if you know what you are doing.
+    dtype : numpy.float32, numpy.float64 or None
+        Working precision, see :class:`PauliVectorNumpy`.
+    """
+
+    _batch_axes = 1
+
+    # noinspection PyMissingConstructor
+    def __init__(self, bases, pv=None, *, batch_size=None, force=False,
+                 dtype=None):
+        # Batches of PTMs are not split between threads
+        self.threads = 1
+        self._dtype = _working_dtype(dtype, pv)
+        PauliVectorBase.__init__(self, bases, pv, force=force)
+        if pv is None:
+            if batch_size is None:
+                raise ValueError(
+                    'Either `pv` or `batch_size` must be provided.')
+        elif not isinstance(pv, np.ndarray):
+            raise ValueError(
+                "`pv` should be Numpy array or None, got type `{}`"
+                .format(type(pv)))
+        else:
+            if pv.shape[1:] != self.dim_pauli or len(pv.shape) == 0:
+                raise ValueError(
+                    '`bases` Pauli dimensionality should be the same as the '
+                    'shape of `data` array without the batch axis.\n'
+                    ' - bases shapes: {}\n - data shape: {}'
+                    .format(self.dim_pauli, pv.shape))
+            if pv.dtype not in (np.float16, np.float32, np.float64):
+                raise ValueError(
+                    '`pv` must have floating point data type, got {}'
+                    .format(pv.dtype))
+            if batch_size is not None and batch_size != pv.shape[0]:
+                raise ValueError(
+                    '`batch_size` ({}) does not match the first dimension '
+                    'of `pv` ({})'.format(batch_size, pv.shape[0]))
+            batch_size = pv.shape[0]
+        if self._exceeds_size_max(batch_size * self.size) and not force:
+            raise ValueError(
+                'Batch of density matrices is going to have {} items. It '
+                'is probably too much. If you know what you are doing, '
+                'pass `force=True` argument to the constructor.'
+                .format(batch_size * self.size))
+
+        self._buffers = [None, None]
+        self._data_buffer = None
+        if pv is not None:
+            self._data = pv.astype(self._dtype, copy=False)
+            self._exposed = self._data is pv
+        else:
+            self._data = self._work_buffer(
+                0, (batch_size,) + self.dim_pauli, self._dtype)
+            self._data_buffer = 0
+            # Not every basis contains the ground state as an element, so
+            # it is built qubit by qubit
+            ground_state = np.ones(())
+            for basis in self.bases:
+                ground_state = np.multiply.outer(
+                    ground_state, _single_qubit_pv(basis, 0))
+            self._data[:] = ground_state
+
+    @classmethod
+    def from_pv(cls, pv, bases, *, force=False):
+        return cls(bases, pv, force=force)
+
+    @classmethod
+    def from_dm(cls, dm, bases, *, force=False):
+        """Create a batch from a stack of density matrices.
+
+        Parameters
+        ----------
+        dm : array
+            Density matrices, stacked along the first axis.
+        bases : list of quantumsim.bases.PauliBasis or PauliBasis
+            Bases of the qubits. If a single basis is provided, it is used
+            for all qubits.
+        force : bool
+            See :class:`PauliVectorBatch`.
+        """
+        if not hasattr(bases, '__iter__'):
+            n_qubits = int(round(np.log(dm.shape[1]) /
+                                 np.log(bases.dim_hilbert)))
+            bases = [bases] * n_qubits
+        return cls(bases, dm_to_pv(dm, bases), force=force)
+
+    @classmethod
+    def from_pauli_vectors(cls, pauli_vectors, *, force=False):
+        """Create a batch from Pauli vectors in the same bases.
+
+        Parameters
+        ----------
+        pauli_vectors : list of quantumsim.pauli_vectors.PauliVectorBase
+        force : bool
+            See :class:`PauliVectorBatch`.
+        """
+        bases = pauli_vectors[0].bases
+        for i, pv in enumerate(pauli_vectors[1:], 1):
+            if pv.bases != bases:
+                raise ValueError(
+                    'Bases of the Pauli vector number {} do not match the '
+                    'bases of the Pauli vector number 0'.format(i))
+        return cls(bases, np.stack([pv.to_pv() for pv in pauli_vectors]),
+                   force=force)
+
+    def to_dm(self):
+        return pv_to_dm(self._data, self.bases)
+
+    @property
+    def batch_size(self):
+        return self._data.shape[0]
+
+    def __len__(self):
+        return self.batch_size
+
+    def __getitem__(self, index):
+        """Return a copy of the batch member number `index` as a
+        :class:`PauliVectorNumpy`."""
+        return PauliVectorNumpy(self.bases, self._data[index].copy(),
+                                force=True, dtype=self._dtype)
+
+    def apply_ptm(self, ptm, *qubits):
+        """Apply a PTM to all members of the batch.
+
+        Parameters
+        ----------
+        ptm : array
+            Pauli transfer matrix. If it has an extra leading axis of the
+            size `batch_size`, PTM number `i` is applied to the batch
+            member number `i`.
+        q0, ..., qN : int
+            Indices of qubits to act on.
+        """
+        if len(ptm.shape) not in (2 * len(qubits), 2 * len(qubits) + 1):
+            raise ValueError(
+                '{}-qubit PTM must have {} dimensions (or {} for a batch of '
+                'PTMs), got {}'.format(len(qubits), 2*len(qubits),
+                                       2*len(qubits) + 1, len(ptm.shape)))
+        if len(ptm.shape) % 2 == 1 and ptm.shape[0] != self.batch_size:
+            raise ValueError(
+                'Number of PTMs in a batch ({}) does not match the batch '
+                'size ({})'.format(ptm.shape[0], self.batch_size))
+        for q in qubits:
+            self._validate_qubit(q, 'qubit')
+        plan = contraction_plan(self._data.shape,
+                                tuple(q + 1 for q in qubits), ptm.shape)
+        self._apply_plan(plan, ptm)
+
+    @memoized
+    def diagonal(self, *, get_data=True):
+        """Diagonals of the density matrices of batch members.
+
+        Returns
+        -------
+        array
+            Array of shape `(batch_size, prod(dim_hilbert))`.
+        """
+        return reduce_axes(self._data, self.bases,
+                           [DIAGONAL] * self.n_qubits, batch_axes=1).reshape(
+            self.batch_size, pytools.product(self.dim_hilbert))
+
+    @memoized
+    def trace(self):
+        """Traces of the density matrices of batch members."""
+        return reduce_axes(self._data, self.bases, [TRACE] * self.n_qubits,
+                           batch_axes=1)
+
+    def partial_trace(self, *qubits):
+        for q in qubits:
+            self._validate_qubit(q, 'qubit')
+        traced_pv = reduce_axes(
+            self._data, self.bases,
+            [KEEP if i in qubits else TRACE for i in range(self.n_qubits)],
+            batch_axes=1)
+        kept = sorted(qubits)
+        traced_pv = np.transpose(
+            traced_pv, [0] + [kept.index(q) + 1 for q in qubits])
+        return self.__class__([self.bases[q] for q in qubits],
+                              np.ascontiguousarray(traced_pv),
+                              dtype=self._dtype)
+
+    @memoized
+    def meas_prob(self, qubit):
+        """Diagonals of the reduced density matrices of a qubit for all
+        batch members.
+
+        Returns
+        -------
+        array
+            Array of shape `(batch_size, dim_hilbert)`.
+        """
+        self._validate_qubit(qubit, 'qubit')
+        return reduce_axes(
+            self._data, self.bases,
+            [DIAGONAL if i == qubit else TRACE
+             for i in range(self.n_qubits)], batch_axes=1)
+
+    def renormalize(self):
+        """Renormalize all batch members to trace one."""
+        tr = self.trace()
+        nonzero = tr > 1e-8
+        if not np.all(nonzero):
+            warnings.warn(
+                "Density matrix trace is 0 for some of the batch members; "
+                "likely your further computation will fail. Have you "
+                "projected DM on a state with zero weight?")
+        factors = np.ones_like(tr)
+        factors[nonzero] = 1 / tr[nonzero]
+        self._own_data()
+        self._data *= factors.reshape((-1,) + (1,) * self.n_qubits)
+        self.version += 1
+
+    def copy(self):
+        pv = self.__class__(self.bases, self._data.copy(), force=True)
+        pv._exposed = False
+        pv.norm = np.copy(self.norm)
+        return pv
+
+    @classmethod
+    def _from_checkpoint(cls, bases, arrays, attrs):
+        return cls(bases, arrays[0], force=True)
+
+    def measure(self, qubit, rng=None):
+        """Not supported: outcomes of batch members may differ, while their
+        bases must be the same. Use :func:`project` instead."""
+        raise NotImplementedError(
+            'Batch members can not be measured together, since they may '
+            'collapse to different outcomes. Use `project` instead.')
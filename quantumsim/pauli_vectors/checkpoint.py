@@ -0,0 +1,228 @@
+"""Checkpoints of Pauli vectors on disk.
+
+A checkpoint is a single file, that consists of a short JSON header and the
+raw data arrays of a Pauli vector, aligned to 64 bytes, so that the data can
+be memory-mapped back without copying. Bases are stored as compact
+descriptors: a name of a library basis (see :mod:`quantumsim.bases`), its
+Hilbert dimensionality and indices of the subbasis elements. Bases, that
+are not subbases of a library basis (with the same matrices and labels),
+are stored with their matrices and labels.
+"""
+import json
+import os
+import struct
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+
+from quantumsim.bases import PauliBasis, general, gell_mann
+from quantumsim.bases.library import twolevel_0xy1, twolevel_ixyz
+from .pauli_vector import PauliVectorBase
+
+_MAGIC = b'QSIMPV\x00\x01'
+_FORMAT = 1
+_ALIGNMENT = 64
+# Size of pieces of large arrays, written at once
+_CHUNK_BYTES = 2**24
+_library = {
+    'general': general,
+    'gell_mann': gell_mann,
+    # Two-level bases are constants, not families of bases
+    'twolevel_0xy1': lambda dim_hilbert: (
+        twolevel_0xy1 if dim_hilbert == 2 else None),
+    'twolevel_ixyz': lambda dim_hilbert: (
+        twolevel_ixyz if dim_hilbert == 2 else None),
+}
+_writer = None
+
+
+def save(pauli_vector, path, *, background=False):
+    """Write a checkpoint of a Pauli vector to a file.
+
+    The file is written under a temporary name and renamed, when complete,
+    so that an existing checkpoint is never left half-overwritten.
+
+    Parameters
+    ----------
+    pauli_vector : quantumsim.pauli_vectors.PauliVectorBase
+        Pauli vector to save.
+    path : str
+        Name of the file.
+    background : bool
+        If `True`, data is copied in memory and written in a background
+        thread, while the computation continues. Checkpoints are written in
+        the order they were requested. Data, that is stored on disk already
+        (for example, by :class:`PauliVectorMemmap`), is written immediately.
+
+    Returns
+    -------
+    concurrent.futures.Future or None
+        If `background` is `True`, a future, that is done, when the file is
+        written.
+    """
+    arrays, attrs = pauli_vector._checkpoint()
+    header = _header(pauli_vector, arrays, attrs)
+    if not background:
+        _write(path, header, arrays)
+        return None
+    if any(isinstance(a, np.memmap) for a in arrays):
+        future = Future()
+        _write(path, header, arrays)
+        future.set_result(None)
+        return future
+    # Data may be overwritten by the next operation, so it is copied now
+    arrays = [np.array(a, order='C') for a in arrays]
+    global _writer
+    if _writer is None:
+        _writer = ThreadPoolExecutor(max_workers=1)
+    return _writer.submit(_write, path, header, arrays)
+
+
+def load(path, *, mmap=True):
+    """Read a Pauli vector from a checkpoint.
+
+    Parameters
+    ----------
+    path : str
+        Name of the file.
+    mmap : bool
+        If `True`, data is memory-mapped (copy-on-write, the file is never
+        modified) instead of being read into memory.
+
+    Returns
+    -------
+    quantumsim.pauli_vectors.PauliVectorBase
+        Pauli vector of the same class, as the one saved.
+    """
+    with open(path, 'rb') as f:
+        magic = f.read(len(_MAGIC))
+        if magic != _MAGIC:
+            raise ValueError('{} is not a Pauli vector checkpoint'
+                             .format(path))
+        (header_size,) = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_size).decode('utf-8'))
+        if header['format'] > _FORMAT:
+            raise ValueError('Checkpoint format {} is not supported, '
+                             'update Quantumsim'.format(header['format']))
+        data_start = _aligned(len(_MAGIC) + 8 + header_size)
+        arrays = []
+        for spec in header['arrays']:
+            dtype = np.dtype(spec['dtype'])
+            shape = tuple(spec['shape'])
+            offset = data_start + spec['offset']
+            if mmap and int(np.prod(shape)) > 0:
+                arrays.append(np.memmap(path, dtype=dtype, mode='c',
+                                        offset=offset, shape=shape))
+            else:
+                f.seek(offset)
+                arrays.append(np.fromfile(
+                    f, dtype=dtype, count=int(np.prod(shape))).reshape(shape))
+
+    classes = _subclasses(PauliVectorBase)
+    if header['class'] not in classes:
+        raise ValueError('Unknown Pauli vector class: {}'
+                         .format(header['class']))
+    table = [_basis_from_descriptor(d) for d in header['bases']]
+    bases = [table[i] for i in header['qubits']]
+    pauli_vector = classes[header['class']]._from_checkpoint(
+        bases, arrays, header['attrs'])
+    norm = header['norm']
+    pauli_vector.norm = np.array(norm) if isinstance(norm, list) else norm
+    return pauli_vector
+
+
+def basis_descriptor(basis):
+    """Compact description of a basis, that can be serialized to JSON.
+
+    Parameters
+    ----------
+    basis : quantumsim.bases.PauliBasis
+
+    Returns
+    -------
+    dict
+    """
+    labels = [str(label) for label in basis.labels]
+    for name, func in _library.items():
+        root = func(basis.dim_hilbert)
+        if root is None:
+            continue
+        distances = np.linalg.norm(
+            (basis.vectors[:, None] - root.vectors[None]).reshape(
+                basis.dim_pauli, root.dim_pauli, -1), axis=2)
+        indices = np.argmin(distances, axis=1)
+        if (np.allclose(distances[np.arange(basis.dim_pauli), indices], 0)
+                and [str(root.labels[i]) for i in indices] == labels):
+            descriptor = {'library': name, 'dim_hilbert': basis.dim_hilbert}
+            if not np.array_equal(indices, np.arange(root.dim_pauli)):
+                descriptor['indices'] = indices.tolist()
+            return descriptor
+    return {'vectors_real': basis.vectors.real.tolist(),
+            'vectors_imag': basis.vectors.imag.tolist(),
+            'labels': labels}
+
+
+def _basis_from_descriptor(descriptor):
+    if 'library' in descriptor:
+        basis = _library[descriptor['library']](descriptor['dim_hilbert'])
+        if 'indices' in descriptor:
+            basis = basis.subbasis(descriptor['indices'])
+        return basis
+    vectors = (np.array(descriptor['vectors_real']) +
+               1j * np.array(descriptor['vectors_imag']))
+    return PauliBasis(vectors, descriptor['labels'])
+
+
+def _header(pauli_vector, arrays, attrs):
+    table = []
+    qubits = []
+    for basis in pauli_vector.bases:
+        descriptor = basis_descriptor(basis)
+        if descriptor not in table:
+            table.append(descriptor)
+        qubits.append(table.index(descriptor))
+    specs = []
+    offset = 0
+    for a in arrays:
+        specs.append({'dtype': a.dtype.str, 'shape': list(a.shape),
+                      'offset': offset})
+        offset = _aligned(offset + a.nbytes)
+    norm = pauli_vector.norm
+    return {
+        'format': _FORMAT,
+        'class': pauli_vector.__class__.__name__,
+        'bases': table,
+        'qubits': qubits,
+        'norm': norm.tolist() if isinstance(norm, np.ndarray) else norm,
+        'attrs': attrs,
+        'arrays': specs,
+    }
+
+
+def _write(path, header, arrays):
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _aligned(len(_MAGIC) + 8 + len(header_bytes))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(_MAGIC)
+        f.write(struct.pack('<Q', len(header_bytes)))
+        f.write(header_bytes)
+        for spec, a in zip(header['arrays'], arrays):
+            f.write(b'\0' * (data_start + spec['offset'] - f.tell()))
+            flat = np.ascontiguousarray(a).reshape(-1)
+            step = max(_CHUNK_BYTES // max(flat.itemsize, 1), 1)
+            for start in range(0, flat.size, step):
+                f.write(memoryview(flat[start:start + step]).cast('B'))
+    os.replace(tmp_path, path)
+
+
+def _aligned(offset):
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _subclasses(cls):
+    classes = {}
+    for subclass in cls.__subclasses__():
+        classes[subclass.__name__] = subclass
+        classes.update(_subclasses(subclass))
+    return classes
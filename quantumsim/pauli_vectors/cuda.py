@@ -130,6 +130,7 @@ class PauliVectorCuda(PauliVectorBase):
         else:
             raise NotImplementedError('Applying {}-qubit PTM is not '
                                       'implemented in the active backend.')
+        self.version += 1
 
     def _apply_two_qubit_ptm(self, qubit0, qubit1, ptm):
         """Apply a two-qubit Pauli transfer matrix to qubit `bit0` and `bit1`.
@@ -400,6 +401,7 @@ class PauliVectorCuda(PauliVectorBase):
         tr = self.trace()
         if tr > 1e-8:
             self._data *= np.float(1 / tr)
+            self.version += 1
         else:
             warnings.warn(
                 "Density matrix trace is 0; likely your further computation "
@@ -0,0 +1,355 @@
+import os
+import shutil
+import tempfile
+import weakref
+
+import numpy as np
+import pytools
+
+from .numpy import PauliVectorNumpy, _working_dtype
+from .pauli_vector import PauliVectorBase, memoized
+from ._contraction import blocks, contraction_plan
+from ._reductions import trace_row
+
+
+class PauliVectorMemmap(PauliVectorBase):
+    """A Pauli vector, that is stored in a memory-mapped file on disk.
+
+    This backend is intended for states, that do not fit in RAM. PTMs are
+    applied block by block, where a block is a slice of the state along the
+    axes, that PTM does not touch, so that only a bounded working set
+    (`chunk_size` elements) is kept in memory. Reductions (`diagonal`,
+    `meas_prob`, `trace`, `partial_trace`) are streamed over the file in the
+    same manner.
+
+    Blocks are slices along the leading storage axes, that are not touched
+    by a PTM. Hence, if a PTM acts on the last storage axes, every block is
+    a single contiguous piece of the file and I/O is purely sequential.
+    Storage order of the qubits may be chosen with `axis_order`: the qubits,
+    that are acted upon most often, should go last.
+
+    Parameters
+    ----------
+    bases : list of quantumsim.bases.PauliBasis
+        A descrption of the basis for the subsystems.
+    pv : array or None
+        Pauli vector, that represents the density matrix in the selected
+        bases, in the order of qubits (not in the storage order). If `None`,
+        density matrix is initialized in
+        :math:`\\left| 0 \\cdots 0 \\right\\rangle` state. An `np.memmap`,
+        that is contiguous in the storage order, is used as is, without
+        copying, and is never written to; other arrays are copied to disk
+        block by block.
+    force : bool
+        By default creation of too large density matrix (more than
+        :math:`2^34` elements in double precision) is not allowed. Set this
+        to `True` if you know what you are doing.
+    dtype : numpy.float32, numpy.float64 or None
+        Working precision, see :class:`PauliVectorNumpy`.
+    directory : str or None
+        A directory to store the files in. A temporary directory is created
+        inside of it and removed, when the Pauli vector is garbage
+        collected. If `None`, system default for temporary files is used.
+    chunk_size : int
+        Maximal number of elements of a block, processed in memory at once.
+    axis_order : tuple of int or None
+        Storage order of qubits: storage axis number `i` holds the qubit
+        number `axis_order[i]`. If `None`, qubits are stored in their order.
+    """
+    # Limited by disk space rather than by memory
+    _size_max = 2**34
+
+    def __init__(self, bases, pv=None, *, force=False, dtype=None,
+                 directory=None, chunk_size=2**20, axis_order=None):
+        self._dtype = _working_dtype(dtype, pv)
+        super().__init__(bases, pv, force=force)
+        if axis_order is None:
+            axis_order = tuple(range(self.n_qubits))
+        else:
+            axis_order = tuple(axis_order)
+            if sorted(axis_order) != list(range(self.n_qubits)):
+                raise ValueError(
+                    '`axis_order` must be a permutation of qubit indices, '
+                    'got {}'.format(axis_order))
+        if chunk_size < 1:
+            raise ValueError('`chunk_size` must be positive, got {}'
+                             .format(chunk_size))
+        self.axis_order = axis_order
+        self.chunk_size = chunk_size
+        self._storage_axes = tuple(int(i) for i in np.argsort(axis_order))
+
+        self._directory = tempfile.mkdtemp(prefix='quantumsim-', dir=directory)
+        self._finalizer = weakref.finalize(
+            self, shutil.rmtree, self._directory, ignore_errors=True)
+        # Similarly to `PauliVectorNumpy`, two files are used as work
+        # buffers, that are swapped on every PTM application, and `_data`
+        # is either a map of one of them, or a map, that is not used as a
+        # work buffer (provided by the user or returned by `to_pv`).
+        self._n_files = 0
+        self._files = [self._new_file(), self._new_file()]
+        self._data_buffer = None
+
+        shape = tuple(self.dim_pauli[q] for q in axis_order)
+        if pv is None:
+            # A new file is filled with zeros
+            self._data = self._work_map(0, shape)
+            self._data_buffer = 0
+            self._data[(0,) * self.n_qubits] = 1.
+        elif isinstance(pv, np.ndarray):
+            if self.dim_pauli != pv.shape:
+                raise ValueError(
+                    '`bases` Pauli dimensionality should be the same as the '
+                    'shape of `data` array.\n'
+                    ' - bases shapes: {}\n - data shape: {}'
+                    .format(self.dim_pauli, pv.shape))
+            if pv.dtype not in (np.float16, np.float32, np.float64):
+                raise ValueError(
+                    '`pv` must have floating point data type, got {}'
+                    .format(pv.dtype))
+            pv_stored = np.transpose(pv, axis_order)
+            if (isinstance(pv, np.memmap) and pv.dtype == self._dtype and
+                    pv_stored.flags.c_contiguous):
+                self._data = pv_stored
+            else:
+                self._data = self._work_map(0, shape)
+                self._data_buffer = 0
+                for index in blocks(shape, range(len(shape)), chunk_size):
+                    self._data[index] = pv_stored[index]
+        else:
+            raise ValueError(
+                "`pv` should be Numpy array or None, got type `{}`"
+                .format(type(pv)))
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def directory(self):
+        """Directory, where the data files are stored."""
+        return self._directory
+
+    def to_pv(self):
+        """Get data in a form of a (memory-mapped) Numpy array.
+
+        The array returned is a view of a file, that is not reused as a work
+        file, so it keeps the data after further operations on the Pauli
+        vector.
+        """
+        self._detach_data()
+        return np.transpose(self._data, self._storage_axes)
+
+    def flush(self):
+        """Write any changes in the data to disk."""
+        self._data.flush()
+
+    def apply_ptm(self, ptm, *qubits):
+        if len(ptm.shape) != 2 * len(qubits):
+            raise ValueError(
+                '{}-qubit PTM must have {} dimensions, got {}'
+                .format(len(qubits), 2*len(qubits), len(ptm.shape)))
+        for q in qubits:
+            self._validate_qubit(q, 'qubit')
+        axes = tuple(self._storage_axes[q] for q in qubits)
+        # Validates the PTM shape for the whole state
+        plan = contraction_plan(self._data.shape, axes, ptm.shape)
+        ptm = ptm.astype(self._dtype, copy=False)
+        untouched = tuple(i for i in range(self.n_qubits) if i not in axes)
+        self._stream(lambda block: contraction_plan(
+                        block.shape, axes, ptm.shape)(block, ptm),
+                     plan.shape_out, untouched)
+
+    @memoized
+    def diagonal(self, *, get_data=True):
+        diag = self._contract_axes(
+            [b.computational_basis_vectors.real for b in self.bases])
+        return diag.reshape(pytools.product(self.dim_hilbert))
+
+    @memoized
+    def trace(self):
+        return self._contract_axes(
+            [trace_row(b) for b in self.bases]).item()
+
+    def partial_trace(self, *qubits):
+        for q in qubits:
+            self._validate_qubit(q, 'qubit')
+        traced_pv = self._contract_axes(
+            [np.identity(b.dim_pauli) if i in qubits else trace_row(b)
+             for i, b in enumerate(self.bases)])
+        traced_pv = traced_pv.reshape(
+            [b.dim_pauli for i, b in enumerate(self.bases) if i in qubits])
+        kept = sorted(qubits)
+        traced_pv = np.transpose(traced_pv, [kept.index(q) for q in qubits])
+        return PauliVectorNumpy([self.bases[q] for q in qubits],
+                                np.ascontiguousarray(traced_pv),
+                                dtype=self._dtype)
+
+    @memoized
+    def meas_prob(self, qubit):
+        self._validate_qubit(qubit, 'qubit')
+        return self._contract_axes(
+            [b.computational_basis_vectors.real if i == qubit
+             else trace_row(b) for i, b in enumerate(self.bases)]
+        ).reshape(self.bases[qubit].dim_hilbert)
+
+    @memoized
+    def purity(self):
+        purity = 0.
+        for index in blocks(self._data.shape, range(self.n_qubits),
+                            self.chunk_size):
+            block = np.asarray(self._data[index], dtype=np.float64)
+            purity += np.dot(block.ravel(), block.ravel())
+        return purity
+
+    @memoized
+    def _element_weights(self, qubit):
+        self._validate_qubit(qubit, 'qubit')
+        axis = self._storage_axes[qubit]
+        weights = np.zeros(self.bases[qubit].dim_pauli)
+        for index in blocks(self._data.shape, range(self.n_qubits),
+                            self.chunk_size):
+            block = np.asarray(self._data[index], dtype=np.float64)
+            indices = list(range(self.n_qubits))
+            weights[index[axis]] += np.einsum(block, indices, block,
+                                              indices, [axis])
+        return weights
+
+    def _select_elements(self, qubit, indices):
+        axis = self._storage_axes[qubit]
+        shape = list(self._data.shape)
+        shape[axis] = len(indices)
+        self._stream(lambda block: np.take(block, indices, axis=axis),
+                     tuple(shape),
+                     [i for i in range(self.n_qubits) if i != axis])
+
+    def _scale(self, factor):
+        self._stream(lambda block: block * factor, self._data.shape,
+                     tuple(range(self.n_qubits)))
+
+    def copy(self):
+        """Copy the Pauli vector to new work files in the same directory."""
+        pv = self.__class__(
+            self.bases, force=True, dtype=self._dtype,
+            directory=os.path.dirname(self._directory),
+            chunk_size=self.chunk_size, axis_order=self.axis_order)
+        for index in blocks(self._data.shape, range(self.n_qubits),
+                            self.chunk_size):
+            pv._data[index] = self._data[index]
+        pv.norm = self.norm
+        return pv
+
+    def _checkpoint(self):
+        return [self._data], {'axis_order': list(self.axis_order),
+                              'chunk_size': self.chunk_size}
+
+    @classmethod
+    def _from_checkpoint(cls, bases, arrays, attrs):
+        axis_order = tuple(attrs['axis_order'])
+        return cls(bases, np.transpose(arrays[0], np.argsort(axis_order)),
+                   force=True, chunk_size=attrs['chunk_size'],
+                   axis_order=axis_order)
+
+    def _add_qubit(self, basis, pv):
+        # New qubit is stored last
+        n = self.n_qubits
+        self._stream(lambda block: block[..., None] * pv,
+                     self._data.shape + (basis.dim_pauli,), range(n),
+                     lambda index: index + (slice(None),))
+        self._set_axis_order(self.axis_order + (n,))
+
+    def _reset(self, qubit, basis, pv):
+        # Reset qubit is moved to the end of the storage, since it is
+        # likely to be acted upon soon.
+        axis = self._storage_axes[qubit]
+        row = trace_row(self.bases[qubit]).ravel()
+        shape = self._data.shape
+        self._stream(
+            lambda block: np.tensordot(block, row, ([axis], [0]))[..., None]
+            * pv,
+            shape[:axis] + shape[axis + 1:] + (basis.dim_pauli,),
+            [i for i in range(self.n_qubits) if i != axis],
+            lambda index: index[:axis] + index[axis + 1:] + (slice(None),))
+        self._set_axis_order(
+            tuple(q for q in self.axis_order if q != qubit) + (qubit,))
+
+    def _remove_qubit(self, qubit):
+        axis = self._storage_axes[qubit]
+        row = trace_row(self.bases[qubit]).ravel()
+        shape = self._data.shape
+        self._stream(lambda block: np.tensordot(block, row, ([axis], [0])),
+                     shape[:axis] + shape[axis + 1:],
+                     [i for i in range(self.n_qubits) if i != axis],
+                     lambda index: index[:axis] + index[axis + 1:])
+        self._set_axis_order(tuple(q - 1 if q > qubit else q
+                                   for q in self.axis_order if q != qubit))
+
+    def _set_axis_order(self, axis_order):
+        self.axis_order = axis_order
+        self._storage_axes = tuple(int(i) for i in np.argsort(axis_order))
+
+    def _contract_axes(self, matrices):
+        """Contract each qubit axis of the state with a matrix (qubit `i`
+        with `matrices[i]` of shape `(r_i, dim_pauli_i)`), streaming the
+        data from disk. The result of shape `(r_0, ..., r_N)` is accumulated
+        in double precision."""
+        n = self.n_qubits
+        matrices = [matrices[q] for q in self.axis_order]
+        result = np.zeros([m.shape[0] for m in matrices], dtype=np.float64)
+        for index in blocks(self._data.shape, range(n), self.chunk_size):
+            einsum_args = [np.asarray(self._data[index], dtype=np.float64),
+                           list(range(n))]
+            for i, (m, s) in enumerate(zip(matrices, index)):
+                einsum_args.append(m[:, s])
+                einsum_args.append([n + i, i])
+            einsum_args.append(list(range(n, 2 * n)))
+            result += np.einsum(*einsum_args, optimize=True)
+        return np.transpose(result, self._storage_axes)
+
+    def _stream(self, func, shape_out, axes, index_out=None):
+        """Write `func(block)` for every block of data to the work file,
+        that does not hold the data now, and swap the files. Blocks are
+        split along storage `axes`, that `func` must preserve. If provided,
+        `index_out(index)` gives the index of the result of `func` in the
+        output."""
+        i_out = 1 if self._data_buffer == 0 else 0
+        out = self._work_map(i_out, shape_out)
+        for index in blocks(self._data.shape, axes, self.chunk_size):
+            result = func(np.array(self._data[index]))
+            out[index if index_out is None else index_out(index)] = result
+        self._data = out
+        self._data_buffer = i_out
+        self.version += 1
+
+    def _new_file(self):
+        filename = os.path.join(self._directory,
+                                'data{}.bin'.format(self._n_files))
+        self._n_files += 1
+        return filename
+
+    def _detach_data(self):
+        """Make sure, that the file holding the data is not reused as a
+        work file: the next operation writes to a new one instead."""
+        if self._data_buffer is None:
+            return
+        filename = self._files[self._data_buffer]
+        self._files[self._data_buffer] = self._new_file()
+        self._data_buffer = None
+        try:
+            # The maps stay valid on POSIX systems, and the space is freed,
+            # when they are closed. Otherwise the file is removed together
+            # with the directory.
+            os.remove(filename)
+        except OSError:
+            pass
+
+    def _work_map(self, index, shape):
+        """Map work file `index` with a given shape. The file only grows,
+        so that the maps, that may still be referenced, stay valid."""
+        filename = self._files[index]
+        n_bytes = max(pytools.product(shape) * self._dtype.itemsize, 1)
+        if not os.path.exists(filename) or \
+                os.path.getsize(filename) < n_bytes:
+            with open(filename, 'ab') as f:
+                f.truncate(n_bytes)
+        return np.memmap(filename, dtype=self._dtype, mode='r+',
+                         shape=tuple(shape))
@@ -0,0 +1,424 @@
+import numpy as np
+import pytools
+
+from .numpy import PauliVectorNumpy, _working_dtype
+from .pauli_vector import PauliVectorBase, MemoryFootprint, memoized
+from ._reductions import trace_row
+
+
+class PauliVectorMPS(PauliVectorBase):
+    """A Pauli vector, that is stored as a matrix product state.
+
+    The Pauli vector is a chain of tensors, one per qubit, of the shape
+    `(bond_left, dim_pauli, bond_right)`, in the same per-qubit bases, as
+    for the other backends. This is the same as a matrix product operator
+    representation of the density matrix. Memory and time scale with the
+    bond dimensions rather than exponentially with the number of qubits,
+    which makes this backend suitable for 1D and weakly entangled systems
+    of many qubits.
+
+    One-qubit PTMs are applied to a single tensor. Two-qubit PTMs on
+    neighbouring qubits are applied to a pair of tensors, that is split back
+    with SVD and truncated to `max_bond` singular values or to the relative
+    error `tolerance`, whichever is smaller. Two-qubit PTMs on qubits, that
+    are not neighbours in the chain, are applied by moving the qubits next
+    to each other by a series of swaps and back. The chain is kept in a
+    mixed canonical form, so that every truncation is optimal with respect
+    to the Hilbert-Schmidt norm of the whole density matrix; the squared
+    norm of all the parts discarded is accumulated in
+    :attr:`truncation_error`. Truncation does not preserve the trace, call
+    :func:`renormalize` to restore it.
+
+    Parameters
+    ----------
+    bases : list of quantumsim.bases.PauliBasis
+        A descrption of the basis for the subsystems.
+    pv : array, list of arrays or None
+        Pauli vector, that represents the density matrix in the selected
+        bases: either a dense array, that is decomposed with truncation, or a
+        list of tensors of the chain. If `None`, density matrix is
+        initialized in :math:`\\left| 0 \\cdots 0 \\right\\rangle` state.
+    force : bool
+        Ignored, since the size of a state is not limited (present for
+        compatibility with the other backends).
+    dtype : numpy.float32, numpy.float64 or None
+        Working precision, see :class:`PauliVectorNumpy`.
+    max_bond : int or None
+        Maximal bond dimension. If `None`, the bond dimension is limited by
+        `tolerance` only.
+    tolerance : float
+        Maximal relative error (in Hilbert-Schmidt norm) of a single SVD
+        truncation. Singular values, that are zero up to rounding errors,
+        are always discarded.
+    """
+    # The size of a state is limited by the bond dimensions only
+    _size_max = float('inf')
+
+    def __init__(self, bases, pv=None, *, force=False, dtype=None,
+                 max_bond=None, tolerance=0.):
+        if isinstance(pv, (list, tuple)):
+            self._dtype = _working_dtype(
+                dtype, pv[0] if len(pv) > 0 else None)
+        else:
+            self._dtype = _working_dtype(dtype, pv)
+        super().__init__(bases, force=True)
+        if max_bond is not None and max_bond < 1:
+            raise ValueError('`max_bond` must be positive, got {}'
+                             .format(max_bond))
+        if tolerance < 0:
+            raise ValueError('`tolerance` must be non-negative, got {}'
+                             .format(tolerance))
+        self.max_bond = max_bond
+        self.tolerance = tolerance
+        # Squared Hilbert-Schmidt norm of all the parts discarded during
+        # truncations
+        self.truncation_error = 0.
+        # Position of the orthogonality center: all tensors on the left of
+        # it are left-orthonormal, all tensors on the right are
+        # right-orthonormal. `None`, if the chain is not in a canonical form.
+        self._center = None
+
+        if pv is None:
+            self._tensors = []
+            for basis in self.bases:
+                dm = np.zeros((basis.dim_hilbert, basis.dim_hilbert))
+                dm[0, 0] = 1
+                self._tensors.append(
+                    basis.hilbert_to_pauli_vector(dm).real
+                    .astype(self._dtype).reshape(1, -1, 1))
+        elif isinstance(pv, (list, tuple)):
+            if len(pv) != self.n_qubits:
+                raise ValueError('Number of tensors ({}) must be equal to '
+                                 'the number of qubits ({})'
+                                 .format(len(pv), self.n_qubits))
+            bond = 1
+            for i, (t, dim) in enumerate(zip(pv, self.dim_pauli)):
+                if t.ndim != 3 or t.shape[:2] != (bond, dim):
+                    raise ValueError(
+                        'Tensor number {} must have shape ({}, {}, bond), '
+                        'got {}'.format(i, bond, dim, t.shape))
+                bond = t.shape[2]
+            if bond != 1:
+                raise ValueError('Last tensor must have a right bond of size '
+                                 '1, got {}'.format(bond))
+            self._tensors = [np.asarray(t, dtype=self._dtype) for t in pv]
+        elif isinstance(pv, np.ndarray):
+            if self.dim_pauli != pv.shape:
+                raise ValueError(
+                    '`bases` Pauli dimensionality should be the same as the '
+                    'shape of `data` array.\n'
+                    ' - bases shapes: {}\n - data shape: {}'
+                    .format(self.dim_pauli, pv.shape))
+            if pv.dtype not in (np.float16, np.float32, np.float64):
+                raise ValueError(
+                    '`pv` must have floating point data type, got {}'
+                    .format(pv.dtype))
+            self._tensors = self._decompose(pv.astype(self._dtype))
+        else:
+            raise ValueError(
+                "`pv` should be Numpy array, list of arrays or None, got type "
+                "`{}`".format(type(pv)))
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def tensors(self):
+        """Tensors of the chain, of shapes `(bond_left, dim_pauli,
+        bond_right)`."""
+        return list(self._tensors)
+
+    @property
+    def bond_dims(self):
+        """Dimensions of the bonds between neighbouring qubits."""
+        return tuple(t.shape[2] for t in self._tensors[:-1])
+
+    def to_pv(self):
+        """Contract the chain into a dense Pauli vector. This is feasible
+        for small systems only."""
+        data = np.ones((1,), dtype=self._dtype)
+        for t in self._tensors:
+            data = np.tensordot(data, t, axes=([-1], [0]))
+        return data.reshape(data.shape[:-1])
+
+    def apply_ptm(self, ptm, *qubits):
+        if len(ptm.shape) != 2 * len(qubits):
+            raise ValueError(
+                '{}-qubit PTM must have {} dimensions, got {}'
+                .format(len(qubits), 2*len(qubits), len(ptm.shape)))
+        self._validate_qubits(qubits)
+        shape_in = tuple(self._tensors[q].shape[1] for q in qubits)
+        if ptm.shape[len(qubits):] != shape_in:
+            raise ValueError('PTM input shape must be {}, got {}'
+                             .format(shape_in, ptm.shape[len(qubits):]))
+        ptm = ptm.astype(self._dtype, copy=False)
+        if len(qubits) == 1:
+            (q,) = qubits
+            self._move_center(q)
+            self._tensors[q] = np.einsum('ij,ajb->aib', ptm, self._tensors[q])
+        elif len(qubits) == 2:
+            q0, q1 = qubits
+            if q0 > q1:
+                q0, q1 = q1, q0
+                ptm = ptm.transpose((1, 0, 3, 2))
+            # Bring the second qubit next to the first one, apply the PTM
+            # and move it back
+            for site in range(q1 - 1, q0, -1):
+                self._apply_pair(site, None)
+            self._apply_pair(q0, ptm)
+            for site in range(q0 + 1, q1):
+                self._apply_pair(site, None)
+        else:
+            raise ValueError('Only one- and two-qubit PTMs can be applied to '
+                             'a matrix product state, got {} qubits'
+                             .format(len(qubits)))
+        self.version += 1
+
+    @memoized
+    def diagonal(self, *, get_data=True):
+        return self._reduce(
+            [b.computational_basis_vectors.real for b in self.bases],
+            range(self.n_qubits)).reshape(pytools.product(self.dim_hilbert))
+
+    @memoized
+    def trace(self):
+        return self._reduce([trace_row(b) for b in self.bases], []).item()
+
+    def partial_trace(self, *qubits):
+        self._validate_qubits(qubits)
+        kept = sorted(qubits)
+        traced_pv = self._reduce(
+            [None if i in qubits else trace_row(b)
+             for i, b in enumerate(self.bases)], kept)
+        traced_pv = np.transpose(traced_pv, [kept.index(q) for q in qubits])
+        return PauliVectorNumpy([self.bases[q] for q in qubits],
+                                np.ascontiguousarray(traced_pv),
+                                dtype=self._dtype)
+
+    @memoized
+    def meas_prob(self, qubit):
+        self._validate_qubit(qubit, 'qubit')
+        return self.joint_meas_prob(qubit)
+
+    @memoized
+    def marginals(self):
+        # Traces of the parts of the chain on the left and on the right of
+        # every qubit
+        lefts = [np.ones(1)]
+        for t, b in zip(self._tensors[:-1], self.bases[:-1]):
+            lefts.append(np.einsum('a,apb,p->b', lefts[-1], t,
+                                   trace_row(b)[0]))
+        rights = [np.ones(1)]
+        for t, b in zip(self._tensors[:0:-1], self.bases[:0:-1]):
+            rights.append(np.einsum('apb,p,b->a', t, trace_row(b)[0],
+                                    rights[-1]))
+        return [np.einsum('a,apb,xp,b->x', left, t,
+                          b.computational_basis_vectors.real, right)
+                for left, t, b, right in zip(lefts, self._tensors,
+                                             self.bases, rights[::-1])]
+
+    @memoized
+    def joint_meas_prob(self, *qubits):
+        self._validate_qubits(qubits)
+        kept = sorted(qubits)
+        probs = self._reduce(
+            [b.computational_basis_vectors.real if i in qubits
+             else trace_row(b) for i, b in enumerate(self.bases)], kept)
+        return np.transpose(probs, [kept.index(q) for q in qubits])
+
+    def bitstring_probs(self, bitstrings):
+        outcomes = self._parse_bitstrings(bitstrings)
+        env = np.ones((len(outcomes), 1))
+        for t, b, column in zip(self._tensors, self.bases, outcomes.T):
+            rows = b.computational_basis_vectors.real[column]
+            env = np.einsum('sa,apb,sp->sb', env, t, rows)
+        return env[:, 0]
+
+    @memoized
+    def purity(self):
+        env = np.ones((1, 1))
+        for t in self._tensors:
+            t = t.astype(np.float64, copy=False)
+            env = np.einsum('ab,apc,bpd->cd', env, t, t, optimize=True)
+        return env.item()
+
+    def _scale(self, factor):
+        site = self._center if self._center is not None else 0
+        self._tensors[site] = self._tensors[site] * self._dtype.type(factor)
+
+    def copy(self):
+        pv = self.__class__(self.bases, [t.copy() for t in self._tensors],
+                            dtype=self._dtype, max_bond=self.max_bond,
+                            tolerance=self.tolerance)
+        pv._center = self._center
+        pv.truncation_error = self.truncation_error
+        pv.norm = self.norm
+        return pv
+
+    def memory_footprint(self):
+        return MemoryFootprint(sum(t.nbytes for t in self._tensors), 0)
+
+    def _checkpoint(self):
+        return list(self._tensors), {'max_bond': self.max_bond,
+                                     'tolerance': self.tolerance,
+                                     'truncation_error': self.truncation_error,
+                                     'center': self._center}
+
+    @classmethod
+    def _from_checkpoint(cls, bases, arrays, attrs):
+        pv = cls(bases, arrays, max_bond=attrs['max_bond'],
+                 tolerance=attrs['tolerance'])
+        pv.truncation_error = attrs['truncation_error']
+        pv._center = attrs['center']
+        return pv
+
+    @memoized
+    def _element_weights(self, qubit):
+        self._validate_qubit(qubit, 'qubit')
+        # Weights are local in the canonical form
+        self._move_center(qubit)
+        t = self._tensors[qubit].astype(np.float64, copy=False)
+        return np.einsum('apb,apb->p', t, t)
+
+    def _select_elements(self, qubit, indices):
+        self._tensors[qubit] = self._tensors[qubit][:, indices, :]
+        self.version += 1
+
+    def _add_qubit(self, basis, pv):
+        norm = np.linalg.norm(pv)
+        if self._center is not None and norm > 0:
+            # Keep the new tensor right-orthonormal
+            self._tensors[self._center] = self._tensors[self._center] * \
+                self._dtype.type(norm)
+            pv = pv / norm
+        self._tensors.append(pv.astype(self._dtype).reshape(1, -1, 1))
+        self.version += 1
+
+    def _reset(self, qubit, basis, pv):
+        # A bond matrix of the traced out qubit is passed through the new
+        # single-qubit tensor
+        traced = np.einsum('apb,p->ab', self._tensors[qubit],
+                           trace_row(self.bases[qubit])[0])
+        self._tensors[qubit] = np.einsum(
+            'ab,p->apb', traced, pv).astype(self._dtype)
+        if self._center != qubit:
+            self._center = None
+        self.version += 1
+
+    def _remove_qubit(self, qubit):
+        traced = np.einsum('apb,p->ab', self._tensors.pop(qubit),
+                           trace_row(self.bases[qubit])[0]).astype(
+            self._dtype)
+        if qubit > 0:
+            self._tensors[qubit - 1] = np.einsum(
+                'apb,bc->apc', self._tensors[qubit - 1], traced)
+        else:
+            self._tensors[0] = np.einsum('ab,bpc->apc', traced,
+                                         self._tensors[0])
+        self._center = None
+        self.version += 1
+
+    def _apply_pair(self, site, ptm):
+        """Apply a two-qubit PTM to the tensors `site` and `site + 1`, or
+        swap them, if `ptm` is `None`, and split the result back."""
+        self._move_center(site)
+        theta = np.einsum('apb,brc->aprc', self._tensors[site],
+                          self._tensors[site + 1])
+        if ptm is None:
+            theta = theta.transpose((0, 2, 1, 3))
+        else:
+            theta = np.einsum('xyij,aijc->axyc', ptm, theta)
+        a, p, r, c = theta.shape
+        u, s, vh = self._svd(theta.reshape(a * p, r * c))
+        self._tensors[site] = u.reshape(a, p, -1)
+        self._tensors[site + 1] = (s[:, None] * vh).reshape(-1, r, c)
+        self._center = site + 1
+
+    def _svd(self, matrix):
+        """Truncated SVD of a matrix."""
+        try:
+            u, s, vh = np.linalg.svd(matrix, full_matrices=False)
+        except np.linalg.LinAlgError:
+            # Divide-and-conquer algorithm occasionally fails to converge
+            import scipy.linalg
+            u, s, vh = scipy.linalg.svd(matrix, full_matrices=False,
+                                        lapack_driver='gesvd')
+        s2 = s.astype(np.float64) ** 2
+        # Squared norm of the singular values from `i` to the end
+        tails = np.cumsum(s2[::-1])[::-1]
+        cutoff = s[0] * np.finfo(self._dtype).eps * max(matrix.shape) \
+            if len(s) > 0 else 0
+        keep = max(int(np.sum((tails > self.tolerance ** 2 * tails[0]) &
+                              (s > cutoff))), 1) if len(s) > 0 else 0
+        if self.max_bond is not None:
+            keep = min(keep, self.max_bond)
+        if keep < len(s):
+            self.truncation_error += float(tails[keep])
+        return u[:, :keep], s[:keep], vh[:keep]
+
+    def _move_center(self, site):
+        """Bring the chain to a mixed canonical form with the orthogonality
+        center at `site`."""
+        if self._center is None:
+            for i in range(site):
+                self._shift_right(i)
+            for i in range(self.n_qubits - 1, site, -1):
+                self._shift_left(i)
+        else:
+            for i in range(self._center, site):
+                self._shift_right(i)
+            for i in range(self._center, site, -1):
+                self._shift_left(i)
+        self._center = site
+
+    def _shift_right(self, site):
+        """Make the tensor `site` left-orthonormal, moving the rest of it to
+        the next tensor."""
+        t = self._tensors[site]
+        a, p, b = t.shape
+        q, r = np.linalg.qr(t.reshape(a * p, b))
+        self._tensors[site] = q.reshape(a, p, -1)
+        self._tensors[site + 1] = np.einsum('kb,bpc->kpc', r,
+                                            self._tensors[site + 1])
+
+    def _shift_left(self, site):
+        """Make the tensor `site` right-orthonormal, moving the rest of it to
+        the previous tensor."""
+        t = self._tensors[site]
+        a, p, b = t.shape
+        q, r = np.linalg.qr(t.reshape(a, p * b).T)
+        self._tensors[site] = q.T.reshape(-1, p, b)
+        self._tensors[site - 1] = np.einsum('apb,kb->apk',
+                                            self._tensors[site - 1], r)
+
+    def _decompose(self, data):
+        """Split a dense Pauli vector into a chain of tensors with
+        sequential SVDs. The orthogonality center ends up at the last
+        tensor."""
+        tensors = []
+        rest = data.reshape((1,) + data.shape)
+        for _ in range(self.n_qubits - 1):
+            a, p = rest.shape[:2]
+            u, s, vh = self._svd(rest.reshape(a * p, -1))
+            tensors.append(u.reshape(a, p, -1))
+            rest = (s[:, None] * vh).reshape((len(s),) + rest.shape[2:])
+        tensors.append(rest.reshape(rest.shape + (1,)))
+        self._center = self.n_qubits - 1
+        return tensors
+
+    def _reduce(self, matrices, kept):
+        """Contract every tensor of the chain with a matrix over its Pauli
+        index (qubit `i` with `matrices[i]` of shape `(r_i, dim_pauli_i)`,
+        or leave it as is, if `matrices[i]` is `None`). Indices of the
+        qubits, that are not `kept`, are removed (their matrices must have a
+        single row). The result is accumulated in double precision."""
+        env = np.ones((1,))
+        for i, (t, m) in enumerate(zip(self._tensors, matrices)):
+            t = t.astype(np.float64, copy=False)
+            if m is not None:
+                t = np.einsum('xp,apb->axb', m, t)
+            if i not in kept:
+                t = t[:, 0, :]
+            env = np.tensordot(env, t, axes=([-1], [0]))
+        return env.reshape(env.shape[:-1])
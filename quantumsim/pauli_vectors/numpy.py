@@ -1,12 +1,52 @@
-import warnings
+import copy
+import weakref
 
 import numpy as np
 import pytools
-from .pauli_vector import PauliVectorBase
+from quantumsim.algebra.algebra import pv_to_dm, \
+    DIAGONAL as DIAGONAL_PTM, PERMUTATION
+from .pauli_vector import PauliVectorBase, MemoryFootprint, memoized
+from ._contraction import contraction_plan, thread_pool
+from ._reductions import reduce_axes, select_outcomes, KEEP, DIAGONAL, \
+    TRACE
+from ._metrics import hs_overlap
+from ._observables import expectation_values
+
+
+_dtypes = (np.dtype(np.float32), np.dtype(np.float64))
+# Signed permutations are applied with slice copies, if contiguous pieces
+# of the slices have at least that many elements
+_permutation_run_min = 256
+
+
+def _working_dtype(dtype, pv):
+    """Working precision of a Pauli vector: `dtype` if provided, otherwise
+    the precision of `pv`, if it is single or double, otherwise double."""
+    if dtype is None:
+        if isinstance(pv, np.ndarray) and pv.dtype in _dtypes:
+            return pv.dtype
+        return np.dtype(np.float64)
+    dtype = np.dtype(dtype)
+    if dtype not in _dtypes:
+        raise ValueError(
+            '`dtype` must be either float32 or float64, got {}'.format(dtype))
+    return dtype
 
 
 class PauliVectorNumpy(PauliVectorBase):
-    def __init__(self, bases, pv=None, *, force=False):
+    # States smaller than this are not split between threads. This is a
+    # guess: the threaded mode was not benchmarked on several cores yet.
+    _parallel_size_min = 2**16
+    # Number of leading axes of the data, that are not qubits
+    _batch_axes = 0
+    # Set of Pauli vectors, that share the data with this one after a
+    # snapshot, or None
+    _share = None
+    # Whether the data was handed out by `to_pv`
+    _exposed = False
+
+    def __init__(self, bases, pv=None, *, force=False, dtype=None,
+                 threads=1):
         """A density matrix describing several subsystems with variable number
         of dimensions.
 
@@ -19,7 +59,28 @@ class PauliVectorNumpy(PauliVectorBase):
             Must be of size (2**no_qubits, 2**no_qubits). Only upper triangle
             is relevant.  If data is `None`, create a new density matrix with
             all qubits in ground state.
+
+        dtype : numpy.float32, numpy.float64 or None
+            Working precision of the Pauli vector. PTMs are cast to it
+            before application; reductions (`trace`, `diagonal`,
+            `meas_prob`, etc.) are accumulated in double precision anyway.
+            If `None`, precision of `pv` is used (double, if `pv` is `None`).
+
+        threads : int
+            Number of threads to apply PTMs with. If more than one, large
+            states are split into slabs along the axes, that PTM does not
+            touch, and the slabs are processed in parallel. Can be changed
+            later via the `threads` attribute.
+
+            .. warning:: The threaded mode is experimental: it is tested
+               for correctness, but its speed-up over a single thread was
+               not measured yet.
         """
+        if threads < 1:
+            raise ValueError('`threads` must be positive, got {}'
+                             .format(threads))
+        self.threads = threads
+        self._dtype = _working_dtype(dtype, pv)
         super().__init__(bases, pv, force=force)
         if pv is not None:
             if self.dim_pauli != pv.shape:
@@ -34,87 +95,390 @@ class PauliVectorNumpy(PauliVectorBase):
                     .format(pv.dtype)
                 )
 
+        # Two persistent flat work buffers, that are swapped on every PTM
+        # application (similarly to `_data` and `_work_data` in the CUDA
+        # backend). `_data` is either a view of one of them (its index is
+        # stored in `_data_buffer`), or an array, that was provided by the
+        # user and is never used as a work buffer.
+        self._buffers = [None, None]
+        self._data_buffer = None
         if isinstance(pv, np.ndarray):
-            self._data = pv
+            self._data = pv.astype(self._dtype, copy=False)
+            # The user owns the data, so it is never modified in place
+            self._exposed = self._data is pv
         elif pv is None:
-            self._data = np.zeros(self.dim_pauli)
+            self._data = self._work_buffer(0, self.dim_pauli, self._dtype)
+            self._data_buffer = 0
+            self._data.fill(0.)
             self._data[tuple([0] * self.n_qubits)] = 1
         else:
             raise ValueError(
                 "`pv` should be Numpy array or None, got type `{}`"
                 .format(type(pv)))
 
+    @property
+    def dtype(self):
+        return self._dtype
+
     def to_pv(self):
+        """Get data in a form of Numpy array.
+
+        The array returned is not reused as a work buffer, so it keeps the
+        data after further operations on the Pauli vector. Operations, that
+        modify the data in place, copy it first.
+        """
+        self._detach_data()
+        self._exposed = True
         return self._data
 
+    def to_dm(self):
+        return pv_to_dm(self._data, self.bases)
+
     def apply_ptm(self, ptm, *qubits):
         if len(ptm.shape) != 2 * len(qubits):
             raise ValueError(
                 '{}-qubit PTM must have {} dimensions, got {}'
                 .format(len(qubits), 2*len(qubits), len(ptm.shape)))
-        dm_in_idx = list(range(self.n_qubits))
-        ptm_in_idx = list(qubits)
-        ptm_out_idx = list(range(self.n_qubits, self.n_qubits + len(
-            qubits)))
-        dm_out_idx = list(dm_in_idx)
-        for i_in, i_out in zip(ptm_in_idx, ptm_out_idx):
-            dm_out_idx[i_in] = i_out
-        self._data = np.einsum(
-            self._data, dm_in_idx, ptm, ptm_out_idx + ptm_in_idx, dm_out_idx,
-            optimize=True)
+        plan = contraction_plan(self._data.shape, qubits, ptm.shape)
+        self._apply_plan(plan, ptm)
 
-    def diagonal(self, *, get_data=True):
-        no_trace_tensors = [basis.computational_basis_vectors
-                            for basis in self.bases]
+    def apply_structured_ptm(self, ptm, structure, *qubits):
+        """Apply a PTM with a specialized kernel for its structure:
+        diagonal PTMs multiply the data elementwise and signed permutations
+        (Clifford gates in the `twolevel_ixyz` basis) gather the data and
+        flip the signs. Other PTMs, and permutations of the last qubits,
+        are applied with :func:`apply_ptm`.
+        """
+        kind = None if structure is None else structure.kind
+        if kind not in (DIAGONAL_PTM, PERMUTATION) or \
+                ptm.ndim != 2 * len(qubits):
+            self.apply_ptm(ptm, *qubits)
+            return
+        for q in qubits:
+            self._validate_qubit(q, 'qubit')
+        axes = tuple(q + self._batch_axes for q in qubits)
+        ndim = self._data.ndim
+        if kind == PERMUTATION and \
+                sorted(axes) == list(range(ndim - len(axes), ndim)):
+            # Slices of the trailing axes are single elements, and gathering
+            # them is slower, than a dense contraction
+            self.apply_ptm(ptm, *qubits)
+            return
+        # Validates the shapes and gives the shape of the result
+        plan = contraction_plan(self._data.shape, axes, ptm.shape)
+        out = self._next_buffer(plan.shape_out)
+        dtype = self._dtype
+        if kind == DIAGONAL_PTM:
+            order = np.argsort(axes)
+            shape = [1] * self._data.ndim
+            for i in order:
+                shape[axes[i]] = self._data.shape[axes[i]]
+            diagonal = np.transpose(structure.diagonal, order)
+            np.multiply(self._data, diagonal.reshape(shape).astype(dtype),
+                        out=out)
+        else:
+            _apply_permutation(structure.permutation, self._data, out, axes,
+                               ptm.shape[len(qubits):], dtype)
+        self._set_data(out)
 
-        trace_argument = []
-        n_qubits = self.n_qubits
-        for i, ntt in enumerate(no_trace_tensors):
-            trace_argument.append(ntt)
-            trace_argument.append([i + n_qubits, i])
+    def _apply_plan(self, plan, ptm):
+        """Execute a contraction plan, writing the result to the work
+        buffer, that does not hold the data now."""
+        dtype = self._dtype
+        if ptm.dtype != dtype:
+            # Mixed precision matmul would silently upcast the data
+            ptm = ptm.astype(dtype)
+        # Result goes to the buffer, that does not hold the data now. The
+        # buffer, that holds the data, is used as a scratch space; if data
+        # is not in a work buffer, the second one is used instead.
+        i_out = 1 if self._data_buffer == 0 else 0
+        out = self._work_buffer(i_out, max(plan.size_in, plan.size_out),
+                                dtype)
+        if plan.direct:
+            scratch = None
+        elif self._data_buffer is None:
+            scratch = self._work_buffer(1, plan.size_out, dtype)
+        else:
+            scratch = self._buffers[self._data_buffer]
+            if scratch.size < plan.size_out or scratch.dtype != dtype:
+                # Data is copied to `out` before scratch is written, so the
+                # buffer may be safely replaced.
+                scratch = self._work_buffer(self._data_buffer,
+                                            plan.size_out, dtype)
+        if self.threads > 1 and plan.size_in >= self._parallel_size_min:
+            pool = thread_pool(self.threads)
+        else:
+            pool = None
+        self._data = plan(self._data, ptm, out=out, scratch=scratch,
+                          pool=pool)
+        self._data_buffer = i_out
+        self._exposed = False
+        self._release_share()
+        self.version += 1
 
-        indices = list(range(n_qubits))
-        out_indices = list(range(n_qubits, 2 * n_qubits))
-        complex_dm_dimension = pytools.product(self.dim_hilbert)
-        return np.einsum(self._data, indices, *trace_argument, out_indices,
-                         optimize=True).real.reshape(complex_dm_dimension)
+    @memoized
+    def diagonal(self, *, get_data=True):
+        return reduce_axes(self._data, self.bases,
+                           [DIAGONAL] * self.n_qubits).reshape(
+            pytools.product(self.dim_hilbert))
 
+    @memoized
     def trace(self):
-        # TODO: can be made more effective
-        return np.sum(self.diagonal())
+        return np.float64(reduce_axes(self._data, self.bases,
+                                      [TRACE] * self.n_qubits))
 
     def partial_trace(self, *qubits):
         for q in qubits:
             self._validate_qubit(q, 'qubit')
-        einsum_args = [self._data, list(range(self.n_qubits))]
-        for i, b in enumerate(self.bases):
-            if i not in qubits:
-                einsum_args.append(b.vectors)
-                einsum_args.append([i, self.n_qubits+i, self.n_qubits+i])
-        traced_dm = np.einsum(*einsum_args, optimize=True).real
-        return self.__class__([self.bases[q] for q in qubits], traced_dm)
+        traced_pv = reduce_axes(
+            self._data, self.bases,
+            [KEEP if i in qubits else TRACE for i in range(self.n_qubits)])
+        kept = sorted(qubits)
+        traced_pv = np.transpose(traced_pv, [kept.index(q) for q in qubits])
+        return self.__class__([self.bases[q] for q in qubits],
+                              np.ascontiguousarray(traced_pv),
+                              dtype=self._dtype)
 
+    @memoized
     def meas_prob(self, qubit):
         self._validate_qubit(qubit, 'qubit')
-        einsum_args = [self._data, list(range(self.n_qubits))]
-        for i, b in enumerate(self.bases):
-            einsum_args.append(b.vectors)
-            einsum_args.append([i, self.n_qubits+i, self.n_qubits+i])
-        einsum_args.append([self.n_qubits + qubit])
-        try:
-            return np.einsum(*einsum_args, optimize=True).real
-        except Exception:
-            raise
-
-    def renormalize(self):
-        tr = self.trace()
-        if tr > 1e-8:
-            self._data *= self.trace() ** -1
+        return reduce_axes(
+            self._data, self.bases,
+            [DIAGONAL if i == qubit else TRACE
+             for i in range(self.n_qubits)])
+
+    @memoized
+    def marginals(self):
+        diag = reduce_axes(self._data, self.bases,
+                           [DIAGONAL] * self.n_qubits, self._batch_axes)
+        axes = set(range(self.n_qubits))
+        return [np.sum(diag, axis=tuple(i + self._batch_axes
+                                        for i in axes - {q}))
+                for q in axes]
+
+    @memoized
+    def joint_meas_prob(self, *qubits):
+        self._validate_qubits(qubits)
+        probs = reduce_axes(
+            self._data, self.bases,
+            [DIAGONAL if i in qubits else TRACE
+             for i in range(self.n_qubits)], self._batch_axes)
+        kept = sorted(qubits)
+        return np.transpose(probs, list(range(self._batch_axes)) +
+                            [kept.index(q) + self._batch_axes
+                             for q in qubits])
+
+    def bitstring_probs(self, bitstrings):
+        return select_outcomes(self._data, self.bases,
+                               self._parse_bitstrings(bitstrings),
+                               self._batch_axes)
+
+    def overlap(self, other):
+        if isinstance(other, PauliVectorNumpy):
+            other_data, other_batch_axes = other._data, other._batch_axes
         else:
-            warnings.warn(
-                "Density matrix trace is 0; likely your further computation "
-                "will fail. Have you projected DM on a state with zero weight?")
+            other_data, other_batch_axes = other.to_pv(), 0
+        return hs_overlap(self._data, self.bases, other_data, other.bases,
+                          self._batch_axes, other_batch_axes)
+
+    def expectation_values(self, observables):
+        return expectation_values(self._data, self.bases, observables,
+                                  self._batch_axes)
+
+    @memoized
+    def purity(self):
+        data = self._data.reshape(
+            self._data.shape[:self._batch_axes] + (-1,))
+        return np.einsum('...i,...i->...', data, data, dtype=np.float64)
+
+    def _scale(self, factor):
+        self._own_data()
+        self._data *= factor
 
     def copy(self):
-        return self.from_pv(self.to_pv().copy(), self.bases)
+        pv = self.__class__(self.bases, self._data.copy(),
+                            threads=self.threads)
+        # The copy owns its data
+        pv._exposed = False
+        pv.norm = self.norm
+        return pv
+
+    def memory_footprint(self):
+        private = sum(b.nbytes for b in self._buffers if b is not None)
+        data = _allocation(self._data).nbytes
+        if self._data_buffer is not None:
+            return MemoryFootprint(private, 0)
+        if self._share is not None and len(self._share) > 1:
+            return MemoryFootprint(private, data)
+        return MemoryFootprint(private + data, 0)
+
+    def _snapshot(self):
+        if self._share is None:
+            self._share = weakref.WeakSet([self])
+        # The buffer holds shared data now, so it must not be reused
+        self._detach_data()
+        pv = copy.copy(self)
+        pv.bases = list(self.bases)
+        pv.norm = copy.copy(self.norm)
+        pv._memo = {}
+        pv._memo_state = None
+        pv._snapshot_refs = []
+        pv._buffers = [None, None]
+        self._share.add(pv)
+        return pv
+
+    def _release_share(self):
+        """Stop sharing the data with snapshots, after it was replaced."""
+        if self._share is not None:
+            self._share.discard(self)
+            self._share = None
+
+    def _detach_data(self):
+        """Make sure, that the array holding the data is not reused as a
+        work buffer."""
+        if self._data_buffer is not None:
+            self._buffers[self._data_buffer] = None
+            self._data_buffer = None
+
+    def _own_data(self):
+        """Copy the data, if it is shared with snapshots or was handed out
+        by `to_pv`, before modifying it in place."""
+        if self._exposed or \
+                (self._share is not None and len(self._share) > 1):
+            out = self._next_buffer(self._data.shape)
+            np.copyto(out, self._data)
+            self._set_data(out)
+
+    def _checkpoint(self):
+        return [self._data], {'threads': self.threads}
+
+    @classmethod
+    def _from_checkpoint(cls, bases, arrays, attrs):
+        return cls(bases, arrays[0], force=True, threads=attrs['threads'])
+
+    def _add_qubit(self, basis, pv):
+        out = self._next_buffer(self._data.shape + (basis.dim_pauli,))
+        np.multiply(self._data[..., None], pv.astype(self._dtype), out=out)
+        self._set_data(out)
+
+    def _reset(self, qubit, basis, pv):
+        traced = self._trace_out(qubit)
+        axis = qubit + self._batch_axes
+        shape = list(self._data.shape)
+        shape[axis] = basis.dim_pauli
+        out = self._next_buffer(tuple(shape))
+        shape_pv = [1] * len(shape)
+        shape_pv[axis] = basis.dim_pauli
+        np.multiply(np.expand_dims(traced, axis), pv.reshape(shape_pv),
+                    out=out)
+        self._set_data(out)
+
+    def _remove_qubit(self, qubit):
+        traced = self._trace_out(qubit)
+        out = self._next_buffer(traced.shape)
+        np.copyto(out, traced)
+        self._set_data(out)
+
+    @memoized
+    def _element_weights(self, qubit):
+        self._validate_qubit(qubit, 'qubit')
+        axis = qubit + self._batch_axes
+        indices = list(range(self._data.ndim))
+        return np.einsum(self._data, indices, self._data, indices, [axis],
+                         dtype=np.float64)
+
+    def _select_elements(self, qubit, indices):
+        axis = qubit + self._batch_axes
+        shape = list(self._data.shape)
+        shape[axis] = len(indices)
+        out = self._next_buffer(tuple(shape))
+        np.take(self._data, indices, axis=axis, out=out)
+        self._set_data(out)
+
+    def _trace_out(self, qubit):
+        return reduce_axes(self._data, self.bases,
+                           [TRACE if i == qubit else KEEP
+                            for i in range(self.n_qubits)], self._batch_axes)
+
+    def _next_buffer(self, shape):
+        """View of the work buffer, that does not hold the data now."""
+        return self._work_buffer(1 if self._data_buffer == 0 else 0, shape,
+                                 self._dtype)
+
+    def _set_data(self, data):
+        """Make a view of a work buffer, obtained from `_next_buffer`, the
+        new data."""
+        self._data = data
+        self._data_buffer = 1 if self._data_buffer == 0 else 0
+        self._exposed = False
+        self._release_share()
+        self.version += 1
+
+    def _work_buffer(self, index, shape, dtype):
+        """Return a view of the work buffer `index` with a given shape.
+
+        The buffer is reallocated only if it is too small for the `shape`
+        requested or has a different data type, so in a steady state no
+        memory is allocated.
+        """
+        size = pytools.product(shape) if hasattr(shape, '__iter__') \
+            else shape
+        buffer = self._buffers[index]
+        if buffer is None or buffer.size < size or buffer.dtype != dtype:
+            buffer = np.empty(size, dtype=dtype)
+            self._buffers[index] = buffer
+        return buffer[:size].reshape(shape)
+
+
+def _apply_permutation(permutation, data, out, axes, dims_in, dtype):
+    """Apply a signed permutation PTM to the `axes` of `data`: every slice
+    of the result with fixed indices along `axes` is a copy of a slice of
+    the data, possibly with a flipped sign."""
+    sources, signs = permutation
+    last = max(axes)
+    trail = pytools.product(data.shape[last + 1:])
+    if trail < _permutation_run_min and \
+            last - min(axes) == len(axes) - 1:
+        # Slices would be short strided pieces, so adjacent target axes are
+        # gathered with a single `take`
+        _take_permutation(sources, signs, data, out, axes, dims_in, dtype)
+        return
+    for index_out in np.ndindex(*sources.shape):
+        index_in = np.unravel_index(sources[index_out], dims_in)
+        dst = [slice(None)] * data.ndim
+        src = [slice(None)] * data.ndim
+        for axis, i_out, i_in in zip(axes, index_out, index_in):
+            dst[axis] = i_out
+            src[axis] = i_in
+        if signs[index_out] > 0:
+            np.copyto(out[tuple(dst)], data[tuple(src)])
+        else:
+            np.negative(data[tuple(src)], out=out[tuple(dst)])
+
+
+def _take_permutation(sources, signs, data, out, axes, dims_in, dtype):
+    """Apply a signed permutation PTM to the adjacent `axes` of `data`
+    with a single `take` along them."""
+    order = np.argsort(axes)
+    first, last = min(axes), max(axes)
+    coords = np.unravel_index(sources, dims_in)
+    # Coordinates of the sources along the axes in their order, indexed by
+    # the output indices in the same order
+    coords = [np.transpose(coords[i], order) for i in order]
+    signs = np.transpose(signs, order)
+    lead = pytools.product(data.shape[:first])
+    trail = pytools.product(data.shape[last + 1:])
+    sources = np.ravel_multi_index(coords, data.shape[first:last + 1])
+    result = out.reshape(lead, sources.size, trail)
+    np.take(data.reshape(lead, -1, trail), sources.ravel(), axis=1,
+            out=result, mode='clip')
+    if np.any(signs < 0):
+        np.multiply(result, signs.reshape(1, -1, 1).astype(dtype),
+                    out=result)
+
 
+def _allocation(array):
+    """The array, that owns the memory of a view."""
+    while isinstance(array.base, np.ndarray):
+        array = array.base
+    return array
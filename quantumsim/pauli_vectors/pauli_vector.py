@@ -1,6 +1,65 @@
 import abc
+import warnings
+import weakref
+from collections import namedtuple
+from functools import lru_cache, wraps
+
+import numpy as np
 import pytools
 from quantumsim.algebra.algebra import dm_to_pv, pv_to_dm
+from quantumsim.bases import general
+from .sampling import _rng
+from ._metrics import hs_overlap, dm_fidelity
+from ._observables import expectation_values
+
+MemoryFootprint = namedtuple('MemoryFootprint', ['private', 'shared'])
+MemoryFootprint.__doc__ = """Memory, occupied by a Pauli vector, in bytes.
+
+Attributes
+----------
+private : int
+    Memory, that is used by this Pauli vector only, including work buffers.
+shared : int
+    Memory, that holds the data, shared with snapshots (see
+    :func:`PauliVectorBase.snapshot`), and is released, when all of them
+    have modified their data or were garbage collected.
+"""
+
+
+def memoized(method):
+    """Memoize the results of a method of a Pauli vector, until the state
+    changes.
+
+    Results are stored per version of the state (see
+    :attr:`PauliVectorBase.version`) and per bases of qubits. Array results
+    are returned as read-only arrays. Calls with unhashable arguments are
+    not memoized.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        state = (self.version, tuple(map(id, self.bases)))
+        if self._memo_state != state:
+            self._memo.clear()
+            self._memo_state = state
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        try:
+            return self._memo[key]
+        except KeyError:
+            pass
+        except TypeError:
+            # Unhashable arguments
+            return method(self, *args, **kwargs)
+        result = method(self, *args, **kwargs)
+        if isinstance(result, np.ndarray):
+            result.flags.writeable = False
+        elif isinstance(result, list):
+            for r in result:
+                if isinstance(r, np.ndarray):
+                    r.flags.writeable = False
+            result = tuple(result)
+        self._memo[key] = result
+        return result
+    return wrapper
 
 
 class PauliVectorBase(metaclass=abc.ABCMeta):
@@ -11,6 +70,11 @@ class PauliVectorBase(metaclass=abc.ABCMeta):
     `super().__init__` in the beginning of its execution, because a lot of
     sanity checks are done here.
 
+    Derived quantities (diagonal, trace, marginals, etc.) are memoized until
+    the state changes. Every method, that modifies the data, increments
+    :attr:`version`; code, that modifies the data returned by `to_pv` in
+    place, must increment it too.
+
     Parameters
     ----------
     bases : list of quantumsim.bases.PauliBasis
@@ -21,16 +85,26 @@ class PauliVectorBase(metaclass=abc.ABCMeta):
         :math:`\\left| 0 \\cdots 0 \\right\\rangle` state.
     force : bool
         By default creation of too large density matrix (more than
-        :math:`2^22` elements currently) is not allowed. Set this to `True`
-        if you know what you are doing.
+        :math:`2^22` elements in double precision currently, twice as much
+        in single precision) is not allowed. Set this to `True` if you know
+        what you are doing.
     """
+    # In double precision elements
     _size_max = 2**22
 
     # noinspection PyUnusedLocal
     @abc.abstractmethod
     def __init__(self, bases, pv=None, *, force=False):
         self.bases = list(bases)
-        if self.size > self._size_max and not force:
+        # Product of probabilities of all outcomes projected onto
+        self.norm = 1.
+        # Incremented on every change of the data
+        self.version = 0
+        self._memo = {}
+        self._memo_state = None
+        # Weak references to the snapshots, taken from this Pauli vector
+        self._snapshot_refs = []
+        if self._exceeds_size_max(self.size) and not force:
             raise ValueError(
                 'Density matrix of the system is going to have {} items. It '
                 'is probably too much. If you know what you are doing, '
@@ -47,14 +121,42 @@ class PauliVectorBase(metaclass=abc.ABCMeta):
 
     @classmethod
     def from_dm(cls, dm, bases, *, force=False):
+        """Create a Pauli vector from a density matrix.
+
+        Parameters
+        ----------
+        dm : array
+            Density matrix of shape `(D, D)` or `(d_0, ..., d_N, d_0, ...,
+            d_N)`. It is converted one qubit at a time (see
+            :func:`quantumsim.algebra.dm_to_pv`), so it may be a
+            memory-mapped array, that does not fit into RAM.
+        bases : list of quantumsim.bases.PauliBasis or PauliBasis
+            Bases of the qubits. If a single basis is provided, it is used
+            for all qubits.
+        force : bool
+            See :class:`PauliVectorBase`.
+        """
         if not hasattr(bases, '__iter__'):
-            n_qubits = len(dm) // bases.dim_hilbert
+            if dm.ndim == 2:
+                n_qubits = int(round(np.log(dm.shape[0]) /
+                                     np.log(bases.dim_hilbert)))
+            else:
+                n_qubits = dm.ndim // 2
             bases = [bases] * n_qubits
         return cls(bases, dm_to_pv(dm, bases), force=force)
 
     def to_dm(self):
         return pv_to_dm(self.to_pv(), self.bases)
 
+    @property
+    def dtype(self):
+        """Floating point data type of the Pauli vector elements."""
+        return np.dtype(np.float64)
+
+    def _exceeds_size_max(self, n_items):
+        return n_items * self.dtype.itemsize > \
+            self._size_max * np.dtype(np.float64).itemsize
+
     @property
     def n_qubits(self):
         return len(self.bases)
@@ -75,6 +177,23 @@ class PauliVectorBase(metaclass=abc.ABCMeta):
     def apply_ptm(self, operation, *qubits):
         pass
 
+    def apply_structured_ptm(self, ptm, structure, *qubits):
+        """Apply a PTM, using its sparsity structure, if the backend has
+        specialized kernels for it (see
+        :func:`quantumsim.algebra.ptm_structure`). By default the structure
+        is ignored.
+
+        Parameters
+        ----------
+        ptm : array
+            Pauli transfer matrix.
+        structure : quantumsim.algebra.PTMStructure or None
+            Structure of `ptm`.
+        q0, ..., qN : int
+            Indices of qubits to act on.
+        """
+        self.apply_ptm(ptm, *qubits)
+
     @abc.abstractmethod
     def diagonal(self, *, get_data=True):
         pass
@@ -91,14 +210,517 @@ class PauliVectorBase(metaclass=abc.ABCMeta):
     def meas_prob(self, qubit):
         pass
 
-    @abc.abstractmethod
     def renormalize(self):
-        pass
+        """Renormalize to trace one."""
+        tr = self.trace()
+        if tr > 1e-8:
+            self._scale(tr ** -1)
+            self.version += 1
+        else:
+            warnings.warn(
+                "Density matrix trace is 0; likely your further computation "
+                "will fail. Have you projected DM on a state with zero "
+                "weight?")
+
+    def _scale(self, factor):
+        """Multiply the data by a scalar `factor` in place."""
+        raise NotImplementedError(
+            'Renormalization is not supported by {}'
+            .format(self.__class__.__name__))
 
     @abc.abstractmethod
     def copy(self):
         pass
 
+    def snapshot(self):
+        """Take a snapshot of the Pauli vector: an independent Pauli vector
+        in the same state, for example to explore measurement branches or
+        to run several circuit tails after a shared prefix.
+
+        Backends, that support it (:class:`PauliVectorNumpy` and
+        :class:`PauliVectorBatch`), share the data between the snapshot and
+        the original, until either of them is modified: PTMs write their
+        results into new buffers anyway, so the shared data is never copied
+        and is released, when no Pauli vector refers to it any more. Other
+        backends copy the data.
+
+        Returns
+        -------
+        PauliVectorBase
+            A Pauli vector of the same class.
+        """
+        pv = self._snapshot()
+        self._snapshot_refs = [ref for ref in self._snapshot_refs
+                               if ref() is not None]
+        self._snapshot_refs.append(weakref.ref(pv))
+        return pv
+
+    def snapshots(self):
+        """Live snapshots, taken from this Pauli vector and, recursively,
+        from its snapshots.
+
+        Returns
+        -------
+        list of PauliVectorBase
+            Snapshots in the order they were taken, depth first.
+        """
+        snapshots = []
+        for ref in self._snapshot_refs:
+            pv = ref()
+            if pv is not None:
+                snapshots.append(pv)
+                snapshots.extend(pv.snapshots())
+        return snapshots
+
+    def memory_footprint(self):
+        """Memory, occupied by the Pauli vector.
+
+        Returns
+        -------
+        MemoryFootprint
+            Named tuple `(private, shared)` of sizes in bytes.
+        """
+        raise NotImplementedError(
+            'Memory footprint is not available for {}'
+            .format(self.__class__.__name__))
+
+    def _snapshot(self):
+        return self.copy()
+
+    @memoized
+    def purity(self):
+        """Purity :math:`\\mathrm{Tr} \\rho^2` of the state.
+
+        Pauli bases are orthonormal, so this is a squared norm of the Pauli
+        vector.
+        """
+        return np.sum(np.square(self.to_pv(), dtype=np.float64))
+
+    def overlap(self, other):
+        """Hilbert-Schmidt overlap :math:`\\mathrm{Tr} \\rho \\sigma`
+        with another state.
+
+        This is a dot product of the Pauli vectors. If bases of a qubit
+        differ between the states, the Pauli vector of `other` is converted
+        to the bases of this one first.
+
+        Parameters
+        ----------
+        other : PauliVectorBase
+            Another state with the same Hilbert dimensions of qubits.
+
+        Returns
+        -------
+        float
+        """
+        return hs_overlap(self.to_pv(), self.bases, other.to_pv(),
+                          other.bases)
+
+    def hs_distance(self, other):
+        """Hilbert-Schmidt distance
+        :math:`\\sqrt{\\mathrm{Tr} (\\rho - \\sigma)^2}` to another state,
+        computed from purities and the overlap of the states.
+
+        Parameters
+        ----------
+        other : PauliVectorBase
+            Another state with the same Hilbert dimensions of qubits.
+
+        Returns
+        -------
+        float
+        """
+        squared = self.purity() + other.purity() - 2 * self.overlap(other)
+        return np.sqrt(np.maximum(squared, 0.))
+
+    def fidelity(self, other, qubits=None, *, atol=1e-10):
+        """Fidelity :math:`\\left(\\mathrm{Tr} \\sqrt{\\sqrt{\\rho}
+        \\sigma \\sqrt{\\rho}}\\right)^2` of reduced states of a
+        subsystem of normalized states.
+
+        Both states are traced down to `qubits` first. If either reduced
+        state is pure, fidelity is their overlap, and no density matrix is
+        built. Otherwise density matrices of the reduced states are built,
+        so the subsystem should be small.
+
+        Parameters
+        ----------
+        other : PauliVectorBase
+            Another state with the same Hilbert dimensions of qubits.
+        qubits : list of int or None
+            Subsystem to compare. If `None`, whole states are compared.
+        atol : float
+            Tolerance for a state to be considered pure.
+
+        Returns
+        -------
+        float
+        """
+        if qubits is None:
+            qubits = range(self.n_qubits)
+        qubits = tuple(qubits)
+        self._validate_qubits(qubits)
+        if self.dim_hilbert != other.dim_hilbert:
+            raise ValueError(
+                'States must have the same Hilbert dimensions of qubits, '
+                'got {} and {}'.format(self.dim_hilbert, other.dim_hilbert))
+        if qubits == tuple(range(self.n_qubits)):
+            this = self
+        else:
+            this, other = self.partial_trace(*qubits), \
+                other.partial_trace(*qubits)
+        if np.all(np.abs(this.purity() - this.trace() ** 2) < atol) or \
+                np.all(np.abs(other.purity() - other.trace() ** 2) < atol):
+            return this.overlap(other)
+        return dm_fidelity(this.to_dm(), other.to_dm())
+
+    @memoized
+    def marginals(self):
+        """Probabilities of measurement outcomes of every qubit, computed
+        in one pass over the state.
+
+        Returns
+        -------
+        tuple of array
+            Element number `i` is the same as `meas_prob(i)`.
+        """
+        diag = self.diagonal().reshape(self.dim_hilbert)
+        axes = set(range(self.n_qubits))
+        return [np.sum(diag, axis=tuple(axes - {q})) for q in axes]
+
+    @memoized
+    def joint_meas_prob(self, *qubits):
+        """Joint probabilities of measurement outcomes of several qubits.
+
+        Parameters
+        ----------
+        q0, ..., qN : int
+            Indices of qubits.
+
+        Returns
+        -------
+        array
+            Array of shape `(dim_hilbert_q0, ..., dim_hilbert_qN)`.
+        """
+        self._validate_qubits(qubits)
+        diag = self.diagonal().reshape(self.dim_hilbert)
+        diag = np.sum(diag, axis=tuple(i for i in range(self.n_qubits)
+                                       if i not in qubits))
+        kept = sorted(qubits)
+        return np.transpose(diag, [kept.index(q) for q in qubits])
+
+    def bitstring_probs(self, bitstrings):
+        """Probabilities of measuring given computational basis states of
+        all qubits.
+
+        Parameters
+        ----------
+        bitstrings : array or list of str
+            Array of shape `(n_bitstrings, n_qubits)` with outcomes of each
+            qubit, or strings of digits, like `'0110'`.
+
+        Returns
+        -------
+        array
+            Array of shape `(n_bitstrings,)`.
+        """
+        outcomes = self._parse_bitstrings(bitstrings)
+        diag = self.diagonal().reshape(self.dim_hilbert)
+        return diag[tuple(outcomes.T)]
+
+    def expectation_values(self, observables):
+        """Expectation values :math:`\\mathrm{Tr} \\rho O` of many
+        observables, that are tensor products of single-qubit factors.
+
+        Values are computed directly in Pauli space: every factor is
+        reduced to its overlaps with the basis elements of its qubit (these
+        are cached for Pauli matrices), and observables with common factors
+        on the leading qubits share the contractions. Large sets of Pauli
+        strings of two-level qubits are looked up in a table of all Pauli
+        strings, that is computed with a Walsh-Hadamard-style transform
+        (see :mod:`quantumsim.pauli_vectors._observables`).
+
+        Parameters
+        ----------
+        observables : list
+            Every observable is either a Pauli string, like `'XIZ'`, a list
+            of per-qubit factors, or a dict, that maps qubit indices to
+            factors (other qubits have identity factors). A factor is one
+            of `'I'`, `'X'`, `'Y'`, `'Z'`, `None` (identity) or a Hermitian
+            matrix of shape `(dim_hilbert, dim_hilbert)`.
+
+        Returns
+        -------
+        array
+            Array of shape `(n_observables,)`.
+        """
+        return expectation_values(self.to_pv(), self.bases, observables)
+
+    def add_qubit(self, basis, state=0, *, force=False):
+        """Add a qubit to the system in place (as the last one).
+
+        Parameters
+        ----------
+        basis : quantumsim.bases.PauliBasis
+            Basis of the new qubit.
+        state : int or array
+            Either a computational basis state of the qubit, or its Pauli
+            vector in `basis`.
+        force : bool
+            Allow the state to grow larger, than the size limit (see
+            :class:`PauliVectorBase`).
+
+        Returns
+        -------
+        int
+            Index of the new qubit.
+        """
+        if self._exceeds_size_max(self.size * basis.dim_hilbert ** 2) \
+                and not force:
+            raise ValueError(
+                'Density matrix of the system is going to have {} items. It '
+                'is probably too much. If you know what you are doing, '
+                'pass `force=True` argument.'
+                .format(self.size * basis.dim_hilbert ** 2))
+        self._add_qubit(basis, _single_qubit_pv(basis, state))
+        self.bases.append(basis)
+        return self.n_qubits - 1
+
+    def reset(self, qubit, state=0, basis=None):
+        """Reset a qubit to a given state in place, tracing out its previous
+        state.
+
+        Parameters
+        ----------
+        qubit : int
+            Index of the qubit.
+        state : int or array
+            Either a computational basis state of the qubit, or its Pauli
+            vector in `basis`.
+        basis : quantumsim.bases.PauliBasis or None
+            New basis of the qubit. If `None` and `state` is a computational
+            basis state, a one-element basis of this state is used, so that
+            the qubit costs no memory until the next operation on it.
+            Otherwise the basis is not changed.
+        """
+        self._validate_qubit(qubit, 'qubit')
+        if basis is None:
+            if isinstance(state, (int, np.integer)):
+                basis = _projected_basis(self.bases[qubit], state)
+            else:
+                basis = self.bases[qubit]
+        self._reset(qubit, basis, _single_qubit_pv(basis, state))
+        self.bases[qubit] = basis
+
+    def remove_qubit(self, qubit):
+        """Trace out a qubit and remove it from the system in place.
+        Indices of the following qubits decrease by one.
+
+        Parameters
+        ----------
+        qubit : int
+            Index of the qubit.
+        """
+        self._validate_qubit(qubit, 'qubit')
+        if self.n_qubits == 1:
+            raise ValueError('Can not remove the last qubit of a system')
+        self._remove_qubit(qubit)
+        del self.bases[qubit]
+
+    def truncate_bases(self, threshold=1e-12, qubits=None):
+        """Drop basis elements, that do not contribute to the state, in
+        place.
+
+        Weight of a basis element of a qubit is a sum of squares of all
+        Pauli vector components, that have this element on this qubit.
+        Elements with weights below `threshold` are removed, and the qubit
+        is switched to a subbasis of its basis, so that further PTM
+        applications work with a smaller tensor. Unlike
+        :func:`quantumsim.operations.compiler.ChainCompiler.optimal_bases`,
+        which relies on the structure of PTMs, this uses the actual state,
+        for example coherences of leaked levels, that decayed due to
+        dephasing.
+
+        Parameters
+        ----------
+        threshold : float
+            Basis elements with weights not greater than this are dropped.
+            At least one element of every qubit is kept.
+        qubits : list of int or None
+            Qubits to truncate. If `None`, all qubits are considered.
+
+        Returns
+        -------
+        float
+            Squared Hilbert-Schmidt norm of the discarded part of the
+            Pauli vector.
+        """
+        if qubits is None:
+            qubits = range(self.n_qubits)
+        qubits = tuple(qubits)
+        self._validate_qubits(qubits)
+        discarded = 0.
+        for qubit in qubits:
+            weights = np.asarray(self._element_weights(qubit))
+            keep = weights > threshold
+            if np.all(keep):
+                continue
+            if not np.any(keep):
+                keep[np.argmax(weights)] = True
+            discarded += float(np.sum(weights[~keep]))
+            indices = np.flatnonzero(keep)
+            self._select_elements(qubit, indices)
+            self.bases[qubit] = self.bases[qubit].subbasis(indices)
+        return discarded
+
+    def _element_weights(self, qubit):
+        raise NotImplementedError(
+            'Basis truncation is not supported by {}'
+            .format(self.__class__.__name__))
+
+    def _select_elements(self, qubit, indices):
+        """Keep only basis elements `indices` of the qubit."""
+        self.apply_ptm(np.identity(self.bases[qubit].dim_pauli)[indices],
+                       qubit)
+
+    def save(self, path, *, background=False):
+        """Write a checkpoint of the Pauli vector to a file, that can be read
+        back with :func:`quantumsim.pauli_vectors.load`.
+
+        Data is written raw, so that it can be memory-mapped back without
+        copying, and bases are stored as compact descriptors.
+
+        Parameters
+        ----------
+        path : str
+            Name of the file.
+        background : bool
+            If `True`, data is copied in memory and written in a background
+            thread, see :func:`quantumsim.pauli_vectors.checkpoint.save`.
+
+        Returns
+        -------
+        concurrent.futures.Future or None
+            If `background` is `True`, a future, that is done, when the file
+            is written.
+        """
+        from .checkpoint import save
+        return save(self, path, background=background)
+
+    def _checkpoint(self):
+        """Data arrays and JSON-serializable attributes, that are needed
+        to restore the Pauli vector with :func:`_from_checkpoint`."""
+        raise NotImplementedError(
+            'Checkpoints are not supported by {}'
+            .format(self.__class__.__name__))
+
+    @classmethod
+    def _from_checkpoint(cls, bases, arrays, attrs):
+        raise NotImplementedError(
+            'Checkpoints are not supported by {}'.format(cls.__name__))
+
+    def _add_qubit(self, basis, pv):
+        raise NotImplementedError(
+            'Adding qubits is not supported by {}'
+            .format(self.__class__.__name__))
+
+    def _reset(self, qubit, basis, pv):
+        raise NotImplementedError(
+            'Resetting qubits is not supported by {}'
+            .format(self.__class__.__name__))
+
+    def _remove_qubit(self, qubit):
+        raise NotImplementedError(
+            'Removing qubits is not supported by {}'
+            .format(self.__class__.__name__))
+
+    def project(self, qubit, outcome):
+        """Project a qubit onto a computational basis state and renormalize
+        the Pauli vector.
+
+        The basis of the qubit is replaced with a one-element computational
+        subbasis, so that the axis of the qubit shrinks to size 1 and the
+        qubit does not cost memory and time in further computations.
+        Probability of the outcome is accumulated in :attr:`norm`, so that
+        the probability of a whole sequence of projections (for example,
+        for post-selection) is available.
+
+        Parameters
+        ----------
+        qubit : int
+            Qubit to project.
+        outcome : int
+            Computational basis state to project onto.
+
+        Returns
+        -------
+        float
+            Probability of the outcome, conditioned on the previous ones.
+        """
+        self._validate_qubit(qubit, 'qubit')
+        basis = self.bases[qubit]
+        if not 0 <= outcome < basis.dim_hilbert:
+            raise ValueError(
+                '`outcome` must be between 0 and {}, got {}'
+                .format(basis.dim_hilbert - 1, outcome))
+        probability = self.meas_prob(qubit)[..., outcome] / self.trace()
+        # The result is a coefficient of the |k><k| basis element, that is
+        # given by the diagonal element of a single-qubit density matrix
+        ptm = basis.computational_basis_vectors[outcome].real.reshape(1, -1)
+        self.apply_ptm(ptm, qubit)
+        self.bases[qubit] = _projected_basis(basis, outcome)
+        self.renormalize()
+        self.norm = self.norm * probability
+        return probability
+
+    def measure(self, qubit, rng=None):
+        """Measure a qubit in the computational basis, sampling the outcome
+        from its probability distribution, and project the qubit onto it
+        (see :func:`project`).
+
+        Parameters
+        ----------
+        qubit : int
+            Qubit to measure.
+        rng : numpy.random.Generator, numpy.random.RandomState, int or None
+            Random number generator or a seed for it.
+
+        Returns
+        -------
+        int
+            Outcome of the measurement.
+        """
+        rng = _rng(rng)
+        self._validate_qubit(qubit, 'qubit')
+        probs = np.cumsum(self.meas_prob(qubit))
+        outcome = int(np.searchsorted(probs, rng.random() * probs[-1],
+                                      side='right'))
+        outcome = min(outcome, len(probs) - 1)
+        self.project(qubit, outcome)
+        return outcome
+
+    def _validate_qubits(self, qubits):
+        for q in qubits:
+            self._validate_qubit(q, 'qubit')
+        if len(set(qubits)) != len(qubits):
+            raise ValueError('Qubit indices must be unique, got {}'
+                             .format(qubits))
+
+    def _parse_bitstrings(self, bitstrings):
+        outcomes = np.array([[int(c) for c in b] if isinstance(b, str)
+                             else b for b in bitstrings], dtype=int)
+        if outcomes.size == 0:
+            outcomes = outcomes.reshape(0, self.n_qubits)
+        if outcomes.ndim != 2 or outcomes.shape[1] != self.n_qubits:
+            raise ValueError(
+                'Bitstrings must have {} outcomes each, got an array of '
+                'shape {}'.format(self.n_qubits, outcomes.shape))
+        if np.any(outcomes < 0) or \
+                np.any(outcomes >= np.array(self.dim_hilbert)):
+            raise ValueError('Outcomes must be between 0 and dim_hilbert-1 '
+                             'of each qubit')
+        return outcomes
+
     def _validate_qubit(self, number, name):
         if number < 0 or number >= self.n_qubits:
             raise ValueError(
@@ -114,3 +736,32 @@ class PauliVectorBase(metaclass=abc.ABCMeta):
                 .format(name=name,
                         target_shape=target_shape,
                         real_shape=ptm.shape))
+
+
+def _single_qubit_pv(basis, state):
+    """Pauli vector of a single qubit in a computational basis state
+    `state`, or `state` itself, if it is a Pauli vector already."""
+    if isinstance(state, (int, np.integer)):
+        if not 0 <= state < basis.dim_hilbert:
+            raise ValueError('`state` must be between 0 and {}, got {}'
+                             .format(basis.dim_hilbert - 1, state))
+        dm = np.zeros((basis.dim_hilbert, basis.dim_hilbert))
+        dm[state, state] = 1
+        return basis.hilbert_to_pauli_vector(dm).real
+    pv = np.asarray(state, dtype=np.float64)
+    if pv.shape != (basis.dim_pauli,):
+        raise ValueError('Pauli vector of a qubit must have shape {}, got {}'
+                         .format((basis.dim_pauli,), pv.shape))
+    return pv
+
+
+@lru_cache(maxsize=64)
+def _projected_basis(basis, outcome):
+    """One-element basis of a state :math:`|k\\rangle\\langle k|`, that
+    is a subbasis of `basis`' superbasis, if possible."""
+    superbasis = basis.superbasis
+    index = superbasis.computational_basis_indices[outcome]
+    if index is None:
+        superbasis = general(basis.dim_hilbert)
+        index = superbasis.computational_basis_indices[outcome]
+    return superbasis.subbasis([index])
@@ -0,0 +1,145 @@
+"""Registry of Pauli vector backends.
+
+Backends are registered under names, either as classes or as import paths
+of the form `'module:Class'`, that are imported only when the backend is
+requested for the first time. This way importing Quantumsim does not
+initialize CUDA, and short-lived worker processes, that use the Numpy
+backend only, never touch it.
+
+A backend is selected by name with :func:`get`. If the name is not
+provided, it is taken from the environment variable
+`QUANTUMSIM_BACKEND`; if that is not set either, the `'auto'` backend is
+used, that is the CUDA backend, if it can be imported, or the Numpy one
+otherwise.
+"""
+import importlib
+import os
+import warnings
+
+ENV_VARIABLE = 'QUANTUMSIM_BACKEND'
+AUTO = 'auto'
+
+_registry = {}
+_loaded = {}
+_auto_order = ['cuda', 'numpy']
+
+
+def register(name, backend, *, replace=False):
+    """Register a Pauli vector backend.
+
+    Parameters
+    ----------
+    name : str
+        Name of the backend.
+    backend : type or str
+        Pauli vector class (a subclass of
+        :class:`quantumsim.pauli_vectors.pauli_vector.PauliVectorBase`) or
+        its import path in the form `'module:Class'`, that is imported
+        lazily.
+    replace : bool
+        Allow replacing a backend, that is registered under the same name.
+    """
+    if name == AUTO:
+        raise ValueError('Name {} is reserved'.format(AUTO))
+    if name in _registry and not replace:
+        raise ValueError('Backend {} is already registered, pass '
+                         '`replace=True` to replace it'.format(name))
+    if isinstance(backend, str):
+        if ':' not in backend:
+            raise ValueError("Import path of a backend must have a form "
+                             "'module:Class', got {}".format(backend))
+    _registry[name] = backend
+    _loaded.pop(name, None)
+
+
+def unregister(name):
+    """Remove a backend from the registry.
+
+    Parameters
+    ----------
+    name : str
+        Name of the backend.
+    """
+    if name not in _registry:
+        raise KeyError('Backend {} is not registered'.format(name))
+    del _registry[name]
+    _loaded.pop(name, None)
+
+
+def names():
+    """Names of the registered backends, including the ones, that were not
+    imported yet.
+
+    Returns
+    -------
+    list of str
+    """
+    return list(_registry)
+
+
+def get(name=None):
+    """Get a Pauli vector backend class, importing it, if necessary.
+
+    Parameters
+    ----------
+    name : str or None
+        Name of the backend. If `None`, the value of the environment
+        variable `QUANTUMSIM_BACKEND` is used, or `'auto'`, if it is not
+        set.
+
+    Returns
+    -------
+    type
+        A subclass of
+        :class:`quantumsim.pauli_vectors.pauli_vector.PauliVectorBase`.
+    """
+    if name is None:
+        name = os.environ.get(ENV_VARIABLE) or AUTO
+    if name == AUTO:
+        return _auto()
+    try:
+        return _loaded[name]
+    except KeyError:
+        pass
+    try:
+        backend = _registry[name]
+    except KeyError:
+        raise ValueError('Unknown backend {}, available backends are: {}'
+                         .format(name, ', '.join(names()))) from None
+    if isinstance(backend, str):
+        module, attribute = backend.split(':')
+        backend = getattr(importlib.import_module(module), attribute)
+    _loaded[name] = backend
+    return backend
+
+
+def _auto():
+    try:
+        return _loaded[AUTO]
+    except KeyError:
+        pass
+    for name in _auto_order:
+        try:
+            backend = get(name)
+            break
+        except ImportError:
+            continue
+    else:
+        raise ImportError('None of the backends {} could be imported'
+                          .format(', '.join(_auto_order)))
+    if name != _auto_order[0]:
+        warnings.warn('Could not import CUDA backend. Either PyCUDA is not '
+                      'installed, or your PC has no NVidia GPU at all. Be '
+                      'wise with a difficulty of the problem you state to '
+                      'Quantumsim.')
+    _loaded[AUTO] = backend
+    return backend
+
+
+register('numpy', 'quantumsim.pauli_vectors.numpy:PauliVectorNumpy')
+register('cuda', 'quantumsim.pauli_vectors.cuda:PauliVectorCuda')
+register('batch', 'quantumsim.pauli_vectors.batch:PauliVectorBatch')
+register('memmap', 'quantumsim.pauli_vectors.memmap:PauliVectorMemmap')
+register('sparse', 'quantumsim.pauli_vectors.sparse:PauliVectorSparse')
+register('mps', 'quantumsim.pauli_vectors.mps:PauliVectorMPS')
+register('shared', 'quantumsim.pauli_vectors.shared:PauliVectorShared')
@@ -0,0 +1,163 @@
+"""Sampling of measurement shots from Pauli vectors."""
+import numpy as np
+
+OUTCOMES = 'outcomes'
+PACKED = 'packed'
+COUNTS = 'counts'
+
+
+class Sampler:
+    """Draws measurement shots in the computational basis from a Pauli
+    vector.
+
+    The joint probability distribution of the qubits is computed once, when
+    the sampler is created, and its cumulative sum is reused by all
+    subsequent calls of :func:`sample`. Later changes of the Pauli vector do
+    not affect the sampler.
+
+    Parameters
+    ----------
+    pauli_vector : quantumsim.pauli_vectors.PauliVectorBase
+        State to sample from.
+    qubits : list of int or None
+        Qubits to measure. If `None`, all qubits are measured. Other qubits
+        are traced out, so that the full diagonal of the density matrix is
+        not computed.
+    """
+
+    def __init__(self, pauli_vector, qubits=None):
+        if qubits is None:
+            qubits = range(pauli_vector.n_qubits)
+        self.qubits = tuple(qubits)
+        self.dims = tuple(pauli_vector.dim_hilbert[q] for q in self.qubits)
+        probs = pauli_vector.joint_meas_prob(*self.qubits).flatten()
+        # Negative probabilities may appear due to rounding errors only
+        probs = np.clip(probs, 0, None)
+        total = np.sum(probs)
+        if total <= 0:
+            raise ValueError('Pauli vector has zero trace, nothing to sample')
+        self.probs = probs / total
+        self._cdf = np.cumsum(self.probs)
+
+    def sample(self, n_shots, rng=None, *, output=OUTCOMES):
+        """Draw measurement shots.
+
+        Parameters
+        ----------
+        n_shots : int
+            Number of shots.
+        rng : numpy.random.Generator, numpy.random.RandomState, int or None
+            Random number generator or a seed for it.
+        output : str
+            Format of the result:
+
+            - `'outcomes'`: array of shape `(n_shots, n_qubits)` with
+              outcomes of each qubit in each shot;
+            - `'packed'`: the same, but packed into bits with
+              :func:`numpy.packbits` (all qubits must be two-level), an
+              array of shape `(n_shots, ceil(n_qubits / 8))`;
+            - `'counts'`: array of shape `dims` with numbers of shots,
+              that produced each combination of outcomes.
+
+        Returns
+        -------
+        ndarray
+        """
+        _validate_output(output, self.dims)
+        rng = _rng(rng)
+        if output == COUNTS:
+            # Multinomial sampling is much faster, than counting shots
+            return rng.multinomial(n_shots, self.probs).reshape(self.dims)
+        indices = np.searchsorted(self._cdf, rng.random(n_shots) *
+                                  self._cdf[-1], side='right')
+        # Protects against rounding errors in the last element of CDF
+        np.minimum(indices, len(self._cdf) - 1, out=indices)
+        return _format(np.stack(np.unravel_index(indices, self.dims),
+                                axis=1), self.dims, output)
+
+
+def sample_sequential(pauli_vector, n_shots, qubits=None, rng=None, *,
+                      output=OUTCOMES):
+    """Draw measurement shots, sampling the qubits one by one from their
+    distributions conditioned on the outcomes of the previous ones.
+
+    Only single-qubit distributions are ever computed: the state is
+    projected on every outcome drawn (see
+    :func:`PauliVectorBase.project`), that shrinks it with every measured
+    qubit. This is preferable to :class:`Sampler`, if the joint distribution
+    of qubits measured is too large to be stored.
+
+    Parameters
+    ----------
+    pauli_vector : quantumsim.pauli_vectors.PauliVectorBase
+        State to sample from. It is not changed.
+    n_shots : int
+        Number of shots.
+    qubits : list of int or None
+        Qubits to measure, in the order of sampling. If `None`, all
+        qubits are measured.
+    rng : numpy.random.Generator, numpy.random.RandomState, int or None
+        Random number generator or a seed for it.
+    output : str
+        Format of the result, see :func:`Sampler.sample`.
+
+    Returns
+    -------
+    ndarray
+    """
+    rng = _rng(rng)
+    if qubits is None:
+        qubits = range(pauli_vector.n_qubits)
+    qubits = tuple(qubits)
+    dims = tuple(pauli_vector.dim_hilbert[q] for q in qubits)
+    _validate_output(output, dims)
+    outcomes = np.empty((n_shots, len(qubits)), dtype=np.int64)
+
+    def branch(state, depth, shots):
+        # Distribute shots of a branch between outcomes of the next qubit
+        if depth == len(qubits) or len(shots) == 0:
+            return
+        probs = np.clip(state.meas_prob(qubits[depth]), 0, None)
+        counts = rng.multinomial(len(shots), probs / np.sum(probs))
+        start = 0
+        for outcome, count in enumerate(counts):
+            if count == 0:
+                continue
+            branch_shots = shots[start:start + count]
+            start += count
+            outcomes[branch_shots, depth] = outcome
+            if depth + 1 < len(qubits):
+                branch_state = state.copy()
+                branch_state.project(qubits[depth], outcome)
+                branch(branch_state, depth + 1, branch_shots)
+
+    # Shots are assigned to branches in a random order, so that the
+    # result is a sequence of independent shots.
+    branch(pauli_vector, 0, rng.permutation(n_shots))
+    if output == COUNTS:
+        counts = np.zeros(int(np.prod(dims)), dtype=np.int64)
+        np.add.at(counts, np.ravel_multi_index(outcomes.T, dims), 1)
+        return counts.reshape(dims)
+    return _format(outcomes, dims, output)
+
+
+def _validate_output(output, dims):
+    if output not in (OUTCOMES, PACKED, COUNTS):
+        raise ValueError("`output` must be one of '{}', '{}' or '{}', got {}"
+                         .format(OUTCOMES, PACKED, COUNTS, output))
+    if output == PACKED and any(d != 2 for d in dims):
+        raise ValueError('Only outcomes of two-level systems can be packed '
+                         'into bits, got dimensions {}'.format(dims))
+
+
+def _format(outcomes, dims, output):
+    if output == PACKED:
+        return np.packbits(outcomes.astype(np.uint8), axis=1)
+    return outcomes.astype(np.min_scalar_type(max(dims) - 1))
+
+
+def _rng(rng):
+    """Random number generator from a seed, or as is."""
+    if rng is None or isinstance(rng, (int, np.integer)):
+        return np.random.default_rng(rng)
+    return rng
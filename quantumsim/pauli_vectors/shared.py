@@ -0,0 +1,316 @@
+import weakref
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from .numpy import PauliVectorNumpy
+from .pauli_vector import PauliVectorBase
+
+# A segment starts with a header, that holds the version of the state, so
+# that memoized quantities are invalidated in all processes
+_HEADER_BYTES = 64
+
+
+class SharedHandle:
+    """A lightweight picklable reference to a :class:`PauliVectorShared`,
+    that may be passed to other processes and attached to with
+    :func:`PauliVectorShared.attach`.
+
+    A handle describes the state at the moment it was taken. Handles stay
+    valid, while the owner changes the data in place (applies PTMs,
+    renormalizes it, etc.), but operations, that change the shape of the
+    Pauli vector (projections, adding and removing qubits, basis
+    truncation), require a new handle.
+    """
+
+    def __init__(self, name, shape, dtype, bases, norm, tracker=None):
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+        self.bases = bases
+        self.norm = norm
+        # PID of the resource tracker of the owner, see `_attach_segment`
+        self.tracker = tracker
+
+    def __repr__(self):
+        return '{}(name={!r}, shape={})'.format(
+            self.__class__.__name__, self.name, self.shape)
+
+
+class PauliVectorShared(PauliVectorNumpy):
+    """A Pauli vector, that is stored in a shared memory segment (see
+    :mod:`multiprocessing.shared_memory`), so that several processes may
+    work with the same state without copying it.
+
+    A Pauli vector, that is created with a constructor, owns its segment:
+    the segment is removed, when the owner is closed (see :func:`close`) or
+    garbage collected. Other processes attach to the segment with
+    :func:`attach`, given a :func:`handle`. Pickling a shared Pauli vector
+    pickles the handle only, and unpickling attaches to the segment
+    read-only, so the Pauli vector may be passed to worker processes
+    directly, for example with :class:`multiprocessing.Pool`.
+
+    Read-only attachments may compute any derived quantities (marginals,
+    probabilities, samples, etc.), but not modify the state. Writable
+    attachments must be requested explicitly; they modify the data in place,
+    so that the changes are visible to all processes, but can not grow the
+    state beyond the size of the segment. It is up to the user to
+    synchronize the processes, that modify the state.
+
+    PTMs are applied the same way, as in :class:`PauliVectorNumpy`, and
+    the result is copied back into the segment, so that the handles stay
+    valid. Work buffers are released after that, so that between operations
+    the state occupies the segment only. :attr:`version` is stored in the
+    segment too, so that derived quantities, memoized by attached Pauli
+    vectors, are invalidated, when the state changes.
+
+    Parameters
+    ----------
+    bases : list of quantumsim.bases.PauliBasis
+        A descrption of the basis for the subsystems.
+    pv : array or None
+        Pauli vector, see :class:`PauliVectorNumpy`. It is copied to the
+        shared memory.
+    force : bool
+        Allow creation of large Pauli vectors, see :class:`PauliVectorNumpy`.
+    dtype : numpy.float32, numpy.float64 or None
+        Working precision, see :class:`PauliVectorNumpy`.
+    threads : int
+        Number of threads to apply PTMs with, see :class:`PauliVectorNumpy`.
+    """
+
+    def __init__(self, bases, pv=None, *, force=False, dtype=None,
+                 threads=1):
+        self._shm = None
+        self._finalizer = None
+        super().__init__(bases, pv, force=force, dtype=dtype,
+                         threads=threads)
+        self._owner = True
+        self._writable = True
+        self._publish()
+
+    @classmethod
+    def attach(cls, handle, *, writable=False):
+        """Attach to a shared Pauli vector, possibly created by another
+        process.
+
+        Parameters
+        ----------
+        handle : SharedHandle
+            Handle, obtained with :func:`handle`.
+        writable : bool
+            Whether the Pauli vector may be modified.
+
+        Returns
+        -------
+        PauliVectorShared
+            A Pauli vector, that does not own the segment.
+        """
+        from .checkpoint import _basis_from_descriptor
+        pv = cls.__new__(cls)
+        pv._shm = None
+        pv._finalizer = None
+        pv.threads = 1
+        pv._dtype = np.dtype(handle.dtype)
+        PauliVectorBase.__init__(
+            pv, [_basis_from_descriptor(d) for d in handle.bases], force=True)
+        pv.norm = (np.array(handle.norm) if isinstance(handle.norm, list)
+                   else handle.norm)
+        pv._buffers = [None, None]
+        pv._data_buffer = None
+        pv._owner = False
+        pv._writable = writable
+        pv._set_segment(_attach_segment(handle.name, handle.tracker))
+        pv._data = pv._segment_view(handle.shape)
+        return pv
+
+    def handle(self):
+        """A lightweight picklable reference to the Pauli vector.
+
+        Returns
+        -------
+        SharedHandle
+        """
+        from .checkpoint import basis_descriptor
+        self._check_open()
+        norm = self.norm
+        return SharedHandle(
+            self._shm.name, self._data.shape, self._dtype,
+            [basis_descriptor(b) for b in self.bases],
+            norm.tolist() if isinstance(norm, np.ndarray) else norm,
+            _tracker_pid())
+
+    @property
+    def owner(self):
+        """Whether the Pauli vector owns its segment and removes it, when
+        closed."""
+        return self._owner
+
+    @property
+    def writable(self):
+        """Whether the Pauli vector may be modified."""
+        return self._writable
+
+    @property
+    def closed(self):
+        return self._shm is None
+
+    @property
+    def version(self):
+        if self._shm is not None:
+            return int(self._version_cell[0])
+        return self._version
+
+    @version.setter
+    def version(self, value):
+        self._version = value
+        if self._shm is not None:
+            self._version_cell[0] = value
+
+    def close(self):
+        """Detach from the segment. If the Pauli vector is an owner, the
+        segment is removed, and attached Pauli vectors in other processes
+        keep their data until they are closed too. The Pauli vector can not
+        be used after that."""
+        self._version = self.version
+        self._data = None
+        self._memo.clear()
+        self._release_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __reduce__(self):
+        return self.__class__.attach, (self.handle(),)
+
+    def to_pv(self):
+        """Get data in a form of Numpy array.
+
+        The array returned is a view of the shared memory segment, that is
+        read-only for read-only attachments.
+        """
+        self._check_open()
+        return self._data
+
+    def apply_ptm(self, ptm, *qubits):
+        self._check_writable()
+        super().apply_ptm(ptm, *qubits)
+
+    def renormalize(self):
+        self._check_writable()
+        super().renormalize()
+
+    def copy(self):
+        """Copy the Pauli vector to a new segment, that is owned by the
+        copy."""
+        self._check_open()
+        return super().copy()
+
+    def _snapshot(self):
+        # Data in the segment is overwritten by PTMs, so it can not be shared
+        # with a snapshot
+        return self.copy()
+
+    def _apply_plan(self, plan, ptm):
+        super()._apply_plan(plan, ptm)
+        self._publish()
+
+    def _set_data(self, data):
+        self._check_writable()
+        super()._set_data(data)
+        self._publish()
+
+    def _publish(self):
+        """Copy the data from a work buffer to the segment, allocating a
+        new one, if the data does not fit, and release the work buffers."""
+        data = self._data
+        if self._shm is None or \
+                self._shm.size < _HEADER_BYTES + data.nbytes:
+            if not self._owner:
+                raise ValueError(
+                    'State does not fit the shared memory segment, only the '
+                    'owner may reallocate it')
+            version = self.version
+            self._release_segment()
+            self._set_segment(shared_memory.SharedMemory(
+                create=True, size=_HEADER_BYTES + data.nbytes))
+            self.version = version
+        view = self._segment_view(data.shape)
+        if view is not data:
+            np.copyto(view, data)
+        self._data = view
+        self._data_buffer = None
+        # The segment is owned by the Pauli vector, and the work buffers
+        # would only triple the memory, that the state occupies
+        self._exposed = False
+        self._buffers = [None, None]
+
+    def _set_segment(self, shm):
+        self._shm = shm
+        self._version_cell = np.ndarray((1,), dtype=np.int64, buffer=shm.buf)
+        self._finalizer = weakref.finalize(self, _release, shm, self._owner)
+
+    def _release_segment(self):
+        if self._shm is not None:
+            self._version = self.version
+            self._version_cell = None
+            self._shm = None
+            self._finalizer()
+
+    def _segment_view(self, shape):
+        view = np.ndarray(shape, dtype=self._dtype, buffer=self._shm.buf,
+                          offset=_HEADER_BYTES)
+        if not self._writable:
+            view.flags.writeable = False
+        return view
+
+    def _check_open(self):
+        if self._shm is None:
+            raise ValueError('Shared Pauli vector is closed')
+
+    def _check_writable(self):
+        self._check_open()
+        if not self._writable:
+            raise ValueError('Shared Pauli vector is attached read-only')
+
+
+def _tracker_pid():
+    return getattr(resource_tracker._resource_tracker, '_pid', None)
+
+
+def _attach_segment(name, tracker):
+    try:
+        # Python 3.13+: attached segments must not be removed by the
+        # resource tracker of this process on exit
+        return shared_memory.SharedMemory(name, track=False)
+    except TypeError:
+        pass
+    # Older versions register the segment with the resource tracker, that
+    # unlinks it, when the process exits. Registration is undone, unless the
+    # tracker is shared with the owner (a worker, started by
+    # `multiprocessing`, inherits the tracker of its parent, and its PID is
+    # known only after a fork), in which case registration was a no-op, and
+    # undoing it would drop the registration of the owner.
+    shm = shared_memory.SharedMemory(name)
+    pid = _tracker_pid()
+    if getattr(shared_memory, '_USE_POSIX', False) and \
+            pid is not None and pid != tracker:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _release(shm, unlink):
+    try:
+        shm.close()
+    except BufferError:
+        # Views of the segment are still referenced somewhere. The mapping
+        # is removed, when they are garbage collected.
+        pass
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
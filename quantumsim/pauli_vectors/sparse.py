@@ -0,0 +1,451 @@
+import numpy as np
+import pytools
+
+from .numpy import PauliVectorNumpy, _working_dtype
+from .pauli_vector import PauliVectorBase, MemoryFootprint, memoized, \
+    _single_qubit_pv
+from ._reductions import trace_row
+
+
+class PauliVectorSparse(PauliVectorBase):
+    """A Pauli vector, that stores only its nonzero elements.
+
+    Circuits, that start in computational basis states and consist mostly of
+    classical or Clifford-like operations, keep only a few nonzero elements
+    of the Pauli vector, while the dense representation grows exponentially
+    with the number of qubits. This backend stores coordinates and values of
+    the nonzero elements only. A PTM is applied by grouping elements, that
+    differ only on the target qubits, and multiplying every group by the
+    PTM, so that the cost is proportional to the number of nonzero elements
+    rather than to the size of the state.
+
+    When the fraction of nonzero elements exceeds `density_max`, the Pauli
+    vector switches to a dense :class:`PauliVectorNumpy` storage (see
+    :attr:`is_dense`) and stays dense afterwards.
+
+    Parameters
+    ----------
+    bases : list of quantumsim.bases.PauliBasis
+        A descrption of the basis for the subsystems.
+    pv : array, tuple or None
+        Pauli vector, that represents the density matrix in the selected
+        bases: either a dense array, or a tuple `(coords, values)` of its
+        nonzero elements (see :func:`entries`) with unique coordinates. If
+        `None`, density matrix is initialized in
+        :math:`\\left| 0 \\cdots 0 \\right\\rangle` state.
+    force : bool
+        Dense storage is used only, if it does not exceed the size limit of
+        :class:`PauliVectorNumpy`. Set this to `True` to ignore the limit.
+    dtype : numpy.float32, numpy.float64 or None
+        Working precision, see :class:`PauliVectorNumpy`.
+    density_max : float
+        Fraction of nonzero elements, above which the dense storage is used.
+    atol : float or None
+        Elements with absolute values not greater than this are considered
+        zero after PTM application. If `None`, ten machine epsilons of
+        `dtype` is used, so that rounding errors do not fill the state.
+    """
+    # Only nonzero elements are stored, so the size of a state is not limited
+    _size_max = float('inf')
+
+    def __init__(self, bases, pv=None, *, force=False, dtype=None,
+                 density_max=0.1, atol=None):
+        if isinstance(pv, tuple):
+            coords, values = pv
+            self._dtype = _working_dtype(dtype, values)
+        else:
+            self._dtype = _working_dtype(dtype, pv)
+        super().__init__(bases, force=True)
+        if not 0 <= density_max <= 1:
+            raise ValueError('`density_max` must be between 0 and 1, got {}'
+                             .format(density_max))
+        self.density_max = density_max
+        self.atol = (10 * np.finfo(self._dtype).eps if atol is None
+                     else atol)
+        self._force = force
+        # Dense Pauli vector, that the operations are delegated to, after
+        # the state became too dense. It shares the list of bases with this
+        # Pauli vector.
+        self._dense = None
+
+        if pv is None:
+            coords = np.zeros((0, 1), dtype=np.intp)
+            values = np.ones(1)
+            for basis in self.bases:
+                coords, values = _append_axis(
+                    coords, values, _single_qubit_pv(basis, 0))
+        elif isinstance(pv, tuple):
+            coords = np.array(coords, dtype=np.intp).reshape(
+                self.n_qubits, -1)
+            values = np.asarray(values)
+            if values.shape != coords.shape[1:]:
+                raise ValueError(
+                    'Number of coordinates ({}) does not match the number of '
+                    'values ({})'.format(coords.shape[1], values.size))
+            if np.any(coords < 0) or np.any(
+                    coords >= np.array(self.dim_pauli).reshape(-1, 1)):
+                raise ValueError('Coordinates must be between 0 and '
+                                 'dim_pauli-1 of each qubit')
+        elif isinstance(pv, np.ndarray):
+            if self.dim_pauli != pv.shape:
+                raise ValueError(
+                    '`bases` Pauli dimensionality should be the same as the '
+                    'shape of `data` array.\n'
+                    ' - bases shapes: {}\n - data shape: {}'
+                    .format(self.dim_pauli, pv.shape))
+            nonzero = np.nonzero(pv)
+            coords = np.array(nonzero, dtype=np.intp).reshape(
+                self.n_qubits, -1)
+            values = pv[nonzero]
+        else:
+            raise ValueError(
+                "`pv` should be Numpy array, tuple or None, got type `{}`"
+                .format(type(pv)))
+        if values.dtype not in (np.float16, np.float32, np.float64):
+            raise ValueError('`pv` must have floating point data type, got {}'
+                             .format(values.dtype))
+        self._set_entries(coords, values, self.dim_pauli)
+        self.version = 0
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def is_dense(self):
+        """Whether the Pauli vector switched to the dense storage."""
+        return self._dense is not None
+
+    @property
+    def nnz(self):
+        """Number of elements stored."""
+        if self._dense is not None:
+            return self._dense.to_pv().size
+        return len(self._values)
+
+    @property
+    def density(self):
+        """Fraction of the Pauli vector elements, that are stored."""
+        return self.nnz / pytools.product(self._shape)
+
+    def entries(self):
+        """Coordinates and values of the nonzero elements.
+
+        Returns
+        -------
+        coords : array
+            Integer array of shape `(n_qubits, nnz)`: indices of basis
+            elements of every qubit.
+        values : array
+            Array of shape `(nnz,)`.
+        """
+        if self._dense is not None:
+            data = self._dense.to_pv()
+            nonzero = np.nonzero(data)
+            return (np.array(nonzero, dtype=np.intp).reshape(
+                self.n_qubits, -1), data[nonzero])
+        return self._coords, self._values
+
+    def to_pv(self):
+        if self._dense is not None:
+            return self._dense.to_pv()
+        data = np.zeros(self._shape, dtype=self._dtype)
+        data[tuple(self._coords)] = self._values
+        return data
+
+    def apply_ptm(self, ptm, *qubits):
+        if len(ptm.shape) != 2 * len(qubits):
+            raise ValueError(
+                '{}-qubit PTM must have {} dimensions, got {}'
+                .format(len(qubits), 2*len(qubits), len(ptm.shape)))
+        self._validate_qubits(qubits)
+        shape_in = tuple(self._shape[q] for q in qubits)
+        if ptm.shape[len(qubits):] != shape_in:
+            raise ValueError(
+                'PTM input shape must be {}, got {}'
+                .format(shape_in, ptm.shape[len(qubits):]))
+        if self._dense is not None:
+            self._dense.apply_ptm(ptm, *qubits)
+            self.version += 1
+            return
+        shape_out = ptm.shape[:len(qubits)]
+        ptm = ptm.reshape(pytools.product(shape_out),
+                          pytools.product(shape_in)).astype(self._dtype)
+        qubits = list(qubits)
+        rest = [q for q in range(self.n_qubits) if q not in qubits]
+        rest_shape = [self._shape[q] for q in rest]
+
+        # Elements, that differ only on the target qubits, form a group. A
+        # PTM is applied to the dense matrix of groups, that is small, since
+        # there are at most `nnz` groups with `ptm.shape[1]` elements each.
+        keys, groups = _unique(self._coords[rest], rest_shape)
+        matrix = np.zeros((keys.shape[1], ptm.shape[1]), dtype=self._dtype)
+        matrix[groups, _ravel(self._coords[qubits], shape_in)] = \
+            self._values
+        result = matrix @ ptm.T
+        i_group, i_out = np.nonzero(np.abs(result) > self.atol)
+
+        coords = np.empty((self.n_qubits, len(i_group)), dtype=np.intp)
+        coords[rest] = keys[:, i_group]
+        coords[qubits] = np.array(np.unravel_index(i_out, shape_out),
+                                  dtype=np.intp).reshape(len(qubits), -1)
+        shape = list(self._shape)
+        for q, dim in zip(qubits, shape_out):
+            shape[q] = dim
+        self._set_entries(coords, result[i_group, i_out], shape)
+
+    @memoized
+    def diagonal(self, *, get_data=True):
+        if self._dense is not None:
+            return self._dense.diagonal()
+        coords, values = self._contract(
+            [b.computational_basis_vectors.real for b in self.bases], [])
+        diag = np.zeros(self.dim_hilbert)
+        diag[tuple(coords)] = values
+        return diag.reshape(pytools.product(self.dim_hilbert))
+
+    @memoized
+    def trace(self):
+        if self._dense is not None:
+            return self._dense.trace()
+        _, values = self._contract([trace_row(b) for b in self.bases],
+                                   range(self.n_qubits))
+        return float(np.sum(values))
+
+    def partial_trace(self, *qubits):
+        self._validate_qubits(qubits)
+        coords, values = self._contract(
+            [np.identity(b.dim_pauli) if i in qubits else trace_row(b)
+             for i, b in enumerate(self.bases)],
+            [i for i in range(self.n_qubits) if i not in qubits])
+        kept = sorted(qubits)
+        coords = coords[[kept.index(q) for q in qubits]]
+        return self.__class__([self.bases[q] for q in qubits],
+                              (coords, values.astype(self._dtype)),
+                              force=self._force,
+                              density_max=self.density_max, atol=self.atol)
+
+    @memoized
+    def meas_prob(self, qubit):
+        self._validate_qubit(qubit, 'qubit')
+        return self.joint_meas_prob(qubit)
+
+    @memoized
+    def marginals(self):
+        return [self.meas_prob(q) for q in range(self.n_qubits)]
+
+    @memoized
+    def joint_meas_prob(self, *qubits):
+        self._validate_qubits(qubits)
+        coords, values = self._contract(
+            [b.computational_basis_vectors.real if i in qubits
+             else trace_row(b) for i, b in enumerate(self.bases)],
+            [i for i in range(self.n_qubits) if i not in qubits])
+        kept = sorted(qubits)
+        coords = coords[[kept.index(q) for q in qubits]]
+        probs = np.zeros([self.dim_hilbert[q] for q in qubits])
+        probs[tuple(coords)] = values
+        return probs
+
+    def bitstring_probs(self, bitstrings):
+        outcomes = self._parse_bitstrings(bitstrings)
+        coords, values = self._contract(
+            [b.computational_basis_vectors.real for b in self.bases], [])
+        # Nonzero diagonal elements and bitstrings are matched by grouping
+        # them together
+        keys, groups = _unique(np.concatenate([coords, outcomes.T], axis=1),
+                               self.dim_hilbert)
+        probs = np.zeros(keys.shape[1])
+        probs[groups[:len(values)]] = values
+        return probs[groups[len(values):]]
+
+    @memoized
+    def purity(self):
+        values = self.entries()[1].astype(np.float64)
+        return np.dot(values, values)
+
+    def _scale(self, factor):
+        if self._dense is not None:
+            self._dense._scale(factor)
+            self._dense.version += 1
+        else:
+            self._values = self._values * self._dtype.type(factor)
+
+    def copy(self):
+        coords, values = self.entries()
+        pv = self.__class__(self.bases, (coords.copy(), values.copy()),
+                            force=self._force, density_max=self.density_max,
+                            atol=self.atol)
+        pv.norm = self.norm
+        return pv
+
+    def memory_footprint(self):
+        if self._dense is not None:
+            return self._dense.memory_footprint()
+        return MemoryFootprint(self._coords.nbytes + self._values.nbytes, 0)
+
+    def _checkpoint(self):
+        return list(self.entries()), {'force': self._force,
+                                      'density_max': self.density_max,
+                                      'atol': self.atol}
+
+    @classmethod
+    def _from_checkpoint(cls, bases, arrays, attrs):
+        return cls(bases, tuple(arrays), **attrs)
+
+    @memoized
+    def _element_weights(self, qubit):
+        self._validate_qubit(qubit, 'qubit')
+        coords, values = self.entries()
+        values = values.astype(np.float64)
+        return np.bincount(coords[qubit], weights=values * values,
+                           minlength=self._shape[qubit])
+
+    def _select_elements(self, qubit, indices):
+        if self._dense is not None:
+            self._dense._select_elements(qubit, indices)
+            self.version += 1
+            return
+        mapping = np.full(self._shape[qubit], -1, dtype=np.intp)
+        mapping[indices] = np.arange(len(indices))
+        new = mapping[self._coords[qubit]]
+        selected = new >= 0
+        coords = self._coords[:, selected]
+        coords[qubit] = new[selected]
+        shape = list(self._shape)
+        shape[qubit] = len(indices)
+        self._set_entries(coords, self._values[selected], shape)
+
+    def _add_qubit(self, basis, pv):
+        if self._dense is not None:
+            self._dense._add_qubit(basis, pv)
+            self.version += 1
+            return
+        self._set_entries(*_append_axis(self._coords, self._values, pv),
+                          self._shape + (len(pv),))
+
+    def _reset(self, qubit, basis, pv):
+        if self._dense is not None:
+            self._dense._reset(qubit, basis, pv)
+            self.version += 1
+            return
+        coords, values = _append_axis(*self._trace_out(qubit), pv)
+        # The new axis is moved to the place of the qubit
+        order = list(range(qubit)) + [self.n_qubits - 1] + \
+            list(range(qubit, self.n_qubits - 1))
+        shape = list(self._shape)
+        shape[qubit] = len(pv)
+        self._set_entries(coords[order], values, shape)
+
+    def _remove_qubit(self, qubit):
+        if self._dense is not None:
+            self._dense._remove_qubit(qubit)
+            self.version += 1
+            return
+        self._set_entries(*self._trace_out(qubit),
+                          self._shape[:qubit] + self._shape[qubit + 1:])
+
+    def _trace_out(self, qubit):
+        return self._contract(
+            [trace_row(b) if i == qubit else np.identity(b.dim_pauli)
+             for i, b in enumerate(self.bases)], [qubit])
+
+    def _contract(self, matrices, drop):
+        """Contract every qubit axis of the state with a matrix (qubit `i`
+        with `matrices[i]` of shape `(r_i, dim_pauli_i)`) and sum up the
+        elements with the same coordinates. Axes listed in `drop` must be
+        contracted with single-row matrices and are removed from the
+        result. The result is accumulated in double precision.
+
+        Returns
+        -------
+        coords, values
+            Nonzero elements of the result in the same form, as returned by
+            :func:`entries`, sorted by coordinates.
+        """
+        coords, values = self.entries()
+        values = values.astype(np.float64)
+        coords = list(coords)
+        for axis, matrix in enumerate(matrices):
+            # Every element is split into the nonzero elements of the
+            # matrix column, that corresponds to its coordinate. Matrices
+            # used here are mostly selections, so usually there is at most
+            # one element per column.
+            rows, cols = np.nonzero(matrix.T)[::-1]
+            counts = np.bincount(cols, minlength=matrix.shape[1])
+            starts = np.cumsum(counts) - counts
+            repeats = counts[coords[axis]]
+            index = np.repeat(np.arange(len(values)), repeats)
+            entry = np.repeat(starts[coords[axis]] - np.cumsum(repeats) +
+                              repeats, repeats) + np.arange(len(index))
+            coords = [c[index] for c in coords]
+            coords[axis] = rows[entry]
+            values = values[index] * matrix[rows[entry], cols[entry]]
+        kept = [i for i in range(len(matrices)) if i not in drop]
+        shape = [matrices[i].shape[0] for i in kept]
+        keys, inverse = _unique(
+            np.array([coords[i] for i in kept], dtype=np.intp).reshape(
+                len(kept), len(values)), shape)
+        summed = np.zeros(keys.shape[1])
+        np.add.at(summed, inverse, values)
+        nonzero = summed != 0
+        return keys[:, nonzero], summed[nonzero]
+
+    def _set_entries(self, coords, values, shape):
+        self._coords = coords
+        self._shape = tuple(shape)
+        self._values = np.asarray(values, dtype=self._dtype)
+        self.version += 1
+        self._check_density()
+
+    def _check_density(self):
+        """Switch to dense storage, if the state is dense enough."""
+        if self._dense is not None or self.density <= self.density_max:
+            return
+        if not self._force and PauliVectorNumpy._size_max * 8 < \
+                pytools.product(self._shape) * self._dtype.itemsize:
+            return
+        self._dense = PauliVectorNumpy(self.bases, self.to_pv(), force=True,
+                                       dtype=self._dtype)
+        # Changes of bases (projections, resets, etc.) must be visible to
+        # the dense Pauli vector
+        self._dense.bases = self.bases
+        self._coords = None
+        self._values = None
+
+
+def _ravel(coords, shape):
+    """Flat indices of coordinates of shape `(len(shape), n)` in a small
+    tensor."""
+    if len(shape) == 0:
+        return np.zeros(coords.shape[1], dtype=np.intp)
+    return np.ravel_multi_index(tuple(coords), tuple(shape))
+
+
+def _unique(coords, shape):
+    """Unique columns of coordinates of shape `(len(shape), n)` in a tensor
+    of a given shape, sorted lexicographically, and indices of the unique
+    columns for every column of `coords`."""
+    if pytools.product(shape) < 2**62:
+        keys, inverse = np.unique(_ravel(coords, shape),
+                                  return_inverse=True)
+        if len(shape) == 0:
+            keys = np.zeros((0, len(keys)), dtype=np.intp)
+        else:
+            keys = np.array(np.unravel_index(keys, tuple(shape)),
+                            dtype=np.intp).reshape(len(shape), -1)
+    else:
+        # Flat indices would overflow
+        keys, inverse = np.unique(coords, axis=1, return_inverse=True)
+    return keys, inverse.ravel()
+
+
+def _append_axis(coords, values, pv):
+    """Outer product of a sparse tensor with a dense vector `pv`, that
+    becomes its last axis."""
+    (nonzero,) = np.nonzero(pv)
+    coords = np.concatenate([
+        np.repeat(coords, len(nonzero), axis=1),
+        np.tile(nonzero, len(values)).reshape(1, -1)], axis=0)
+    values = (values[:, None] * pv[nonzero]).ravel()
+    return coords, values
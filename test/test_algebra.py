@@ -0,0 +1,173 @@
+# This file is part of quantumsim. (https://gitlab.com/quantumsim/quantumsim)
+# (c) 2018 Quantumsim Authors
+# Distributed under the GNU GPLv3. See LICENSE.txt or
+# https://www.gnu.org/licenses/gpl.txt
+
+import pytest
+import numpy as np
+
+from pytest import approx
+from quantumsim import bases
+from quantumsim.algebra import algebra, dm_to_pv, pv_to_dm
+from quantumsim.algebra.tools import random_hermitian_matrix
+
+
+def reference_pv(dm, bs):
+    # Kronecker product of the bases
+    vectors = bs[0].vectors
+    for b in bs[1:]:
+        dim = vectors.shape[1] * b.dim_hilbert
+        vectors = np.einsum('pij,qkl->pqikjl', vectors, b.vectors).reshape(
+            vectors.shape[0] * b.dim_pauli, dim, dim)
+    pv = np.einsum('pji,ij->p', vectors, dm).real
+    return pv.reshape(tuple(b.dim_pauli for b in bs))
+
+
+class TestConversion:
+    @pytest.mark.parametrize('bs', [
+        [bases.general(2)] * 3,
+        [bases.gell_mann(3), bases.general(2)],
+        [bases.general(2), bases.general(3), bases.gell_mann(2)],
+    ])
+    def test_round_trip(self, bs):
+        dim = int(np.prod([b.dim_hilbert for b in bs]))
+        dm = random_hermitian_matrix(dim, seed=7)
+        pv = dm_to_pv(dm, bs)
+        assert pv.shape == tuple(b.dim_pauli for b in bs)
+        assert pv == approx(reference_pv(dm, bs))
+        dims = tuple(b.dim_hilbert for b in bs)
+        assert dm_to_pv(dm.reshape(dims * 2), bs) == approx(pv)
+        assert pv_to_dm(pv, bs) == approx(dm)
+
+    def test_subbases(self):
+        b = bases.general(2)
+        bs = [b.subbasis([0, 1]), b]
+        dm = np.diag([0.5, 0.2, 0.2, 0.1]).astype(complex)
+        dm[0, 1] = dm[1, 0] = 0.1
+        pv = dm_to_pv(dm, bs)
+        assert pv.shape == (2, 4)
+        assert pv_to_dm(pv, bs) == approx(dm)
+
+    def test_batch(self):
+        bs = [bases.general(2), bases.gell_mann(3)]
+        dms = np.stack([random_hermitian_matrix(6, seed=i)
+                        for i in range(6)]).reshape(2, 3, 6, 6)
+        pvs = dm_to_pv(dms, bs)
+        assert pvs.shape == (2, 3, 4, 9)
+        for i, j in np.ndindex(2, 3):
+            assert pvs[i, j] == approx(dm_to_pv(dms[i, j], bs))
+        assert dm_to_pv(dms.reshape(2, 3, 2, 3, 2, 3), bs) == approx(pvs)
+        assert pv_to_dm(pvs, bs) == approx(dms)
+
+    @pytest.mark.parametrize('batch_shape', [(), (2,)])
+    def test_streaming(self, monkeypatch, tmpdir, batch_shape):
+        bs = [bases.general(2), bases.general(3), bases.gell_mann(2)]
+        dms = np.stack([random_hermitian_matrix(12, seed=i)
+                        for i in range(2)]).reshape((-1, 12, 12))
+        dms = dms[:1].reshape(12, 12) if batch_shape == () else dms
+        expected = dm_to_pv(dms, bs)
+        dm_file = np.memmap(str(tmpdir.join('dm')), dtype=complex,
+                            mode='w+', shape=dms.shape)
+        dm_file[:] = dms
+        pv_file = np.memmap(str(tmpdir.join('pv')), dtype=np.float64,
+                            mode='w+', shape=expected.shape)
+        # Blocks span the last two qubits only
+        monkeypatch.setattr(algebra, '_BLOCK_SIZE', 36)
+        assert algebra._streamed_qubits([2, 3, 2]) == 1
+        assert dm_to_pv(dm_file, bs, out=pv_file) is pv_file
+        assert np.asarray(pv_file) == approx(expected)
+        dm_file[:] = 0
+        assert pv_to_dm(pv_file, bs, out=dm_file) is dm_file
+        assert np.asarray(dm_file) == approx(dms)
+        # Blocks of single elements
+        monkeypatch.setattr(algebra, '_BLOCK_SIZE', 1)
+        assert dm_to_pv(dms, bs) == approx(expected)
+        assert pv_to_dm(expected, bs) == approx(dms)
+
+    def test_pauli_vectors(self, tmpdir):
+        from quantumsim.pauli_vectors import PauliVectorNumpy, \
+            PauliVectorBatch
+        dm = random_hermitian_matrix(8, seed=3)
+        dm_file = np.memmap(str(tmpdir.join('dm')), dtype=complex,
+                            mode='w+', shape=dm.shape)
+        dm_file[:] = dm
+        pv = PauliVectorNumpy.from_dm(dm_file, bases.general(2))
+        assert pv.n_qubits == 3
+        assert pv.to_dm() == approx(dm)
+        dms = np.stack([dm, np.identity(8) / 8])
+        batch = PauliVectorBatch.from_dm(dms, bases.general(2))
+        assert batch.to_pv()[0] == approx(pv.to_pv())
+        assert batch.to_dm() == approx(dms)
+
+    def test_errors(self):
+        bs = [bases.general(2)] * 2
+        with pytest.raises(ValueError):
+            dm_to_pv(np.zeros((3, 3)), bs)
+        with pytest.raises(ValueError):
+            dm_to_pv(np.zeros((4, 4)), bs, out=np.zeros(16))
+        with pytest.raises(ValueError):
+            pv_to_dm(np.zeros((4, 2)), bs)
+        with pytest.raises(ValueError):
+            pv_to_dm(np.zeros((4, 4)), bs, out=np.zeros((16, 16)))
+
+
+class TestPTMStructure:
+    def test_library_gates(self):
+        from quantumsim.models import qubits as lib, transmons
+        ixyz = (bases.library.twolevel_ixyz,)
+        general = (bases.general(2),)
+        for op in (lib.phase_damping(0.1), lib.phase_flipping(0.2),
+                   lib.depolarization(0.1)):
+            ptm = op.ptm(ixyz)
+            structure = algebra.ptm_structure(ptm)
+            assert structure.kind == algebra.DIAGONAL
+            assert structure.diagonal == approx(np.diag(ptm))
+
+        # Other sparsity patterns are not used
+        assert algebra.ptm_structure(
+            lib.rotate_z(0.3).ptm(general)).kind == algebra.DENSE
+        assert algebra.ptm_structure(transmons.amp_damping(
+            0.1, 0.05, 0.2, 0.3).ptm((bases.general(3),))).kind == \
+            algebra.DENSE
+        assert algebra.PTMStructure(algebra.DENSE)._fields == \
+            ('kind', 'diagonal', 'permutation')
+
+        # Two-qubit diagonal PTM
+        diag = np.random.RandomState(1).random_sample(16)
+        structure = algebra.ptm_structure(np.diag(diag).reshape(4, 4, 4, 4))
+        assert structure.kind == algebra.DIAGONAL
+        assert structure.diagonal.shape == (4, 4)
+
+    def test_clifford_gates(self):
+        from quantumsim.models import qubits as lib
+        ixyz = bases.library.twolevel_ixyz
+        for op, n_qubits in ((lib.hadamard(), 1), (lib.cnot(), 2),
+                             (lib.cphase(np.pi), 2),
+                             (lib.rotate_y(np.pi / 2), 1)):
+            ptm = op.ptm((ixyz,) * n_qubits)
+            structure = algebra.ptm_structure(ptm)
+            assert structure.kind == algebra.PERMUTATION
+            sources, signs = structure.permutation
+            assert sources.shape == (4,) * n_qubits
+            matrix = np.zeros((4 ** n_qubits,) * 2)
+            matrix[np.arange(4 ** n_qubits), sources.ravel()] = signs.ravel()
+            assert matrix == approx(ptm.reshape(matrix.shape))
+        # Pauli gates are diagonal
+        structure = algebra.ptm_structure(lib.rotate_x(np.pi).ptm((ixyz,)))
+        assert structure.kind == algebra.DIAGONAL
+        assert structure.diagonal == approx([1, 1, -1, -1])
+        # Clifford gates are not signed permutations in the general basis
+        assert algebra.ptm_structure(lib.cnot().ptm(
+            (bases.general(2),) * 2)).kind != algebra.PERMUTATION
+
+    def test_dense(self):
+        ptm = np.diag(np.full(9, 0.5)) + np.diag(np.full(8, 0.25), 1)
+        assert algebra.ptm_structure(ptm).kind == algebra.DENSE
+        ptm = np.random.RandomState(2).random_sample((4, 4))
+        assert algebra.ptm_structure(ptm).kind == algebra.DENSE
+        assert algebra.ptm_structure(
+            np.random.RandomState(3).random_sample((4, 4, 4, 4))).kind == \
+            algebra.DENSE
+        # Rounding errors are not structure
+        ptm = np.identity(4) + 1e-18 * np.ones((4, 4))
+        assert algebra.ptm_structure(ptm).kind == algebra.DIAGONAL
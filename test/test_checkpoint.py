@@ -0,0 +1,157 @@
+# This file is part of quantumsim. (https://gitlab.com/quantumsim/quantumsim)
+# (c) 2018 Quantumsim Authors
+# Distributed under the GNU GPLv3. See LICENSE.txt or
+# https://www.gnu.org/licenses/gpl.txt
+
+import os
+
+import pytest
+import numpy as np
+
+from pytest import approx
+from quantumsim import bases
+from quantumsim.models import qubits as lib
+from quantumsim.pauli_vectors import PauliVectorNumpy, PauliVectorBatch, \
+    PauliVectorMemmap, PauliVectorSparse, PauliVectorMPS, load
+from quantumsim.pauli_vectors.checkpoint import basis_descriptor, \
+    _basis_from_descriptor
+
+
+def prepare(pv):
+    lib.rotate_y(1.1)(pv, 0)
+    lib.cnot()(pv, 0, 1)
+    lib.amp_damping(0.2)(pv, 1)
+    lib.rotate_x(0.7)(pv, 2)
+    return pv
+
+
+class TestBasisDescriptors:
+    def test_library_bases(self):
+        for basis in (bases.general(2), bases.gell_mann(3),
+                      bases.general(3).subbasis([0, 4, 5])):
+            descriptor = basis_descriptor(basis)
+            assert 'vectors_real' not in descriptor
+            assert _basis_from_descriptor(descriptor) == basis
+        assert basis_descriptor(bases.general(2)) == {
+            'library': 'general', 'dim_hilbert': 2}
+        descriptor = basis_descriptor(
+            bases.general(2).subbasis([1, 3]).subbasis([1]))
+        assert descriptor == {'library': 'general', 'dim_hilbert': 2,
+                              'indices': [3]}
+
+    def test_custom_basis(self):
+        vectors = np.array([[[1, 1], [1, 1]], [[1, -1], [-1, 1]]]) / 2
+        basis = bases.PauliBasis(vectors.astype(complex), ['a', 'b'])
+        descriptor = basis_descriptor(basis)
+        restored = _basis_from_descriptor(descriptor)
+        assert restored == basis
+        assert list(restored.labels) == ['a', 'b']
+
+    def test_twolevel_bases(self):
+        ixyz = bases.library.twolevel_ixyz
+        for basis in (ixyz, ixyz.subbasis([0, 3]),
+                      bases.library.twolevel_0xy1):
+            descriptor = basis_descriptor(basis)
+            assert 'vectors_real' not in descriptor
+            restored = _basis_from_descriptor(descriptor)
+            assert restored == basis
+            assert list(restored.labels) == list(basis.labels)
+        assert basis_descriptor(ixyz) == {
+            'library': 'twolevel_ixyz', 'dim_hilbert': 2}
+        assert _basis_from_descriptor(
+            basis_descriptor(ixyz.subbasis([0, 3]))).superbasis is ixyz
+
+
+class TestCheckpoint:
+    @pytest.mark.parametrize('mmap', [True, False])
+    @pytest.mark.parametrize('dtype', [np.float64, np.float32])
+    def test_numpy(self, tmpdir, mmap, dtype):
+        path = str(tmpdir.join('pv.qsim'))
+        pv = prepare(PauliVectorNumpy([bases.general(2)] * 3, dtype=dtype))
+        pv.project(2, 1)
+        pv.save(path)
+        loaded = load(path, mmap=mmap)
+        assert isinstance(loaded, PauliVectorNumpy)
+        assert loaded.dtype == dtype
+        assert loaded.bases == pv.bases
+        assert loaded.bases[2].superbasis is bases.general(2)
+        assert loaded.norm == approx(pv.norm)
+        assert loaded.to_pv() == approx(pv.to_pv())
+        assert isinstance(loaded.to_pv(), np.memmap) == mmap
+        # The file is not modified by further computation
+        loaded.renormalize()
+        lib.rotate_x(0.3)(loaded, 0)
+        assert load(path).to_pv() == approx(pv.to_pv())
+
+    def test_twolevel_ixyz(self, tmpdir):
+        path = str(tmpdir.join('pv.qsim'))
+        ixyz = bases.library.twolevel_ixyz
+        pv = prepare(PauliVectorNumpy([ixyz] * 3))
+        pv.save(path)
+        loaded = load(path)
+        assert all(b.superbasis is ixyz for b in loaded.bases)
+        assert [list(b.labels) for b in loaded.bases] == \
+            [list(b.labels) for b in pv.bases]
+        assert loaded.to_pv() == approx(pv.to_pv())
+        assert loaded.to_dm() == approx(pv.to_dm())
+
+    def test_batch(self, tmpdir):
+        path = str(tmpdir.join('pv.qsim'))
+        batch = PauliVectorBatch([bases.general(2)] * 2, batch_size=3)
+        lib.rotate_y(np.array([0., 1., 2.]))(batch, 0)
+        batch.project(0, 0)
+        batch.save(path)
+        loaded = load(path)
+        assert isinstance(loaded, PauliVectorBatch)
+        assert loaded.to_pv() == approx(batch.to_pv())
+        assert loaded.norm == approx(batch.norm)
+
+    @pytest.mark.parametrize('axis_order', [None, (2, 0, 1)])
+    def test_memmap(self, tmpdir, axis_order):
+        path = str(tmpdir.join('pv.qsim'))
+        pv = prepare(PauliVectorMemmap(
+            [bases.general(2)] * 3, directory=str(tmpdir), chunk_size=16,
+            axis_order=axis_order))
+        pv.save(path)
+        loaded = load(path)
+        assert isinstance(loaded, PauliVectorMemmap)
+        assert loaded.axis_order == pv.axis_order
+        assert loaded.to_pv() == approx(pv.to_pv())
+        # Data is mapped from the checkpoint without copying
+        assert loaded._data_buffer is None
+        lib.hadamard()(loaded, 1)
+        lib.hadamard()(pv, 1)
+        assert loaded.to_pv() == approx(pv.to_pv())
+
+    def test_sparse_and_mps(self, tmpdir):
+        path = str(tmpdir.join('pv.qsim'))
+        for cls in (PauliVectorSparse, PauliVectorMPS):
+            pv = prepare(cls([bases.general(2)] * 3))
+            pv.save(path)
+            loaded = load(path)
+            assert isinstance(loaded, cls)
+            assert loaded.to_pv() == approx(pv.to_pv())
+            lib.cnot()(loaded, 1, 2)
+            lib.cnot()(pv, 1, 2)
+            assert loaded.to_pv() == approx(pv.to_pv())
+
+    def test_background(self, tmpdir):
+        pv = prepare(PauliVectorNumpy([bases.general(2)] * 3))
+        expected = pv.to_pv().copy()
+        futures = [pv.save(str(tmpdir.join('pv{}.qsim'.format(i))),
+                           background=True) for i in range(3)]
+        # Computation continues, while checkpoints are written
+        lib.hadamard()(pv, 0)
+        for future in futures:
+            future.result()
+        for i in range(3):
+            assert load(str(tmpdir.join('pv{}.qsim'.format(i)))).to_pv() == \
+                approx(expected)
+        assert not any(f.endswith('.tmp') for f in os.listdir(str(tmpdir)))
+
+    def test_invalid_file(self, tmpdir):
+        path = str(tmpdir.join('garbage'))
+        with open(path, 'wb') as f:
+            f.write(b'not a checkpoint')
+        with pytest.raises(ValueError):
+            load(path)
@@ -0,0 +1,181 @@
+# This file is part of quantumsim. (https://gitlab.com/quantumsim/quantumsim)
+# (c) 2018 Quantumsim Authors
+# Distributed under the GNU GPLv3. See LICENSE.txt or
+# https://www.gnu.org/licenses/gpl.txt
+
+import pytest
+import numpy as np
+
+from pytest import approx
+from quantumsim import bases
+from quantumsim.algebra.tools import random_hermitian_matrix
+from quantumsim.pauli_vectors import PauliVectorNumpy, PauliVectorBatch
+from quantumsim.models import qubits as lib
+
+
+class TestPauliVectorBatch:
+    def test_create(self):
+        b = [bases.general(2)] * 3
+        batch = PauliVectorBatch(b, batch_size=5)
+        assert batch.batch_size == len(batch) == 5
+        assert batch.to_pv().shape == (5, 4, 4, 4)
+        assert batch.trace() == approx(np.ones(5))
+        assert batch.diagonal()[:, 0] == approx(np.ones(5))
+
+        with pytest.raises(ValueError):
+            PauliVectorBatch(b)
+        with pytest.raises(ValueError):
+            PauliVectorBatch(b, np.zeros((5, 4, 4)))
+        with pytest.raises(ValueError):
+            PauliVectorBatch(b, np.zeros((5, 4, 4, 4)), batch_size=4)
+        with pytest.raises(ValueError):
+            PauliVectorBatch(b, np.zeros((5, 4, 4, 4), dtype=complex))
+        with pytest.raises(ValueError):
+            PauliVectorBatch([bases.general(2)] * 8, batch_size=100)
+
+    def test_create_without_ground_state_element(self):
+        b = [bases.gell_mann(2), bases.general(2)]
+        batch = PauliVectorBatch(b, batch_size=3)
+        ground_state = np.zeros((4, 4))
+        ground_state[0, 0] = 1
+        assert batch.trace() == approx(np.ones(3))
+        assert batch.to_dm() == approx(np.array([ground_state] * 3))
+
+    def test_circuit_matches_individual_states(self):
+        b = [bases.general(2)] * 3
+        dms = [random_hermitian_matrix(8, seed) for seed in range(7)]
+        batch = PauliVectorBatch.from_dm(np.array(dms), b)
+        states = [PauliVectorNumpy.from_dm(dm, b) for dm in dms]
+
+        circuit = lib.rotate_y(0.3).at(0), lib.cphase(1.1).at(2, 0), \
+            lib.amp_damping(0.2).at(1), lib.cnot().at(1, 2)
+        for op, qubits in circuit:
+            op(batch, *qubits)
+            for state in states:
+                op(state, *qubits)
+
+        for i, state in enumerate(states):
+            assert batch[i].to_pv() == approx(state.to_pv())
+            assert batch.diagonal()[i] == approx(state.diagonal())
+            assert batch.trace()[i] == approx(state.trace())
+            for q in range(3):
+                assert batch.meas_prob(q)[i] == approx(state.meas_prob(q))
+            assert batch.to_dm()[i] == approx(state.to_dm())
+        traced = batch.partial_trace(0, 2)
+        for i, state in enumerate(states):
+            assert traced[i].to_pv() == \
+                approx(state.partial_trace(0, 2).to_pv())
+
+    def test_single_precision(self):
+        b = [bases.general(2)] * 2
+        batch = PauliVectorBatch(b, batch_size=3, dtype=np.float32)
+        batch64 = PauliVectorBatch(b, batch_size=3)
+        for pv in (batch, batch64):
+            lib.rotate_x(np.array([0.1, 0.2, 0.3])).astype(pv.dtype)(pv, 1)
+            lib.cnot()(pv, 1, 0)
+        assert batch.to_pv().dtype == np.float32
+        assert batch[0].dtype == np.float32
+        assert batch.trace().dtype == np.float64
+        np.testing.assert_allclose(batch.to_pv(), batch64.to_pv(), atol=1e-6)
+
+    def test_renormalize(self):
+        b = [bases.general(2)] * 2
+        pv = np.zeros((3, 4, 4))
+        pv[:, 0, 0] = [0.5, 2., 0.]
+        batch = PauliVectorBatch(b, pv)
+        with pytest.warns(UserWarning):
+            batch.renormalize()
+        assert batch.trace() == approx([1., 1., 0.])
+
+    def test_from_pauli_vectors(self):
+        b = [bases.general(2)] * 2
+        states = [PauliVectorNumpy.from_dm(random_hermitian_matrix(4, seed),
+                                           b) for seed in range(3)]
+        batch = PauliVectorBatch.from_pauli_vectors(states)
+        assert batch.batch_size == 3
+        copy = batch.copy()
+        lib.hadamard()(copy, 1)
+        for i, state in enumerate(states):
+            assert batch[i].to_pv() == approx(state.to_pv())
+        with pytest.raises(ValueError):
+            PauliVectorBatch.from_pauli_vectors(
+                states + [PauliVectorNumpy([bases.general(3)] * 2)])
+
+
+class TestBatchedOperations:
+    @pytest.mark.parametrize('constructor,params', [
+        (lib.rotate_x, (np.linspace(0, 2 * np.pi, 5),)),
+        (lib.rotate_euler, (np.linspace(0, 1, 5), np.linspace(1, 2, 5),
+                            np.linspace(-1, 0, 5))),
+        (lib.amp_damping, (np.linspace(0, 1, 5),)),
+        (lib.depolarization, (np.linspace(0, 1, 5),)),
+        (lib.cphase, (np.linspace(0, np.pi, 5),)),
+    ])
+    def test_qubit_constructors(self, constructor, params):
+        op_batch = constructor(*params)
+        assert op_batch.batch_size == 5
+        for i in range(5):
+            op = constructor(*(p[i] for p in params))
+            assert op_batch[i].shape == op.shape
+            assert op_batch[i].ptm(op.bases_in) == \
+                approx(op.ptm(op.bases_in))
+
+    def test_transmon_constructors(self):
+        from quantumsim.models import transmons as lib3
+        t1 = np.array([10., 20., 30., np.inf])
+        t2 = np.array([15., 30., 60., np.inf])
+        ops = lib3.idle(2., t1, t2, 0.1)
+        for i in range(len(t1)):
+            op = lib3.idle(2., t1[i], t2[i], 0.1)
+            assert ops[i].ptm(op.bases_in) == approx(op.ptm(op.bases_in))
+        with pytest.raises(ValueError):
+            lib3.idle(2., t1, 3 * t1)
+
+        p = np.linspace(0, 0.1, 3)
+        ops = lib3.amp_damping(p, 0.01, p, 0.02)
+        for i in range(3):
+            op = lib3.amp_damping(p[i], 0.01, p[i], 0.02)
+            assert ops[i].ptm(op.bases_in) == approx(op.ptm(op.bases_in))
+
+    def test_apply_to_batch(self):
+        b = [bases.general(2)] * 2
+        angles = np.linspace(0, np.pi, 4)
+        batch = PauliVectorBatch(b, batch_size=4)
+        lib.rotate_y(angles)(batch, 1)
+        lib.cphase(angles).set_bases(bases_out=(
+            bases.general(2).computational_subbasis(),) * 2)(batch, 1, 0)
+        assert batch.bases[0] == bases.general(2).computational_subbasis()
+        for i, angle in enumerate(angles):
+            state = PauliVectorNumpy(b)
+            lib.rotate_y(angle)(state, 1)
+            lib.cphase(angle).set_bases(bases_out=(
+                bases.general(2).computational_subbasis(),) * 2)(state, 1, 0)
+            assert batch[i].to_pv() == approx(state.to_pv())
+
+        with pytest.raises(ValueError):
+            lib.rotate_y(angles[:3])(batch, 1)
+        with pytest.raises(ValueError):
+            lib.rotate_y(angles)(PauliVectorNumpy(b), 1)
+
+    def test_chains(self):
+        b = [bases.general(2)] * 2
+        angles = np.linspace(0, np.pi, 3)
+        circuit = lib.Operation.from_sequence(
+            lib.rotate_x(angles).at(0), lib.cnot().at(0, 1))
+        batch = PauliVectorBatch(b, batch_size=3)
+        circuit(batch, 0, 1)
+        for i, angle in enumerate(angles):
+            state = PauliVectorNumpy(b)
+            lib.rotate_x(angle)(state, 0)
+            lib.cnot()(state, 0, 1)
+            assert batch[i].to_pv() == approx(state.to_pv())
+
+        # Compiler does not support batched operations
+        damping = lib.amp_phase_damping(angles / 10, angles / 20)
+        for op in (circuit, damping):
+            with pytest.raises(ValueError, match='batched'):
+                op.compile(tuple(b[:op.num_qubits]))
+            with pytest.raises(ValueError, match='batched'):
+                op.ptm(tuple(b[:op.num_qubits]))
+        with pytest.raises(ValueError, match='batched'):
+            lib.rotate_x(angles).compile(tuple(b[:1]))
@@ -0,0 +1,150 @@
+# This file is part of quantumsim. (https://gitlab.com/quantumsim/quantumsim)
+# (c) 2018 Quantumsim Authors
+# Distributed under the GNU GPLv3. See LICENSE.txt or
+# https://www.gnu.org/licenses/gpl.txt
+
+import gc
+import os
+
+import pytest
+import numpy as np
+
+from pytest import approx
+from quantumsim import bases
+from quantumsim.pauli_vectors import PauliVectorNumpy, PauliVectorMemmap
+from quantumsim.pauli_vectors._contraction import blocks
+
+
+class TestBlocks:
+    @pytest.mark.parametrize('axes,max_size', [
+        ((0, 1, 2), 1000), ((0, 1, 2), 12), ((0, 2), 7), ((1,), 1),
+        ((2, 0), 40)])
+    def test_blocks_cover_tensor(self, axes, max_size):
+        shape = (3, 4, 5)
+        counts = np.zeros(shape, dtype=int)
+        for index in blocks(shape, axes, max_size):
+            block = counts[index]
+            assert block.ndim == 3
+            for axis in range(3):
+                if axis not in axes:
+                    assert block.shape[axis] == shape[axis]
+            if block.size > max_size:
+                assert all(block.shape[axis] == 1 for axis in axes)
+            block += 1
+        assert np.all(counts == 1)
+
+
+class TestPauliVectorMemmap:
+    @pytest.mark.parametrize('axis_order', [None, (2, 0, 3, 1)])
+    def test_matches_numpy(self, axis_order, tmpdir):
+        b = [bases.general(2), bases.general(3), bases.general(2),
+             bases.general(2)]
+        rng = np.random.RandomState(1234)
+        reference = PauliVectorNumpy(b, rng.random_sample((4, 9, 4, 4)))
+        pv = PauliVectorMemmap(b, reference.to_pv(), directory=str(tmpdir),
+                               chunk_size=20, axis_order=axis_order)
+        assert pv.to_pv() == approx(reference.to_pv())
+
+        for qubits in ((0,), (1,), (3, 0), (2, 1), (1, 3)):
+            shape = tuple(pv.dim_pauli[q] for q in qubits)
+            ptm = rng.random_sample(shape * 2)
+            reference.apply_ptm(ptm, *qubits)
+            pv.apply_ptm(ptm, *qubits)
+            assert pv.to_pv() == approx(reference.to_pv())
+
+        # PTM, that changes the dimensions of a qubit
+        ptm = rng.random_sample((2, 9))
+        reference.apply_ptm(ptm, 1)
+        pv.apply_ptm(ptm, 1)
+        assert pv.to_pv().shape == reference.to_pv().shape
+        assert pv.to_pv() == approx(reference.to_pv())
+        reference.bases[1] = pv.bases[1] = \
+            bases.general(3).computational_subbasis().subbasis([0, 1])
+
+        assert pv.diagonal() == approx(reference.diagonal())
+        assert pv.trace() == approx(reference.trace())
+        for q in range(4):
+            assert pv.meas_prob(q) == approx(reference.meas_prob(q))
+        for qubits in ((2,), (0, 3), (0, 1, 3)):
+            assert pv.partial_trace(*qubits).to_pv() == \
+                approx(reference.partial_trace(*qubits).to_pv())
+        pv.renormalize()
+        assert pv.trace() == approx(1)
+
+    def test_ground_state_and_circuit(self, tmpdir):
+        from quantumsim.models import qubits as lib
+        b = [bases.general(2)] * 3
+        pv = PauliVectorMemmap(b, directory=str(tmpdir), chunk_size=8)
+        reference = PauliVectorNumpy(b)
+        circuit = lib.rotate_x(0.4).at(0), lib.cphase(1.3).at(0, 2), \
+            lib.amp_damping(0.1).at(1), lib.cnot().at(2, 1)
+        for op, qubits in circuit:
+            op(pv, *qubits)
+            op(reference, *qubits)
+        assert pv.to_pv() == approx(reference.to_pv())
+        assert pv.to_dm() == approx(reference.to_dm())
+        assert pv.copy().to_pv() == approx(reference.to_pv())
+
+    def test_exported_data_is_not_overwritten(self, tmpdir):
+        b = [bases.general(2)] * 2
+        rng = np.random.RandomState(256)
+        pv = PauliVectorMemmap(b, rng.random_sample((4, 4)),
+                               directory=str(tmpdir), chunk_size=4)
+        ptm = rng.random_sample((4, 4))
+        for _ in range(3):
+            data = pv.to_pv()
+            data_copy = np.array(data)
+            for qubit in (0, 1, 0):
+                pv.apply_ptm(ptm, qubit)
+            pv.renormalize()
+            assert data == approx(data_copy)
+            assert pv.to_pv() != approx(data_copy)
+        # Files of exported data do not pile up
+        assert len(os.listdir(pv.directory)) <= 2
+
+    def test_external_memmap_is_not_written(self, tmpdir):
+        b = [bases.general(2)] * 2
+        filename = str(tmpdir.join('state.bin'))
+        data = np.memmap(filename, dtype=np.float64, mode='w+', shape=(4, 4))
+        data[0, 0] = 0.5
+        data[3, 3] = 0.5
+        data.flush()
+        pv = PauliVectorMemmap(b, data, directory=str(tmpdir))
+        assert np.shares_memory(pv.to_pv(), data)
+        pv.apply_ptm(np.identity(4)[::-1].copy(), 0)
+        assert data[0, 0] == 0.5
+        assert pv.to_pv()[3, 0] == 0.5
+
+    def test_copy_has_own_files(self, tmpdir):
+        b = [bases.general(2)] * 3
+        data = np.random.RandomState(512).random_sample((4, 4, 4))
+        pv = PauliVectorMemmap(b, data, directory=str(tmpdir), chunk_size=8,
+                               axis_order=(2, 0, 1))
+        copy = pv.copy()
+        assert copy._data.filename != pv._data.filename
+        assert copy.directory != pv.directory
+        ptm = np.identity(4)[::-1].copy()
+        for qubit in (0, 1, 2, 0):
+            pv.apply_ptm(ptm, qubit)
+        assert copy.to_pv() == approx(data)
+        assert copy.axis_order == pv.axis_order
+
+    def test_files_are_removed(self, tmpdir):
+        pv = PauliVectorMemmap([bases.general(2)] * 2, directory=str(tmpdir))
+        directory = pv.directory
+        assert os.path.isdir(directory)
+        del pv
+        gc.collect()
+        assert not os.path.exists(directory)
+
+    def test_errors(self, tmpdir):
+        b = [bases.general(2)] * 2
+        with pytest.raises(ValueError):
+            PauliVectorMemmap(b, np.zeros((4, 2)), directory=str(tmpdir))
+        with pytest.raises(ValueError):
+            PauliVectorMemmap(b, axis_order=(0, 0), directory=str(tmpdir))
+        pv = PauliVectorMemmap(b, directory=str(tmpdir))
+        with pytest.raises(ValueError):
+            pv.apply_ptm(np.identity(4), 2)
+        with pytest.raises(ValueError):
+            pv.apply_ptm(np.identity(9).reshape((3, 3, 3, 3)), 0)
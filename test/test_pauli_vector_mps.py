@@ -0,0 +1,139 @@
+# This file is part of quantumsim. (https://gitlab.com/quantumsim/quantumsim)
+# (c) 2018 Quantumsim Authors
+# Distributed under the GNU GPLv3. See LICENSE.txt or
+# https://www.gnu.org/licenses/gpl.txt
+
+import pytest
+import numpy as np
+
+from pytest import approx
+from quantumsim import bases
+from quantumsim.models import qubits as lib
+from quantumsim.pauli_vectors import PauliVectorNumpy, PauliVectorMPS
+
+
+class TestPauliVectorMPS:
+    def test_ground_state(self):
+        b = [bases.general(2), bases.gell_mann(2), bases.general(2)]
+        pv = PauliVectorMPS(b)
+        dm = np.zeros((8, 8))
+        dm[0, 0] = 1
+        assert pv.to_dm() == approx(dm)
+        assert pv.bond_dims == (1, 1)
+
+    @pytest.mark.parametrize('dtype', [np.float64, np.float32])
+    def test_matches_numpy(self, dtype):
+        b = [bases.general(2), bases.general(3), bases.general(2),
+             bases.general(2), bases.general(2)]
+        rng = np.random.RandomState(1234)
+        data = rng.random_sample((4, 9, 4, 4, 4))
+        reference = PauliVectorNumpy(b, data)
+        pv = PauliVectorMPS(b, data, dtype=dtype)
+        assert pv.to_pv() == approx(reference.to_pv(), rel=1e-4, abs=1e-6)
+
+        for qubits in ((0,), (1,), (3, 4), (2, 1), (0, 3), (4, 1)):
+            shape = tuple(pv.dim_pauli[q] for q in qubits)
+            ptm = rng.random_sample(shape * 2) / np.sqrt(np.prod(shape))
+            reference.apply_ptm(ptm, *qubits)
+            pv.apply_ptm(ptm, *qubits)
+            assert pv.to_pv() == approx(reference.to_pv(), rel=1e-4,
+                                        abs=1e-6)
+        ptm = rng.random_sample((2, 9))
+        reference.apply_ptm(ptm, 1)
+        pv.apply_ptm(ptm, 1)
+        assert pv.to_pv().shape == reference.to_pv().shape
+        pv.bases[1] = reference.bases[1] = b[1].subbasis([0, 4])
+        # Singular values, that are zero up to rounding errors, are dropped
+        assert pv.truncation_error < 1e-4 * pv.purity()
+
+        def check(actual, expected):
+            assert actual == approx(expected, rel=1e-4, abs=1e-6)
+
+        check(pv.to_pv(), reference.to_pv())
+        check(pv.trace(), reference.trace())
+        check(pv.diagonal(), reference.diagonal())
+        check(pv.purity(), reference.purity())
+        for q in range(5):
+            check(pv.meas_prob(q), reference.meas_prob(q))
+        for actual, expected in zip(pv.marginals(), reference.marginals()):
+            check(actual, expected)
+        check(pv.joint_meas_prob(3, 0), reference.joint_meas_prob(3, 0))
+        check(pv.partial_trace(2, 0).to_pv(),
+              reference.partial_trace(2, 0).to_pv())
+        bitstrings = ['00000', '10011', '01101', '11111']
+        check(pv.bitstring_probs(bitstrings),
+              reference.bitstring_probs(bitstrings))
+        with pytest.raises(ValueError):
+            pv.apply_ptm(np.identity(64).reshape((4,) * 6), 0, 2, 3)
+
+    def test_many_qubits(self):
+        n = 32
+        pv = PauliVectorMPS([bases.general(2)] * n)
+        lib.hadamard()(pv, 0)
+        for q in range(n - 1):
+            lib.cnot()(pv, q, q + 1)
+        # Pure state has bond dimension 2, its density matrix has 4
+        assert max(pv.bond_dims) == 4
+        for q in range(n):
+            lib.amp_damping(0.1)(pv, q)
+        assert pv.trace() == approx(1)
+        assert pv.bitstring_probs(['0' * n, '1' * n]) == approx(
+            [0.5 + 0.5 * 0.1 ** n, 0.5 * 0.9 ** n])
+        assert pv.meas_prob(n - 1) == approx([0.55, 0.45])
+        assert pv.marginals()[5] == approx([0.55, 0.45])
+        assert pv.joint_meas_prob(0, n - 1) == approx(np.array(
+            [[0.5 + 0.5 * 0.01, 0.5 * 0.9 * 0.1],
+             [0.5 * 0.9 * 0.1, 0.5 * 0.81]]))
+        assert pv.truncation_error == approx(0, abs=1e-12)
+
+    def test_truncation(self):
+        n = 6
+        b = [bases.general(2)] * n
+        rng = np.random.RandomState(42)
+        reference = PauliVectorNumpy(b)
+        pv = PauliVectorMPS(b, max_bond=4)
+        for _ in range(3):
+            for q in range(n):
+                angle = rng.random_sample()
+                lib.rotate_y(angle)(pv, q)
+                lib.rotate_y(angle)(reference, q)
+            for q in range(n - 1):
+                lib.cnot()(pv, q, q + 1)
+                lib.cnot()(reference, q, q + 1)
+        assert max(pv.bond_dims) <= 4
+        assert pv.truncation_error > 0
+        # Every truncation is optimal, so the error is bounded by the sum of
+        # the parts discarded
+        error = np.sum((pv.to_pv() - reference.to_pv()) ** 2)
+        assert error <= pv.truncation_error * (1 + 1e-6)
+
+    def test_tolerance(self):
+        b = [bases.general(2)] * 4
+        pv = PauliVectorMPS(b, tolerance=0.75)
+        lib.hadamard()(pv, 0)
+        lib.cnot()(pv, 0, 1)
+        # Bell state has four equal singular values
+        assert pv.bond_dims == (2, 1, 1)
+        assert pv.truncation_error == approx(0.5)
+
+    def test_projection_and_allocation(self):
+        b = bases.general(2)
+        pv = PauliVectorMPS([b] * 3)
+        lib.hadamard()(pv, 0)
+        lib.cnot()(pv, 0, 2)
+        assert pv.project(2, 1) == approx(0.5)
+        assert pv.bitstring_probs(['101', '001']) == approx([1, 0])
+        assert pv.add_qubit(b, 1) == 3
+        pv.reset(0)
+        pv.remove_qubit(1)
+        assert pv.n_qubits == 3
+        assert pv.bitstring_probs(['011']) == approx([1])
+        pv.reset(2, b.hilbert_to_pauli_vector(np.identity(2) / 2).real, b)
+        assert pv.joint_meas_prob(1, 2) == approx(np.array([[0, 0],
+                                                            [0.5, 0.5]]))
+        copy = pv.copy()
+        lib.rotate_x()(copy, 1)
+        assert pv.meas_prob(1) == approx([0, 1])
+        assert copy.meas_prob(1) == approx([1, 0])
+        assert pv.truncate_bases() == approx(0)
+        assert pv.dim_pauli == (1, 1, 2)
@@ -0,0 +1,172 @@
+# This file is part of quantumsim. (https://gitlab.com/quantumsim/quantumsim)
+# (c) 2018 Quantumsim Authors
+# Distributed under the GNU GPLv3. See LICENSE.txt or
+# https://www.gnu.org/licenses/gpl.txt
+
+import multiprocessing
+import pickle
+from multiprocessing import shared_memory
+
+import pytest
+import numpy as np
+
+from pytest import approx
+from quantumsim import bases
+from quantumsim.models import qubits as lib
+from quantumsim.pauli_vectors import PauliVectorNumpy, PauliVectorShared, \
+    SharedHandle
+
+
+def prepare(pv):
+    lib.rotate_y(1.1)(pv, 0)
+    lib.cnot()(pv, 0, 1)
+    lib.amp_damping(0.2)(pv, 1)
+    lib.rotate_x(0.7)(pv, 2)
+    return pv
+
+
+def worker_marginals(pv):
+    return pv.marginals()
+
+
+def worker_flip(handle):
+    pv = PauliVectorShared.attach(handle, writable=True)
+    lib.rotate_x(np.pi)(pv, 2)
+    pv.close()
+    return handle.name
+
+
+class TestPauliVectorShared:
+    def test_matches_numpy(self):
+        b = [bases.general(2)] * 3
+        with PauliVectorShared(b) as pv:
+            ref = prepare(PauliVectorNumpy(b))
+            prepare(pv)
+            assert pv.to_pv() == approx(ref.to_pv())
+            assert pv.trace() == approx(ref.trace())
+            for m, m_ref in zip(pv.marginals(), ref.marginals()):
+                assert m == approx(m_ref)
+            pv.project(2, 1)
+            ref.project(2, 1)
+            pv.renormalize()
+            ref.renormalize()
+            assert pv.to_pv() == approx(ref.to_pv())
+            assert pv.norm == approx(ref.norm)
+
+    def test_no_work_buffers_between_operations(self):
+        b = [bases.general(2)] * 3
+        with PauliVectorShared(b) as pv:
+            prepare(pv)
+            pv.renormalize()
+            assert pv.memory_footprint().private == pv.to_pv().nbytes
+            lib.rotate_y(0.3)(pv, 1)
+            assert pv.memory_footprint().private == pv.to_pv().nbytes
+
+    def test_handle_follows_ptms(self):
+        b = [bases.general(2)] * 3
+        with PauliVectorShared(b) as pv:
+            handle = pv.handle()
+            assert isinstance(handle, SharedHandle)
+            prepare(pv)
+            assert pv.handle().name == handle.name
+            attached = PauliVectorShared.attach(handle)
+            assert not attached.owner
+            assert not attached.writable
+            assert attached.to_pv() == approx(pv.to_pv())
+            assert attached.meas_prob(1) == approx(pv.meas_prob(1))
+            # Memoized quantities of the attachment must be invalidated
+            lib.rotate_y(0.3)(pv, 1)
+            assert attached.version == pv.version
+            assert attached.meas_prob(1) == approx(pv.meas_prob(1))
+            attached.close()
+
+    def test_read_only(self):
+        with PauliVectorShared([bases.general(2)] * 2) as pv:
+            attached = PauliVectorShared.attach(pv.handle())
+            with pytest.raises(ValueError, match='read-only'):
+                lib.rotate_x(0.5)(attached, 0)
+            with pytest.raises(ValueError, match='read-only'):
+                attached.renormalize()
+            with pytest.raises(ValueError):
+                attached.to_pv()[0, 0] = 0.
+            attached.close()
+            with pytest.raises(ValueError, match='closed'):
+                attached.to_pv()
+
+    def test_writable(self):
+        b = [bases.general(2)] * 2
+        with PauliVectorShared(b) as pv:
+            pv.meas_prob(0)
+            attached = PauliVectorShared.attach(pv.handle(), writable=True)
+            lib.rotate_x(np.pi)(attached, 0)
+            assert pv.meas_prob(0) == approx([0, 1])
+            # Growing the state is not possible without the owner
+            with pytest.raises(ValueError, match='owner'):
+                attached.add_qubit(bases.general(2))
+            attached.close()
+            # The owner may reallocate the segment
+            pv.add_qubit(bases.general(2))
+            assert pv.dim_pauli == (4, 4, 4)
+            assert pv.meas_prob(0) == approx([0, 1])
+            assert pv.meas_prob(2) == approx([1, 0])
+
+    def test_pickle(self):
+        with PauliVectorShared([bases.general(2)] * 3) as pv:
+            prepare(pv)
+            pv.project(2, 0)
+            restored = pickle.loads(pickle.dumps(pv))
+            assert isinstance(restored, PauliVectorShared)
+            assert not restored.owner and not restored.writable
+            assert restored.to_pv() == approx(pv.to_pv())
+            assert restored.norm == approx(pv.norm)
+            assert restored.bases == pv.bases
+            copy = restored.copy()
+            assert copy.owner and copy.writable
+            lib.rotate_x(0.3)(copy, 0)
+            copy.close()
+            restored.close()
+        # Only a handle is pickled, not the data
+        with PauliVectorShared([bases.general(2)] * 8) as pv:
+            assert len(pickle.dumps(pv)) < 2000 < pv.to_pv().nbytes
+
+    def test_close(self):
+        pv = PauliVectorShared([bases.general(2)] * 2)
+        handle = pv.handle()
+        attached = PauliVectorShared.attach(handle)
+        data = attached.to_pv().copy()
+        pv.close()
+        assert pv.closed
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(handle.name)
+        # Attachments keep their mapping until they are closed
+        assert attached.to_pv() == approx(data)
+        attached.close()
+
+    def test_garbage_collected(self):
+        pv = PauliVectorShared([bases.general(2)] * 2)
+        name = pv.handle().name
+        del pv
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name)
+
+    @pytest.mark.parametrize('method', ['fork', 'spawn'])
+    def test_worker_processes(self, method):
+        if method not in multiprocessing.get_all_start_methods():
+            pytest.skip('{} start method is not available'.format(method))
+        ctx = multiprocessing.get_context(method)
+        b = [bases.general(2)] * 3
+        with PauliVectorShared(b) as pv:
+            prepare(pv)
+            expected = pv.marginals()
+            with ctx.Pool(2) as pool:
+                results = pool.map(worker_marginals, [pv] * 2)
+                for marginals in results:
+                    for m, m_ref in zip(marginals, expected):
+                        assert m == approx(m_ref)
+                prob = pv.meas_prob(2)
+                name = pool.apply(worker_flip, (pv.handle(),))
+            assert name == pv.handle().name
+            assert pv.meas_prob(2) == approx(prob[::-1])
+            # Segment must survive the workers
+            assert pv.to_pv() is not None
+            PauliVectorShared.attach(pv.handle()).close()
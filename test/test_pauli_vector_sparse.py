@@ -0,0 +1,131 @@
+# This file is part of quantumsim. (https://gitlab.com/quantumsim/quantumsim)
+# (c) 2018 Quantumsim Authors
+# Distributed under the GNU GPLv3. See LICENSE.txt or
+# https://www.gnu.org/licenses/gpl.txt
+
+import pytest
+import numpy as np
+
+from pytest import approx
+from quantumsim import bases
+from quantumsim.models import qubits as lib
+from quantumsim.pauli_vectors import PauliVectorNumpy, PauliVectorSparse
+
+
+class TestPauliVectorSparse:
+    def test_ground_state(self):
+        b = [bases.general(2), bases.gell_mann(2), bases.general(2)]
+        pv = PauliVectorSparse(b, density_max=1.)
+        dm = np.zeros((8, 8))
+        dm[0, 0] = 1
+        assert pv.to_dm() == approx(dm)
+        assert pv.trace() == approx(1)
+        assert pv.nnz < pv.size
+
+    def test_matches_numpy(self):
+        b = [bases.general(2), bases.general(3), bases.general(2),
+             bases.general(2)]
+        rng = np.random.RandomState(1234)
+        data = rng.random_sample((4, 9, 4, 4))
+        data[data < 0.8] = 0
+        reference = PauliVectorNumpy(b, data)
+        pv = PauliVectorSparse(b, data, density_max=1.)
+        assert not pv.is_dense
+        assert pv.to_pv() == approx(reference.to_pv())
+
+        for qubits in ((0,), (1,), (3, 0), (2, 1), (1, 3)):
+            shape = tuple(pv.dim_pauli[q] for q in qubits)
+            ptm = rng.random_sample(shape * 2)
+            reference.apply_ptm(ptm, *qubits)
+            pv.apply_ptm(ptm, *qubits)
+            assert pv.to_pv() == approx(reference.to_pv())
+        ptm = rng.random_sample((2, 9))
+        reference.apply_ptm(ptm, 1)
+        pv.apply_ptm(ptm, 1)
+        assert pv.to_pv().shape == reference.to_pv().shape
+        assert pv.to_pv() == approx(reference.to_pv())
+        pv.bases[1] = reference.bases[1] = b[1].subbasis([0, 4])
+
+        assert pv.trace() == approx(reference.trace())
+        assert pv.diagonal() == approx(reference.diagonal())
+        assert pv.purity() == approx(reference.purity())
+        for q in range(4):
+            assert pv.meas_prob(q) == approx(reference.meas_prob(q))
+        assert pv.joint_meas_prob(3, 0) == approx(
+            reference.joint_meas_prob(3, 0))
+        assert pv.partial_trace(2, 0).to_pv() == approx(
+            reference.partial_trace(2, 0).to_pv())
+        bitstrings = ['0000', '1001', '0110', '1111']
+        assert pv.bitstring_probs(bitstrings) == approx(
+            reference.bitstring_probs(bitstrings))
+
+    def test_clifford_circuit_stays_sparse(self):
+        n = 16
+        b = [bases.general(2)] * n
+        pv = PauliVectorSparse(b)
+        lib.hadamard()(pv, 0)
+        for q in range(1, n):
+            lib.cnot()(pv, 0, q)
+        # GHZ state has 2 diagonal and 2**(n-1) off-diagonal nonzero
+        # components out of 4**n
+        assert not pv.is_dense
+        assert pv.nnz == 2 + 2 ** (n - 1)
+        assert pv.trace() == approx(1)
+        assert pv.meas_prob(5) == approx([0.5, 0.5])
+        assert pv.bitstring_probs(['0' * n, '1' * n, '01' * (n // 2)]) == \
+            approx([0.5, 0.5, 0])
+        assert pv.purity() == approx(1)
+        pv.project(3, 1)
+        assert pv.bitstring_probs(['1' * n]) == approx([1])
+        assert pv.norm == approx(0.5)
+
+    def test_densify(self):
+        b = [bases.general(2)] * 3
+        pv = PauliVectorSparse(b, density_max=0.3)
+        reference = PauliVectorNumpy(b)
+        for q in range(3):
+            lib.rotate_x(0.3)(pv, q)
+            lib.rotate_x(0.3)(reference, q)
+            lib.rotate_y(0.7)(pv, q)
+            lib.rotate_y(0.7)(reference, q)
+        assert pv.is_dense
+        assert pv.density == 1
+        lib.cnot()(pv, 0, 2)
+        lib.cnot()(reference, 0, 2)
+        assert pv.to_pv() == approx(reference.to_pv())
+        assert pv.meas_prob(2) == approx(reference.meas_prob(2))
+        pv.project(1, 0)
+        reference.project(1, 0)
+        assert pv.dim_pauli == reference.dim_pauli
+        assert pv.to_pv() == approx(reference.to_pv())
+        assert pv.copy().to_pv() == approx(reference.to_pv())
+
+    def test_qubit_allocation(self):
+        b = bases.general(2)
+        pv = PauliVectorSparse([b] * 2, density_max=1.)
+        lib.hadamard()(pv, 0)
+        lib.cnot()(pv, 0, 1)
+        pv.add_qubit(b, 1)
+        assert pv.bitstring_probs(['001', '111', '110']) == \
+            approx([0.5, 0.5, 0])
+        pv.reset(0)
+        assert pv.dim_pauli == (1, 4, 4)
+        assert pv.bitstring_probs(['001', '011', '111']) == \
+            approx([0.5, 0.5, 0])
+        pv.remove_qubit(2)
+        assert pv.meas_prob(1) == approx([0.5, 0.5])
+        assert pv.truncate_bases() == 0
+        assert pv.dim_pauli == (1, 2)
+
+    def test_entries(self):
+        b = [bases.general(2)] * 2
+        pv = PauliVectorSparse(b, ([[0, 1], [3, 0]], [0.5, 0.25]))
+        coords, values = pv.entries()
+        assert coords.tolist() == [[0, 1], [3, 0]]
+        assert values == approx([0.5, 0.25])
+        with pytest.raises(ValueError):
+            PauliVectorSparse(b, ([[0, 4], [0, 0]], [0.5, 0.25]))
+        with pytest.raises(ValueError):
+            PauliVectorSparse(b, ([[0], [0]], [0.5, 0.25]))
+        with pytest.raises(ValueError):
+            pv.apply_ptm(np.identity(4), 2)
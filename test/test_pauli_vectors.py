@@ -31,7 +31,8 @@ def dm_dims(request):
 
 
 # FIXME: Gell-Mann should also be tested, when it is supported
-# @pytest.fixture(params=[quantumsim.bases.general, quantumsim.bases.gell_mann])
+# @pytest.fixture(params=[quantumsim.bases.general,
+#                         quantumsim.bases.gell_mann])
 @pytest.fixture(params=[quantumsim.bases.general])
 def dm_basis(request):
     return request.param
@@ -101,7 +102,7 @@ class TestPauliVectors:
 
     @pytest.mark.parametrize(
         'bases', [
-            (quantumsim.bases.general(2), quantumsim.bases.general(2), quantumsim.bases.general(2)),
+            (quantumsim.bases.general(2),) * 3,
             (quantumsim.bases.general(2).subbasis([0, 1, 2]),
              quantumsim.bases.general(2).subbasis([0, 1]),
              quantumsim.bases.general(2))
@@ -220,7 +221,7 @@ class TestPauliVectors:
 
     @pytest.mark.parametrize(
         'bases', [
-            (quantumsim.bases.general(2), quantumsim.bases.general(2), quantumsim.bases.general(2)),
+            (quantumsim.bases.general(2),) * 3,
             (basis_general_reshuffled, basis_general_reshuffled,
              basis_general_reshuffled),
             (quantumsim.bases.general(2),
@@ -266,7 +267,7 @@ class TestPauliVectors:
 
     @pytest.mark.parametrize(
         'bases', [
-            (quantumsim.bases.general(2), quantumsim.bases.general(2), quantumsim.bases.general(2)),
+            (quantumsim.bases.general(2),) * 3,
             (basis_general_reshuffled, basis_general_reshuffled,
              basis_general_reshuffled),
             (
@@ -288,3 +289,1151 @@ class TestPauliVectors:
         assert s.bases[1] == bases[1]
         assert np.allclose(s.diagonal(), diag)
 
+
+class TestContractionPlan:
+    @pytest.mark.parametrize('qubits', [
+        (0,), (2,), (3,), (0, 1), (1, 0), (1, 3), (3, 0), (0, 1, 2),
+        (2, 0, 3), (3, 1, 2)
+    ])
+    @pytest.mark.parametrize('threads', [1, 3])
+    def test_apply_ptm_matches_einsum(self, qubits, threads):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        rng = np.random.RandomState(512)
+        shape = (4, 3, 9, 2)
+        pv = PauliVectorNumpy(
+            [quantumsim.bases.general(2),
+             quantumsim.bases.general(2).subbasis([0, 1, 2]),
+             quantumsim.bases.general(3),
+             quantumsim.bases.general(2).subbasis([0, 3])],
+            rng.random_sample(shape), threads=threads)
+        pv._parallel_size_min = 0
+        # PTM changes dimensions of the target qubits
+        dims_out = tuple(shape[q] - 1 if shape[q] > 1 else 1 for q in qubits)
+        ptm = rng.random_sample(dims_out + tuple(shape[q] for q in qubits))
+
+        n, k = len(shape), len(qubits)
+        out_idx = list(range(n))
+        for i, q in enumerate(qubits):
+            out_idx[q] = n + i
+        expected = np.einsum(pv.to_pv(), list(range(n)),
+                             ptm, list(range(n, n + k)) + list(qubits),
+                             out_idx)
+        pv.apply_ptm(ptm, *qubits)
+        assert pv.to_pv().shape == expected.shape
+        assert pv.to_pv().flags.c_contiguous
+        np.testing.assert_allclose(pv.to_pv(), expected, rtol=1e-12)
+
+    def test_plan_is_cached(self):
+        from quantumsim.pauli_vectors._contraction import contraction_plan
+        plan = contraction_plan((4, 4, 4), (2, 0), (4, 4, 4, 4))
+        assert contraction_plan((4, 4, 4), (2, 0), (4, 4, 4, 4)) is plan
+        assert not plan.direct
+        assert contraction_plan((4, 4, 4), (1, 2), (4, 4, 4, 4)).direct
+
+    @pytest.mark.parametrize('n_threads', [2, 3, 7])
+    def test_thread_pool(self, n_threads):
+        from quantumsim.pauli_vectors._contraction import ThreadPool
+        pool = ThreadPool(n_threads)
+        for n in (1, 2, 5, 16):
+            slabs = pool.slabs(n)
+            assert len(slabs) == min(n, n_threads)
+            assert slabs[0].start == 0 and slabs[-1].stop == n
+            for s1, s2 in zip(slabs[:-1], slabs[1:]):
+                assert s1.stop == s2.start
+        with pytest.raises(ValueError):
+            ThreadPool(0)
+
+    def test_parallel_circuit_matches_serial(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        rng = np.random.RandomState(8192)
+        b = [quantumsim.bases.general(2)] * 9
+        pv_serial = PauliVectorNumpy(b)
+        pv_parallel = PauliVectorNumpy(b, threads=4)
+        assert pv_serial.size >= pv_parallel._parallel_size_min
+        for qubits in ((0,), (8,), (4, 5), (7, 2), (0, 8), (3,)):
+            ptm = rng.random_sample((4,) * 2 * len(qubits)) / 4
+            pv_serial.apply_ptm(ptm, *qubits)
+            pv_parallel.apply_ptm(ptm, *qubits)
+        np.testing.assert_allclose(pv_parallel.to_pv(), pv_serial.to_pv(),
+                                   rtol=1e-12)
+        assert pv_parallel.copy().threads == 4
+        with pytest.raises(ValueError):
+            PauliVectorNumpy(b, threads=0)
+
+    def test_wrong_ptm_shape(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        pv = PauliVectorNumpy([quantumsim.bases.general(2)] * 2)
+        with pytest.raises(ValueError):
+            pv.apply_ptm(np.identity(9), 0)
+        with pytest.raises(ValueError):
+            pv.apply_ptm(np.identity(4), 2)
+
+
+class TestWorkBuffers:
+    def test_steady_state_does_not_allocate(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        rng = np.random.RandomState(1024)
+        pv = PauliVectorNumpy([quantumsim.bases.general(2)] * 4)
+        ptm1 = rng.random_sample((4, 4))
+        ptm2 = rng.random_sample((4, 4, 4, 4))
+        pv.apply_ptm(ptm2, 3, 0)
+        pv.apply_ptm(ptm1, 1)
+        buffers = [b.__array_interface__['data'][0] for b in pv._buffers]
+        expected = pv._data.copy()
+        for _ in range(3):
+            pv.apply_ptm(ptm2, 3, 0)
+            pv.apply_ptm(ptm1, 1)
+            expected = np.einsum('abcd,ijda->jbci', expected, ptm2)
+            expected = np.einsum('abcd,ib->aicd', expected, ptm1)
+            assert [b.__array_interface__['data'][0]
+                    for b in pv._buffers] == buffers
+            assert any(np.shares_memory(pv._data, b) for b in pv._buffers)
+        np.testing.assert_allclose(pv.to_pv(), expected, rtol=1e-12)
+
+    def test_user_data_is_not_overwritten(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        data = np.random.RandomState(2048).random_sample((4, 4, 4))
+        data_copy = data.copy()
+        pv = PauliVectorNumpy([quantumsim.bases.general(2)] * 3, data)
+        for qubits in ((0,), (2, 0), (1, 2), (0, 2)):
+            ptm = np.identity(4 ** len(qubits)).reshape((4,) * 2 *
+                                                        len(qubits))
+            pv.apply_ptm(ptm, *qubits)
+        np.testing.assert_array_equal(data, data_copy)
+        np.testing.assert_allclose(pv.to_pv(), data_copy)
+        assert not np.shares_memory(pv.to_pv(), data)
+
+    def test_exported_data_is_not_overwritten(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        rng = np.random.RandomState(4096)
+        pv = PauliVectorNumpy([quantumsim.bases.general(2)] * 2)
+        ptm = rng.random_sample((4, 4))
+        pv.apply_ptm(ptm, 0)
+        data = pv.to_pv()
+        data_copy = data.copy()
+        pv2 = PauliVectorNumpy.from_pv(data, list(pv.bases))
+        for qubit in (0, 1, 0):
+            pv.apply_ptm(ptm, qubit)
+        pv.renormalize()
+        np.testing.assert_array_equal(data, data_copy)
+        np.testing.assert_array_equal(pv2.to_pv(), data_copy)
+        assert not any(np.shares_memory(data, b) for b in pv._buffers
+                       if b is not None)
+
+
+class TestPrecision:
+    def test_single_precision_circuit(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        from quantumsim.models import qubits as lib
+        basis = (quantumsim.bases.general(2),)
+        circuit = lib.Operation.from_sequence(
+            lib.rotate_x(0.3).at(0), lib.cphase(1.1).at(0, 1),
+            lib.rotate_y(1.7).at(1), lib.amp_damping(0.1).at(0),
+            lib.rotate_euler(0.2, 0.5, 0.9).at(1))
+        pv64 = PauliVectorNumpy(basis * 2)
+        pv32 = PauliVectorNumpy(basis * 2, dtype=np.float32)
+        assert pv64.dtype == np.float64
+        assert pv32.dtype == np.float32
+        circuit(pv64, 0, 1)
+        circuit.compile(basis * 2, dtype=np.float32)(pv32, 0, 1)
+        assert pv32.to_pv().dtype == np.float32
+        np.testing.assert_allclose(pv32.to_pv(), pv64.to_pv(), atol=1e-6)
+
+        # Reductions are accumulated in double precision
+        assert pv32.diagonal().dtype == np.float64
+        assert pv32.meas_prob(0).dtype == np.float64
+        assert pv32.trace() == approx(1)
+        assert pv32.partial_trace(1).dtype == np.float32
+        assert pv32.copy().dtype == np.float32
+
+    def test_double_precision_ptm_is_cast(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        rng = np.random.RandomState(4096)
+        ptm = rng.random_sample((4, 4))
+        pv = PauliVectorNumpy([quantumsim.bases.general(2)] * 2,
+                              dtype=np.float32)
+        expected = np.einsum('ab,ib->ai', pv.to_pv(), ptm)
+        pv.apply_ptm(ptm, 1)
+        assert pv.to_pv().dtype == np.float32
+        np.testing.assert_allclose(pv.to_pv(), expected, rtol=1e-6)
+
+    def test_operations_without_ptm(self):
+        from quantumsim.models import qubits as lib
+
+        class Flip(lib.Operation):
+            dim_hilbert = 2
+            num_qubits = 1
+
+            def __call__(self, pauli_vector, *qubits):
+                lib.rotate_x(np.pi)(pauli_vector, *qubits)
+
+            def set_bases(self, bases_in=None, bases_out=None):
+                return lib.rotate_x(np.pi).set_bases(bases_in, bases_out)
+
+            def ptm(self, bases_in, bases_out=None):
+                return lib.rotate_x(np.pi).ptm(bases_in, bases_out)
+
+        flip = Flip()
+        assert flip.astype(np.float32) is flip
+        chain = lib.Operation.from_sequence(lib.rotate_y(0.3).at(0),
+                                            flip.at(1))
+        chain32 = chain.astype(np.float32)
+        assert chain32.operations[0].operation._ptm.dtype == np.float32
+        assert chain32.operations[1].operation is flip
+
+    def test_dtype_from_data(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        b = [quantumsim.bases.general(2)]
+        assert PauliVectorNumpy(
+            b, np.zeros(4, dtype=np.float32)).dtype == np.float32
+        assert PauliVectorNumpy(
+            b, np.zeros(4, dtype=np.float16)).dtype == np.float64
+        pv = PauliVectorNumpy(b, np.zeros(4), dtype=np.float32)
+        assert pv.to_pv().dtype == np.float32
+        with pytest.raises(ValueError):
+            PauliVectorNumpy(b, dtype=np.int32)
+
+    def test_size_limit(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        # 1.56 times more, than allowed in double precision
+        b = [quantumsim.bases.general(2)] * 9 + [quantumsim.bases.general(5)]
+        with pytest.raises(ValueError, match='force=True'):
+            PauliVectorNumpy(b)
+        assert PauliVectorNumpy(b, dtype=np.float32).size == 2**18 * 25
+
+
+class TestReductions:
+    @pytest.mark.parametrize('bases', [
+        # Bases with hints, without them, and with partial hints
+        (quantumsim.bases.general(2), quantumsim.bases.gell_mann(2),
+         quantumsim.bases.general(3)),
+        (quantumsim.bases.gell_mann(3),
+         quantumsim.bases.general(2).subbasis([0, 1, 3]),
+         quantumsim.bases.general(3).computational_subbasis()),
+        (quantumsim.bases.general(2).subbasis([1, 2]),
+         quantumsim.bases.gell_mann(2).subbasis([0, 3]),
+         quantumsim.bases.gell_mann(2).subbasis([1, 2])),
+    ])
+    @pytest.mark.parametrize('dtype', [np.float32, np.float64])
+    def test_reductions_match_density_matrix(self, bases, dtype):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        rng = np.random.RandomState(16384)
+        data = rng.random_sample([b.dim_pauli for b in bases])
+        pv = PauliVectorNumpy(bases, data.astype(dtype))
+        rho = np.einsum(data, [0, 1, 2],
+                        bases[0].vectors, [0, 3, 6],
+                        bases[1].vectors, [1, 4, 7],
+                        bases[2].vectors, [2, 5, 8], [3, 4, 5, 6, 7, 8])
+
+        rtol = 1e-6 if dtype == np.float32 else 1e-12
+        diag = np.einsum(rho, [0, 1, 2, 0, 1, 2], [0, 1, 2]).real
+        assert pv.diagonal().dtype == np.float64
+        np.testing.assert_allclose(pv.diagonal(), diag.flatten(), rtol=rtol)
+        assert pv.trace() == approx(np.sum(diag), rel=rtol)
+        for q in range(3):
+            np.testing.assert_allclose(
+                pv.meas_prob(q),
+                np.sum(diag, axis=tuple(i for i in range(3) if i != q)),
+                rtol=rtol)
+        for qubits in ((0,), (2, 1), (0, 2)):
+            traced = pv.partial_trace(*qubits)
+            assert traced.bases == [bases[q] for q in qubits]
+            assert traced.dtype == dtype
+            rho_traced = rho
+            for i in (2, 1, 0):
+                if i not in qubits:
+                    rho_traced = np.trace(rho_traced, axis1=i,
+                                          axis2=i + rho_traced.ndim // 2)
+            kept = sorted(qubits)
+            k = len(qubits)
+            rho_traced = np.transpose(
+                rho_traced, [kept.index(q) for q in qubits] +
+                [kept.index(q) + k for q in qubits])
+            einsum_args = [traced.to_pv(), list(range(k))]
+            for i, q in enumerate(qubits):
+                einsum_args.append(bases[q].vectors)
+                einsum_args.append([i, k + i, 2 * k + i])
+            np.testing.assert_allclose(
+                np.einsum(*einsum_args), rho_traced, rtol=rtol, atol=rtol)
+
+    def test_hints_are_used(self):
+        from quantumsim.pauli_vectors._reductions import _diagonal_indices
+        assert quantumsim.bases.gell_mann(2).trace_index == 0
+        assert quantumsim.bases.general(2).trace_index is None
+        assert _diagonal_indices(quantumsim.bases.general(3)) is not None
+        assert _diagonal_indices(quantumsim.bases.gell_mann(2)) is None
+
+
+class TestProjection:
+    @pytest.mark.parametrize('basis', [quantumsim.bases.general(2),
+                                       quantumsim.bases.gell_mann(2)])
+    def test_project(self, basis):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        from quantumsim.models import qubits as lib
+        ground_state = np.zeros((8, 8))
+        ground_state[0, 0] = 1
+        pv = PauliVectorNumpy.from_dm(ground_state, [basis] * 3)
+        lib.rotate_y(1.2)(pv, 0)
+        lib.cnot()(pv, 0, 2)
+        lib.rotate_x(0.7)(pv, 1)
+        dm = pv.to_dm().reshape((2,) * 6)
+
+        p1 = pv.project(0, 1)
+        assert pv.to_pv().shape == (1, 4, 4)
+        assert pv.bases[0].dim_pauli == 1
+        assert pv.bases[0].superbasis == quantumsim.bases.general(2)
+        assert pv.trace() == approx(1)
+        assert p1 == approx(np.sin(0.6) ** 2)
+        assert pv.norm == approx(p1)
+        expected = np.zeros_like(dm)
+        expected[1, :, :, 1] = dm[1, :, :, 1] / p1
+        assert pv.to_dm() == approx(expected.reshape(8, 8))
+
+        p2 = pv.project(2, 1)
+        assert p2 == approx(1)
+        p3 = pv.project(1, 0)
+        assert p3 == approx(np.cos(0.35) ** 2)
+        assert pv.to_pv().shape == (1, 1, 1)
+        assert pv.norm == approx(p1 * p2 * p3)
+        assert pv.copy().norm == pv.norm
+        # Projecting onto the same outcome again changes nothing
+        assert pv.project(1, 0) == approx(1)
+
+        with pytest.raises(ValueError):
+            pv.project(1, 2)
+        with pytest.raises(ValueError):
+            pv.project(3, 0)
+
+    def test_measure(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        from quantumsim.models import qubits as lib
+        outcomes = []
+        for seed in range(200):
+            pv = PauliVectorNumpy([quantumsim.bases.general(2)] * 2)
+            lib.rotate_y(np.pi / 2)(pv, 0)
+            lib.cnot()(pv, 0, 1)
+            rng = np.random.RandomState(seed) if seed % 2 else seed
+            outcome = pv.measure(0, rng)
+            assert pv.norm == approx(0.5)
+            # Qubits are correlated
+            assert pv.measure(1, seed) == outcome
+            assert pv.norm == approx(0.5)
+            outcomes.append(outcome)
+        assert 0.35 < np.mean(outcomes) < 0.65
+
+    def test_other_backends(self, tmpdir):
+        from quantumsim.pauli_vectors import PauliVectorBatch, \
+            PauliVectorMemmap
+        from quantumsim.models import qubits as lib
+        b = [quantumsim.bases.general(2)] * 2
+        batch = PauliVectorBatch(b, batch_size=3)
+        lib.rotate_y(np.array([0., np.pi / 2, np.pi]))(batch, 1)
+        with pytest.warns(UserWarning):
+            # Zero weight of the first member
+            assert batch.project(1, 1) == approx([0, 0.5, 1])
+        assert batch.to_pv().shape == (3, 4, 1)
+        assert batch.norm == approx([0, 0.5, 1])
+        with pytest.raises(NotImplementedError):
+            batch.measure(0)
+
+        pv = PauliVectorMemmap(b, directory=str(tmpdir))
+        lib.rotate_y(np.pi / 2)(pv, 0)
+        assert pv.project(0, 0) == approx(0.5)
+        assert pv.to_pv().shape == (1, 4)
+        assert pv.trace() == approx(1)
+
+
+class TestProbabilityQueries:
+    @pytest.mark.parametrize('bases', [
+        [quantumsim.bases.general(2)] * 4,
+        [quantumsim.bases.gell_mann(2), quantumsim.bases.general(3),
+         quantumsim.bases.general(2).subbasis([0, 1, 3]),
+         quantumsim.bases.gell_mann(3)],
+    ])
+    def test_queries_match_diagonal(self, bases):
+        from quantumsim.pauli_vectors import PauliVectorNumpy, \
+            PauliVectorBatch
+        rng = np.random.RandomState(32768)
+        dim_pauli = [b.dim_pauli for b in bases]
+        dim_hilbert = [b.dim_hilbert for b in bases]
+        pv = PauliVectorNumpy(bases, rng.random_sample(dim_pauli))
+        diag = pv.diagonal().reshape(dim_hilbert)
+
+        marginals = pv.marginals()
+        assert len(marginals) == 4
+        for q, m in enumerate(marginals):
+            np.testing.assert_allclose(m, pv.meas_prob(q), rtol=1e-12)
+        np.testing.assert_allclose(
+            pv.joint_meas_prob(2, 0), np.sum(diag, axis=(1, 3)).T,
+            rtol=1e-12)
+        np.testing.assert_allclose(
+            pv.joint_meas_prob(3, 1, 2, 0), np.transpose(diag, (3, 1, 2, 0)),
+            rtol=1e-12)
+
+        bitstrings = [[0, 2, 1, 1], [1, 0, 0, 2], [0, 0, 0, 0]]
+        if dim_hilbert[1] == 2:
+            bitstrings = [[b % 2 for b in bs] for bs in bitstrings]
+        expected = [diag[tuple(bs)] for bs in bitstrings]
+        np.testing.assert_allclose(pv.bitstring_probs(bitstrings), expected,
+                                   rtol=1e-12)
+        np.testing.assert_allclose(
+            pv.bitstring_probs([''.join(map(str, bs)) for bs in bitstrings]),
+            expected, rtol=1e-12)
+        assert pv.bitstring_probs([]).shape == (0,)
+
+        # Base class implementation
+        from quantumsim.pauli_vectors.pauli_vector import PauliVectorBase
+        for q, m in enumerate(PauliVectorBase.marginals(pv)):
+            np.testing.assert_allclose(m, marginals[q], rtol=1e-12)
+        np.testing.assert_allclose(
+            PauliVectorBase.joint_meas_prob(pv, 3, 1),
+            pv.joint_meas_prob(3, 1), rtol=1e-12)
+        np.testing.assert_allclose(
+            PauliVectorBase.bitstring_probs(pv, bitstrings), expected,
+            rtol=1e-12)
+
+        batch = PauliVectorBatch.from_pauli_vectors([pv, pv.copy()])
+        assert batch.marginals()[1].shape == (2, dim_hilbert[1])
+        assert batch.joint_meas_prob(3, 1).shape == \
+            (2, dim_hilbert[3], dim_hilbert[1])
+        np.testing.assert_allclose(batch.bitstring_probs(bitstrings),
+                                   [expected] * 2, rtol=1e-12)
+
+    def test_errors(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        pv = PauliVectorNumpy([quantumsim.bases.general(2)] * 2)
+        with pytest.raises(ValueError):
+            pv.joint_meas_prob(0, 0)
+        with pytest.raises(ValueError):
+            pv.joint_meas_prob(2)
+        with pytest.raises(ValueError):
+            pv.bitstring_probs(['010'])
+        with pytest.raises(ValueError):
+            pv.bitstring_probs([[0, 2]])
+
+
+class TestMemoization:
+    def test_results_are_reused_until_change(self, monkeypatch):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        from quantumsim.pauli_vectors import numpy as backend
+        from quantumsim.models import qubits as lib
+        calls = []
+        original = backend.reduce_axes
+
+        def reduce_axes(*args, **kwargs):
+            calls.append(args[2])
+            return original(*args, **kwargs)
+
+        monkeypatch.setattr(backend, 'reduce_axes', reduce_axes)
+
+        pv = PauliVectorNumpy([quantumsim.bases.general(2)] * 3)
+        lib.rotate_y(1.)(pv, 0)
+        version = pv.version
+        diag = pv.diagonal()
+        assert pv.diagonal() is diag
+        assert not diag.flags.writeable
+        assert pv.meas_prob(0) is pv.meas_prob(0)
+        assert pv.meas_prob(0) is not pv.meas_prob(1)
+        assert pv.marginals() is pv.marginals()
+        assert pv.joint_meas_prob(1, 0) is pv.joint_meas_prob(1, 0)
+        n_calls = len(calls)
+        pv.trace()
+        pv.trace()
+        pv.renormalize()
+        # Trace is computed once
+        assert len(calls) == n_calls + 1
+        assert pv.version == version + 1
+
+        lib.rotate_x(0.5)(pv, 1)
+        assert pv.version == version + 2
+        assert pv.diagonal() is not diag
+        # Change of the bases invalidates the results too
+        diag = pv.diagonal()
+        pv.bases[2] = quantumsim.bases.gell_mann(2)
+        assert pv.diagonal() is not diag
+
+    def test_purity(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy, \
+            PauliVectorBatch
+        from quantumsim.models import qubits as lib
+        pv = PauliVectorNumpy([quantumsim.bases.general(2)] * 2)
+        assert pv.purity() == approx(1)
+        lib.rotate_y(1.)(pv, 0)
+        lib.amp_damping(0.3)(pv, 0)
+        dm = pv.to_dm()
+        assert pv.purity() == approx(np.trace(dm @ dm).real)
+        batch = PauliVectorBatch.from_pauli_vectors([
+            pv, PauliVectorNumpy(pv.bases)])
+        assert batch.purity() == approx([pv.purity(), 1])
+
+
+class TestQubitAllocation:
+    @pytest.fixture(params=['numpy', 'memmap'])
+    def make_pv(self, request, tmpdir):
+        from quantumsim.pauli_vectors import PauliVectorNumpy, \
+            PauliVectorMemmap
+        if request.param == 'numpy':
+            return PauliVectorNumpy
+        return lambda bases: PauliVectorMemmap(
+            bases, directory=str(tmpdir), chunk_size=16)
+
+    def test_add_reset_remove(self, make_pv):
+        from quantumsim.models import qubits as lib
+        basis = quantumsim.bases.general(2)
+        pv = make_pv([basis] * 2)
+        lib.rotate_y(1.1)(pv, 0)
+        lib.cnot()(pv, 0, 1)
+        lib.rotate_x(0.4)(pv, 1)
+        dm = pv.to_dm()
+        one = np.diag([0., 1.])
+        zero = np.diag([1., 0.])
+
+        version = pv.version
+        assert pv.add_qubit(basis, 1) == 2
+        assert pv.version > version
+        assert pv.n_qubits == 3
+        assert pv.to_dm() == approx(np.kron(dm, one))
+
+        # Reset to a computational state shrinks the basis
+        pv.reset(0)
+        assert pv.bases[0].dim_pauli == 1
+        assert pv.to_pv().shape == (1, 4, 4)
+        dm_1 = np.einsum('abac->bc', dm.reshape(2, 2, 2, 2))
+        assert pv.to_dm() == approx(np.kron(np.kron(zero, dm_1), one))
+        lib.rotate_x(0.3)(pv, 0)
+        rx = np.array([[np.cos(0.15), -1j * np.sin(0.15)],
+                       [-1j * np.sin(0.15), np.cos(0.15)]])
+        rho_0 = rx @ zero @ rx.conj().T
+        assert pv.to_dm() == approx(np.kron(np.kron(rho_0, dm_1), one))
+
+        # Reset to a Pauli vector in a given basis
+        pv.reset(2, basis.hilbert_to_pauli_vector(np.identity(2) / 2).real,
+                 basis)
+        assert pv.bases[2] == basis
+        assert pv.to_dm() == approx(
+            np.kron(np.kron(rho_0, dm_1), np.identity(2) / 2))
+
+        pv.remove_qubit(0)
+        assert pv.n_qubits == 2
+        assert pv.to_dm() == approx(np.kron(dm_1, np.identity(2) / 2))
+        pv.remove_qubit(1)
+        assert pv.to_dm() == approx(dm_1)
+        assert pv.trace() == approx(1)
+        with pytest.raises(ValueError):
+            pv.remove_qubit(0)
+
+    def test_batch(self):
+        from quantumsim.pauli_vectors import PauliVectorBatch
+        from quantumsim.models import qubits as lib
+        basis = quantumsim.bases.general(2)
+        batch = PauliVectorBatch([basis], batch_size=2)
+        lib.rotate_y(np.array([0., np.pi]))(batch, 0)
+        batch.add_qubit(basis)
+        assert batch.to_pv().shape == (2, 4, 4)
+        assert batch.joint_meas_prob(0, 1) == approx(
+            np.array([[[1, 0], [0, 0]], [[0, 0], [1, 0]]]))
+        batch.reset(0, 1)
+        assert batch.meas_prob(0) == approx(np.array([[0, 1], [0, 1]]))
+        batch.remove_qubit(0)
+        assert batch.to_pv().shape == (2, 4)
+        assert batch.trace() == approx(np.ones(2))
+
+    def test_errors(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        basis = quantumsim.bases.general(2)
+        pv = PauliVectorNumpy([basis])
+        with pytest.raises(ValueError):
+            pv.add_qubit(basis, 2)
+        with pytest.raises(ValueError):
+            pv.add_qubit(basis, np.zeros(3))
+        with pytest.raises(ValueError):
+            pv.reset(1)
+        with pytest.raises(ValueError):
+            PauliVectorNumpy([basis] * 11).add_qubit(basis)
+
+
+class TestBasisTruncation:
+    @pytest.fixture(params=['numpy', 'memmap'])
+    def make_pv(self, request, tmpdir):
+        from quantumsim.pauli_vectors import PauliVectorNumpy, \
+            PauliVectorMemmap
+        if request.param == 'numpy':
+            return PauliVectorNumpy
+        return lambda bases, pv: PauliVectorMemmap(
+            bases, pv, directory=str(tmpdir), chunk_size=16)
+
+    @staticmethod
+    def leaked_dm():
+        # Qutrit 0 has no population of the level 2, qutrit 1 does
+        rng = np.random.RandomState(42)
+        a = rng.randn(9, 9) + 1j * rng.randn(9, 9)
+        a[6:, :] = 0
+        dm = a @ a.conj().T
+        return dm / np.trace(dm)
+
+    def test_truncate(self, make_pv):
+        basis = quantumsim.bases.general(3)
+        dm = self.leaked_dm()
+        pv = make_pv([basis] * 2, quantumsim.algebra.dm_to_pv(
+            dm.reshape(3, 3, 3, 3), [basis] * 2))
+        version = pv.version
+        assert pv.truncate_bases() == approx(0, abs=1e-12)
+        assert pv.version > version
+        assert pv.dim_pauli == (4, 9)
+        assert pv.bases[0].superbasis is basis
+        assert pv.to_dm() == approx(dm)
+        assert pv.trace() == approx(1)
+
+    def test_discarded_norm(self, make_pv):
+        basis = quantumsim.bases.general(2)
+        pv_data = np.zeros((4, 4))
+        pv_data[0, 0] = 0.5
+        pv_data[1, 0] = 1e-7
+        pv_data[0, 2] = 0.3
+        pv = make_pv([basis] * 2, pv_data)
+        assert pv.truncate_bases(1e-12) == approx(1e-14)
+        assert pv.dim_pauli == (1, 2)
+        assert pv.to_pv() == approx(np.array([[0.5, 0.3]]))
+        # Nothing to truncate
+        version = pv.version
+        assert pv.truncate_bases(1e-12) == 0
+        assert pv.version == version
+
+    def test_qubits_and_batch(self):
+        from quantumsim.pauli_vectors import PauliVectorBatch
+        basis = quantumsim.bases.general(2)
+        pv_data = np.zeros((2, 4, 4))
+        pv_data[0, 0, 0] = 0.5
+        pv_data[1, 0, 3] = 0.5
+        batch = PauliVectorBatch([basis] * 2, pv_data)
+        assert batch.truncate_bases(qubits=[1]) == 0
+        assert batch.dim_pauli == (4, 2)
+        assert batch.to_pv() == approx(pv_data[:, :, [0, 3]])
+        with pytest.raises(ValueError):
+            batch.truncate_bases(qubits=[2])
+
+    def test_empty_state(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        basis = quantumsim.bases.general(2)
+        pv = PauliVectorNumpy([basis], np.zeros(4))
+        assert pv.truncate_bases() == 0
+        assert pv.dim_pauli == (1,)
+
+
+class TestSnapshots:
+    def test_branches(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        from quantumsim.models import qubits as lib
+        basis = quantumsim.bases.general(2)
+        pv = PauliVectorNumpy([basis] * 3)
+        lib.rotate_y(1.1)(pv, 0)
+        lib.cnot()(pv, 0, 1)
+        data = pv.to_pv()
+        prefix = data.copy()
+
+        snapshot = pv.snapshot()
+        assert snapshot.to_pv() is data
+        assert pv.snapshots() == [snapshot]
+        assert pv.memory_footprint().shared == data.nbytes
+
+        branches = []
+        for outcome in (0, 1):
+            branch = snapshot.snapshot()
+            branch.project(0, outcome)
+            branches.append(branch)
+        assert pv.snapshots() == [snapshot] + branches
+        assert branches[0].meas_prob(1) == approx([1, 0])
+        assert branches[1].meas_prob(1) == approx([0, 1])
+        assert branches[0].norm + branches[1].norm == approx(1)
+        assert branches[0].bases[0] != branches[1].bases[0]
+        assert pv.bases[0] == basis
+        assert pv.norm == 1.
+
+        # Parent does not overwrite the data, shared with the snapshot
+        lib.rotate_x(0.5)(pv, 2)
+        lib.rotate_x(0.5)(pv, 1)
+        lib.rotate_x(0.5)(pv, 0)
+        assert snapshot.to_pv() is data
+        assert data == approx(prefix)
+        assert pv.memory_footprint().shared == 0
+        # The only holder of the data owns it now
+        assert snapshot.memory_footprint() == (data.nbytes, 0)
+        snapshot.renormalize()
+        # The data was handed out by `to_pv`, so it is copied before an
+        # in-place change
+        assert snapshot.to_pv() is not data
+        assert data == approx(prefix)
+
+        del snapshot, branches
+        assert pv.snapshots() == []
+
+    def test_in_place_changes_copy_data(self):
+        from quantumsim.pauli_vectors import PauliVectorBatch
+        basis = quantumsim.bases.general(2)
+        data = np.zeros((2, 4))
+        data[:, 0] = [1., 2.]
+        batch = PauliVectorBatch([basis], data)
+        snapshot = batch.snapshot()
+        assert isinstance(snapshot, PauliVectorBatch)
+        snapshot.renormalize()
+        assert snapshot.trace() == approx([1, 1])
+        assert batch.trace() == approx([1, 2])
+        assert data[:, 0] == approx([1, 2])
+        assert snapshot.memory_footprint().shared == 0
+
+    def test_other_backends(self):
+        from quantumsim.pauli_vectors import PauliVectorSparse, \
+            PauliVectorMPS
+        from quantumsim.models import qubits as lib
+        basis = quantumsim.bases.general(2)
+        for cls in (PauliVectorSparse, PauliVectorMPS):
+            pv = cls([basis] * 2)
+            lib.rotate_y(1.1)(pv, 0)
+            snapshot = pv.snapshot()
+            assert isinstance(snapshot, cls)
+            lib.rotate_y(-1.1)(pv, 0)
+            assert pv.meas_prob(0) == approx([1, 0])
+            assert snapshot.meas_prob(0) == approx(
+                [np.cos(0.55)**2, np.sin(0.55)**2])
+            assert pv.snapshots() == [snapshot]
+            assert snapshot.memory_footprint().private > 0
+
+
+class TestExpectationValues:
+    @staticmethod
+    def _expected(dm, factors):
+        from functools import reduce
+        paulis = {'I': np.identity(2), 'X': np.array([[0, 1], [1, 0]]),
+                  'Y': np.array([[0, -1j], [1j, 0]]),
+                  'Z': np.array([[1, 0], [0, -1]])}
+        op = reduce(np.kron, [paulis[f] if isinstance(f, str) else f
+                              for f in factors])
+        return np.trace(dm @ op).real
+
+    @pytest.mark.parametrize('bases', [
+        [quantumsim.bases.library.twolevel_ixyz] * 3,
+        [quantumsim.bases.general(2), quantumsim.bases.gell_mann(2),
+         quantumsim.bases.general(2).subbasis([0, 1, 2])],
+    ])
+    def test_pauli_strings(self, bases):
+        from itertools import product
+        from quantumsim.pauli_vectors import PauliVectorNumpy, \
+            PauliVectorBatch
+        from quantumsim.pauli_vectors import _observables
+        from quantumsim.models import qubits as lib
+        pv = PauliVectorNumpy([quantumsim.bases.general(2)] * 3)
+        lib.rotate_y(1.)(pv, 0)
+        lib.rotate_x(0.7)(pv, 2)
+        lib.cphase()(pv, 0, 2)
+        lib.amp_damping(0.2)(pv, 1)
+        pv = PauliVectorNumpy.from_dm(pv.to_dm(), bases)
+        dm = pv.to_dm()
+
+        strings = [''.join(s) for s in product('IXYZ', repeat=3)]
+        expected = [self._expected(dm, s) for s in strings]
+        # All strings are looked up in a table, a few are contracted
+        np.testing.assert_allclose(pv.expectation_values(strings), expected,
+                                   atol=1e-12)
+        few = strings[::30]
+        assert len(few) < _observables._table_min_fraction * 4 ** 3
+        np.testing.assert_allclose(pv.expectation_values(few),
+                                   expected[::30], atol=1e-12)
+        np.testing.assert_allclose(
+            pv.expectation_values([{0: 'Z', 2: 'X'}, ['Z', None, 'X']]),
+            [self._expected(dm, 'ZIX')] * 2, atol=1e-12)
+
+        from quantumsim.pauli_vectors.pauli_vector import PauliVectorBase
+        np.testing.assert_allclose(
+            PauliVectorBase.expectation_values(pv, strings), expected,
+            atol=1e-12)
+        batch = PauliVectorBatch.from_pauli_vectors([pv, pv.copy()])
+        for observables, values in ((strings, expected),
+                                    (few, expected[::30])):
+            np.testing.assert_allclose(batch.expectation_values(observables),
+                                       [values] * 2, atol=1e-12)
+
+    def test_table_with_uneven_factors(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        from quantumsim.models import qubits as lib
+        pv = PauliVectorNumpy([quantumsim.bases.general(2)] * 2)
+        lib.rotate_y(0.4)(pv, 0)
+        lib.rotate_x(1.3)(pv, 1)
+        lib.cnot()(pv, 0, 1)
+        dm = pv.to_dm()
+        # Qubit 0 has three distinct factors, qubit 1 has two
+        strings = ['ZI', 'XI', 'ZZ', 'IZ']
+        np.testing.assert_allclose(
+            pv.expectation_values(strings),
+            [self._expected(dm, s) for s in strings], atol=1e-12)
+
+    def test_matrices(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        bases = [quantumsim.bases.general(3), quantumsim.bases.gell_mann(2)]
+        dm = random_density_matrix(6, seed=4321)
+        pv = PauliVectorNumpy.from_dm(dm, bases)
+        h3 = random_density_matrix(3, seed=11) + np.diag([1., -2., 0.])
+        h2 = np.array([[0.5, 1 - 1j], [1 + 1j, -1]])
+        observables = [[h3, 'X'], [h3, h2], [None, 'Z'], [h3, None],
+                       {1: h2}]
+        expected = [
+            np.trace(dm @ np.kron(h3, [[0, 1], [1, 0]])).real,
+            np.trace(dm @ np.kron(h3, h2)).real,
+            np.trace(dm @ np.kron(np.identity(3), np.diag([1, -1]))).real,
+            np.trace(dm @ np.kron(h3, np.identity(2))).real,
+            np.trace(dm @ np.kron(np.identity(3), h2)).real,
+        ]
+        np.testing.assert_allclose(pv.expectation_values(observables),
+                                   expected, atol=1e-12)
+        assert pv.expectation_values([]).shape == (0,)
+
+    def test_errors(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        pv = PauliVectorNumpy([quantumsim.bases.general(3),
+                               quantumsim.bases.general(2)])
+        with pytest.raises(ValueError):
+            pv.expectation_values(['ZI'])
+        with pytest.raises(ValueError):
+            pv.expectation_values(['I'])
+        with pytest.raises(ValueError):
+            pv.expectation_values([{2: 'Z'}])
+        with pytest.raises(ValueError):
+            pv.expectation_values([[None, 'W']])
+        with pytest.raises(ValueError):
+            pv.expectation_values([[None, np.array([[0, 1], [0, 0]])]])
+        with pytest.raises(ValueError):
+            pv.expectation_values([[np.identity(2), None]])
+
+
+class TestStateMetrics:
+    @staticmethod
+    def _fidelity(dm1, dm2):
+        # `scipy.linalg.sqrtm` is inaccurate for rank-deficient matrices
+        def sqrtm(dm):
+            values, vectors = np.linalg.eigh(dm)
+            return (vectors * np.sqrt(np.clip(values, 0, None))) @ \
+                vectors.conj().T
+        sqrt = sqrtm(dm1)
+        return np.trace(sqrtm(sqrt @ dm2 @ sqrt)).real ** 2
+
+    def test_overlap_and_distance(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy, \
+            PauliVectorBatch, PauliVectorSparse
+        from quantumsim.pauli_vectors.pauli_vector import PauliVectorBase
+        dm1 = random_density_matrix(12, seed=100)
+        dm2 = random_density_matrix(12, seed=200)
+        pv1 = PauliVectorNumpy.from_dm(
+            dm1, [quantumsim.bases.general(3), quantumsim.bases.general(2),
+                  quantumsim.bases.general(2)])
+        pv2 = PauliVectorNumpy.from_dm(
+            dm2, [quantumsim.bases.gell_mann(3),
+                  quantumsim.bases.library.twolevel_ixyz,
+                  quantumsim.bases.general(2)])
+        overlap = np.trace(dm1 @ dm2).real
+        distance = np.linalg.norm(dm1 - dm2)
+        assert pv1.overlap(pv2) == approx(overlap)
+        assert pv2.overlap(pv1) == approx(overlap)
+        assert PauliVectorBase.overlap(pv1, pv2) == approx(overlap)
+        assert pv1.overlap(pv1) == approx(pv1.purity())
+        assert pv1.hs_distance(pv2) == approx(distance)
+        assert pv1.hs_distance(pv1) == approx(0, abs=1e-7)
+
+        sparse = PauliVectorSparse.from_dm(dm2, pv2.bases)
+        assert pv1.overlap(sparse) == approx(overlap)
+        assert sparse.overlap(pv1) == approx(overlap)
+
+        batch = PauliVectorBatch.from_pauli_vectors([pv1, pv1.copy()])
+        assert batch.overlap(pv2) == approx([overlap] * 2)
+        assert batch.hs_distance(pv2) == approx([distance] * 2)
+
+        # Subbases are handled exactly
+        pv3 = PauliVectorNumpy(
+            [quantumsim.bases.general(3).subbasis([0, 1]),
+             quantumsim.bases.general(2).subbasis([0]),
+             quantumsim.bases.general(2).subbasis([1])],
+            np.array([0.3, 0.7]).reshape(2, 1, 1))
+        assert pv1.overlap(pv3) == approx(
+            np.trace(dm1 @ pv3.to_dm()).real)
+
+        with pytest.raises(ValueError):
+            pv1.overlap(PauliVectorNumpy([quantumsim.bases.general(2)] * 3))
+
+    def test_fidelity(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy, \
+            PauliVectorBatch
+        from quantumsim.models import qubits as lib
+        bases = [quantumsim.bases.general(2)] * 3
+        dm1 = random_density_matrix(8, seed=300)
+        dm2 = random_density_matrix(8, seed=400)
+        pv1 = PauliVectorNumpy.from_dm(dm1, bases)
+        pv2 = PauliVectorNumpy.from_dm(dm2, bases)
+        assert pv1.fidelity(pv2) == approx(self._fidelity(dm1, dm2))
+        assert pv1.fidelity(pv1) == approx(1)
+
+        reduced1 = pv1.partial_trace(2, 0).to_dm()
+        reduced2 = pv2.partial_trace(2, 0).to_dm()
+        assert pv1.fidelity(pv2, [2, 0]) == \
+            approx(self._fidelity(reduced1, reduced2))
+
+        # Pure states are compared without density matrices
+        pure = PauliVectorNumpy(bases)
+        lib.rotate_y(1.)(pure, 1)
+        psi = np.linalg.eigh(pure.to_dm())[1][:, -1]
+        pure.to_dm = None
+        assert pure.fidelity(pv2) == approx((psi.conj() @ dm2 @ psi).real)
+
+        batch = PauliVectorBatch.from_pauli_vectors([pv1, pv2])
+        assert batch.fidelity(pv2, [1]) == approx([
+            self._fidelity(pv1.partial_trace(1).to_dm(),
+                           pv2.partial_trace(1).to_dm()), 1])
+
+        with pytest.raises(ValueError):
+            pv1.fidelity(pv2, [0, 0])
+        with pytest.raises(ValueError):
+            pv1.fidelity(PauliVectorNumpy([quantumsim.bases.general(2)] * 2))
+
+
+class TestBackendRegistry:
+    def test_get(self, monkeypatch):
+        from quantumsim.pauli_vectors import registry, PauliVectorNumpy, \
+            PauliVectorSparse
+        assert registry.get('numpy') is PauliVectorNumpy
+        assert registry.get('sparse') is PauliVectorSparse
+        monkeypatch.setenv(registry.ENV_VARIABLE, 'sparse')
+        assert registry.get() is PauliVectorSparse
+        import quantumsim
+        assert quantumsim.PauliVector is PauliVectorSparse
+        assert quantumsim.pauli_vectors.Default is PauliVectorSparse
+        with pytest.raises(ValueError):
+            registry.get('nonexistent')
+
+    def test_register(self):
+        from quantumsim.pauli_vectors import registry, PauliVectorNumpy
+
+        class Custom(PauliVectorNumpy):
+            pass
+
+        registry.register('custom', Custom)
+        # Nothing is imported until the backend is requested
+        registry.register('custom_lazy', 'quantumsim_nonexistent:Backend')
+        try:
+            assert 'custom' in registry.names()
+            assert registry.get('custom') is Custom
+            with pytest.raises(ValueError):
+                registry.register('custom', PauliVectorNumpy)
+            registry.register('custom', PauliVectorNumpy, replace=True)
+            assert registry.get('custom') is PauliVectorNumpy
+            with pytest.raises(ImportError):
+                registry.get('custom_lazy')
+            with pytest.raises(ValueError):
+                registry.register('auto', Custom)
+            with pytest.raises(ValueError):
+                registry.register('custom_path', 'quantumsim.Backend')
+        finally:
+            registry.unregister('custom')
+            registry.unregister('custom_lazy')
+        assert 'custom' not in registry.names()
+
+    def test_import_is_lazy(self):
+        import os
+        import subprocess
+        import sys
+        code = ('import sys, quantumsim; '
+                'assert "pycuda" not in sys.modules; '
+                'assert "scipy" not in sys.modules; '
+                'assert "quantumsim.pauli_vectors.memmap" not in sys.modules; '
+                'assert "quantumsim.pauli_vectors.shared" not in sys.modules; '
+                'assert "quantumsim.pauli_vectors.checkpoint" '
+                'not in sys.modules; '
+                'from quantumsim.pauli_vectors import PauliVectorMemmap, '
+                'load; '
+                'assert PauliVectorMemmap.__name__ == "PauliVectorMemmap"; '
+                'assert load.__module__ == '
+                '"quantumsim.pauli_vectors.checkpoint"; '
+                'assert quantumsim.PauliVector.__name__ == '
+                '"PauliVectorNumpy"; '
+                'assert "pycuda" not in sys.modules')
+        env = dict(os.environ, QUANTUMSIM_BACKEND='numpy')
+        subprocess.run([sys.executable, '-c', code], env=env, check=True)
+
+
+class TestStructuredPTM:
+    @pytest.mark.parametrize('ptm,qubits', [
+        (np.diag(np.arange(1., 5.)), (1,)),
+        (np.diag(np.arange(1., 17.)).reshape(4, 4, 4, 4), (2, 0)),
+        (np.array([[0., 0, 0, -1], [1, 0, 0, 0], [0, 0, 1, 0],
+                   [0, 1, 0, 0]]), (1,)),
+        (np.identity(16)[::-1].reshape(4, 4, 4, 4), (0, 2)),
+    ])
+    def test_matches_dense(self, ptm, qubits):
+        from quantumsim.algebra import ptm_structure
+        from quantumsim.pauli_vectors import PauliVectorNumpy, \
+            PauliVectorBatch, PauliVectorSparse
+        rng = np.random.RandomState(42)
+        bases = [quantumsim.bases.general(2)] * 3
+        data = rng.random_sample((4, 4, 4))
+        structure = ptm_structure(ptm)
+        assert structure.kind != 'dense'
+
+        expected = PauliVectorNumpy(bases, data.copy())
+        expected.apply_ptm(ptm, *qubits)
+        pvs = [PauliVectorNumpy(bases, data.copy()),
+               PauliVectorNumpy(bases, data.astype(np.float32))]
+        if ptm.shape[0] == ptm.shape[-1]:
+            # Other backends ignore the structure
+            pvs.append(PauliVectorSparse(bases, data.copy()))
+        for pv in pvs:
+            version = pv.version
+            pv.apply_structured_ptm(ptm, structure, *qubits)
+            assert pv.version > version
+            np.testing.assert_allclose(pv.to_pv(), expected.to_pv(),
+                                       rtol=1e-6, atol=1e-6)
+        batch = PauliVectorBatch(bases, np.stack([data, 2 * data]))
+        batch.apply_structured_ptm(ptm, structure, *qubits)
+        np.testing.assert_allclose(
+            batch.to_pv(), [expected.to_pv(), 2 * expected.to_pv()])
+
+        # Shared data of snapshots is not modified
+        pv = PauliVectorNumpy(bases, data.copy())
+        snapshot = pv.snapshot()
+        pv.apply_structured_ptm(ptm, structure, *qubits)
+        np.testing.assert_allclose(snapshot.to_pv(), data)
+
+    @pytest.mark.parametrize('gate,qubits', [
+        ('hadamard', (1,)), ('cnot', (0, 1)), ('cnot', (2, 1)),
+        ('cnot', (2, 0)), ('cphase', (0, 2)),
+    ])
+    def test_clifford(self, gate, qubits):
+        from quantumsim.pauli_vectors import PauliVectorNumpy, \
+            PauliVectorBatch
+        from quantumsim.models import qubits as lib
+        ixyz = quantumsim.bases.library.twolevel_ixyz
+        bases = [ixyz] * 3
+        op = getattr(lib, gate)()
+        op = op.set_bases((ixyz,) * op.num_qubits, (ixyz,) * op.num_qubits)
+        assert op._structure.kind == 'permutation'
+        data = np.random.RandomState(45).random_sample((4, 4, 4))
+        expected = PauliVectorNumpy(bases, data.copy())
+        expected.apply_ptm(op.ptm((ixyz,) * op.num_qubits), *qubits)
+        for dtype in (np.float64, np.float32):
+            pv = PauliVectorNumpy(bases, data.astype(dtype))
+            op(pv, *qubits)
+            np.testing.assert_allclose(pv.to_pv(), expected.to_pv(),
+                                       rtol=1e-6, atol=1e-6)
+        batch = PauliVectorBatch(bases, np.stack([data, -data]))
+        op(batch, *qubits)
+        np.testing.assert_allclose(
+            batch.to_pv(), [expected.to_pv(), -expected.to_pv()],
+            atol=1e-12)
+
+    def test_dense(self):
+        from quantumsim.algebra import ptm_structure
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        from quantumsim.models import qubits as lib
+        # Block-diagonal and sparse PTMs are applied as dense ones
+        for ptm in (np.diag(np.full(9, 0.5)) + np.diag(np.full(8, 0.25), 1),
+                    np.array([[1., 0, 0, 0], [0, 1., 0, 0], [0, 0, 0, 0.3]])):
+            structure = ptm_structure(ptm)
+            assert structure.kind == 'dense'
+            bases = [quantumsim.bases.general(int(np.sqrt(ptm.shape[1])))] * 2
+            data = np.random.RandomState(43).random_sample(
+                (ptm.shape[1],) * 2)
+            pv = PauliVectorNumpy(bases, data)
+            pv.apply_structured_ptm(ptm, structure, 1)
+            np.testing.assert_allclose(pv.to_pv(), data @ ptm.T)
+
+        # Structure is detected, when an operation is applied
+        op = lib.rotate_z(0.4).set_bases((quantumsim.bases.general(2),) * 1)
+        assert not op._structure_detected
+        op(PauliVectorNumpy([quantumsim.bases.general(2)]), 0)
+        assert op._structure_detected
+
+    def test_operations(self):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        from quantumsim.models import qubits as lib
+        bases = [quantumsim.bases.library.twolevel_ixyz,
+                 quantumsim.bases.general(2)]
+        dm = random_density_matrix(4, seed=44)
+        pv = PauliVectorNumpy.from_dm(dm, bases)
+        for op in (lib.phase_damping(0.1), lib.rotate_z(0.4)):
+            op.set_bases((bases[0],), (bases[0],))(pv, 0)
+            op(pv, 1)
+        expected = PauliVectorNumpy.from_dm(dm, bases)
+        for op in (lib.phase_damping(0.1), lib.rotate_z(0.4)):
+            expected.apply_ptm(op.ptm((bases[0],)), 0)
+            expected.apply_ptm(op.ptm((bases[1],)), 1)
+        np.testing.assert_allclose(pv.to_pv(), expected.to_pv(), atol=1e-12)
+
+        # Conversions to the bases of states are reused
+        op = lib.cnot()
+        assert op.set_bases((bases[0],) * 2) is op.set_bases((bases[0],) * 2)
+
+    def test_library_gates_use_kernels(self, monkeypatch):
+        from quantumsim.pauli_vectors import PauliVectorNumpy
+        from quantumsim.pauli_vectors import numpy as pv_numpy
+        from quantumsim.models import qubits as lib
+        ixyz = quantumsim.bases.library.twolevel_ixyz
+        calls = []
+        apply_permutation = pv_numpy._apply_permutation
+
+        def spy(permutation, data, out, axes, *args):
+            calls.append(axes)
+            apply_permutation(permutation, data, out, axes, *args)
+
+        monkeypatch.setattr(pv_numpy, '_apply_permutation', spy)
+        dm = random_density_matrix(8, seed=46)
+        pv = PauliVectorNumpy.from_dm(dm, [ixyz] * 3)
+        expected = PauliVectorNumpy.from_dm(
+            dm, [quantumsim.bases.general(2)] * 3)
+        for op, qubits in ((lib.hadamard(), (0,)), (lib.cnot(), (0, 2)),
+                           (lib.rotate_x(0.3), (1,))):
+            op(pv, *qubits)
+            op(expected, *qubits)
+        # Output bases are converted too, so the state stays in the
+        # `twolevel_ixyz` basis, where Clifford gates are permutations
+        assert pv.bases == [ixyz] * 3
+        assert calls == [(0,), (0, 2)]
+        np.testing.assert_allclose(pv.to_dm(), expected.to_dm(), atol=1e-12)
+
+    @pytest.mark.parametrize('gate,qubits', [
+        ('hadamard', (2,)), ('cnot', (1, 2)), ('cnot', (2, 1)),
+    ])
+    def test_trailing_permutation_is_dense(self, gate, qubits, monkeypatch):
+        from quantumsim.algebra import ptm_structure
+        from quantumsim.pauli_vectors import PauliVectorNumpy, \
+            PauliVectorBatch
+        from quantumsim.pauli_vectors import numpy as pv_numpy
+        from quantumsim.models import qubits as lib
+        ixyz = quantumsim.bases.library.twolevel_ixyz
+        calls = []
+        monkeypatch.setattr(pv_numpy, '_apply_permutation',
+                            lambda *args: calls.append(args))
+        ptm = getattr(lib, gate)().ptm((ixyz,) * len(qubits))
+        structure = ptm_structure(ptm)
+        assert structure.kind == 'permutation'
+        data = np.random.RandomState(47).random_sample((4, 4, 4))
+        expected = PauliVectorNumpy([ixyz] * 3, data.copy())
+        expected.apply_ptm(ptm, *qubits)
+        pv = PauliVectorNumpy([ixyz] * 3, data.copy())
+        pv.apply_structured_ptm(ptm, structure, *qubits)
+        np.testing.assert_allclose(pv.to_pv(), expected.to_pv(), atol=1e-12)
+        batch = PauliVectorBatch([ixyz] * 3, np.stack([data, -data]))
+        batch.apply_structured_ptm(ptm, structure, *qubits)
+        np.testing.assert_allclose(
+            batch.to_pv(), [expected.to_pv(), -expected.to_pv()],
+            atol=1e-12)
+        assert calls == []
+
+    def test_conversions_cache(self):
+        from quantumsim.models import qubits as lib
+        op = lib.hadamard()
+        op._converted_max = 2
+        ixyz = (quantumsim.bases.library.twolevel_ixyz,)
+        gell_mann = (quantumsim.bases.gell_mann(2),)
+        general = (quantumsim.bases.general(2).subbasis([0, 1, 3, 2]),)
+        op_ixyz = op.set_bases(ixyz, ixyz)
+        op_gell_mann = op.set_bases(gell_mann, gell_mann)
+        # The least recently used conversion is evicted
+        assert op.set_bases(ixyz, ixyz) is op_ixyz
+        op.set_bases(general, general)
+        assert op.set_bases(ixyz, ixyz) is op_ixyz
+        assert op.set_bases(gell_mann, gell_mann) is not op_gell_mann
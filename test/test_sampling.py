@@ -0,0 +1,88 @@
+# This file is part of quantumsim. (https://gitlab.com/quantumsim/quantumsim)
+# (c) 2018 Quantumsim Authors
+# Distributed under the GNU GPLv3. See LICENSE.txt or
+# https://www.gnu.org/licenses/gpl.txt
+
+import pytest
+import numpy as np
+
+from quantumsim import bases
+from quantumsim.models import qubits as lib
+from quantumsim.pauli_vectors import PauliVectorNumpy, Sampler, \
+    sample_sequential
+
+
+@pytest.fixture
+def state():
+    # Qubit 0 is in a superposition, qubit 1 copies it, qubit 2 is excited
+    # with probability 0.2 independently
+    pv = PauliVectorNumpy([bases.general(2)] * 3)
+    lib.rotate_y(2 * np.arcsin(np.sqrt(0.3)))(pv, 0)
+    lib.cnot()(pv, 0, 1)
+    lib.rotate_y(2 * np.arcsin(np.sqrt(0.2)))(pv, 2)
+    return pv
+
+
+class TestSampler:
+    def test_outcomes(self, state):
+        sampler = Sampler(state)
+        assert sampler.probs.reshape(2, 2, 2) == pytest.approx(
+            state.diagonal().reshape(2, 2, 2))
+        shots = sampler.sample(20000, np.random.default_rng(42))
+        assert shots.shape == (20000, 3)
+        assert shots.dtype == np.uint8
+        assert np.all(shots[:, 0] == shots[:, 1])
+        assert np.mean(shots, axis=0) == pytest.approx([0.3, 0.3, 0.2],
+                                                       abs=0.02)
+        # Seeded generators reproduce the shots
+        assert np.array_equal(sampler.sample(100, 7), sampler.sample(100, 7))
+
+    def test_packed_and_counts(self, state):
+        sampler = Sampler(state, qubits=(2, 0))
+        assert sampler.dims == (2, 2)
+        shots = sampler.sample(1000, 1)
+        packed = sampler.sample(1000, 1, output='packed')
+        assert packed.shape == (1000, 1)
+        assert np.array_equal(np.unpackbits(packed, axis=1)[:, :2], shots)
+
+        counts = sampler.sample(100000, np.random.RandomState(3),
+                                output='counts')
+        assert counts.shape == (2, 2)
+        assert np.sum(counts) == 100000
+        assert counts / 100000 == pytest.approx(np.array(
+            [[0.8 * 0.7, 0.8 * 0.3], [0.2 * 0.7, 0.2 * 0.3]]), abs=0.01)
+
+    def test_errors(self, state):
+        sampler = Sampler(state)
+        with pytest.raises(ValueError):
+            sampler.sample(10, output='histogram')
+        qutrit = PauliVectorNumpy([bases.general(3)])
+        with pytest.raises(ValueError):
+            Sampler(qutrit).sample(10, output='packed')
+        with pytest.raises(ValueError):
+            Sampler(PauliVectorNumpy([bases.general(2)],
+                                     np.zeros(4)))
+
+
+class TestSequentialSampling:
+    def test_matches_distribution(self, state):
+        shots = sample_sequential(state, 20000, rng=11)
+        assert shots.shape == (20000, 3)
+        assert np.all(shots[:, 0] == shots[:, 1])
+        assert np.mean(shots, axis=0) == pytest.approx([0.3, 0.3, 0.2],
+                                                       abs=0.02)
+        # Original state is not changed
+        assert state.to_pv().shape == (4, 4, 4)
+        assert state.trace() == pytest.approx(1)
+
+    def test_subset_and_formats(self, state):
+        counts = sample_sequential(state, 50000, (1, 2), rng=5,
+                                   output='counts')
+        assert np.sum(counts) == 50000
+        assert counts / 50000 == pytest.approx(np.array(
+            [[0.7 * 0.8, 0.7 * 0.2], [0.3 * 0.8, 0.3 * 0.2]]), abs=0.01)
+        shots = sample_sequential(state, 100, (1, 0), rng=5)
+        packed = sample_sequential(state, 100, (1, 0), rng=5,
+                                   output='packed')
+        assert np.array_equal(np.unpackbits(packed, axis=1)[:, :2], shots)
+        assert np.all(shots[:, 0] == shots[:, 1])